@@ -5,4 +5,5 @@ if __name__ == "__main__":
   user_data = UserData("John Doe", "1970-01-01", "Male", "Caucasian", None)
   llm_instance.start(user_data, "default")
   response=llm_instance.generate_response("Who was the 10th president of the United States of America?")
-  print(response)
\ No newline at end of file
+  print(response)
+  llm_instance.stop()
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""Offline backfill throughput (messages per second) against replaying logs through check_for_memories.
+
+Writes --sessions synthetic chat logs (the usual three pinned messages, then --messages turns drawn
+from a small pool, so some of them repeat across sessions like real chatter does). "before" is the
+only way to backfill there was: read every log and call MemoryInstance.check_for_memories once per
+message. "after" is llmimic.backfill with duplicates skipped, large analyzer batches, bulk writes and
+--workers processes (0 runs inline; worker start-up and model loading count against it).
+The analyzers are the stand-ins from benchmarks.memory_pipeline; summarization is left out because
+the old path never did it.
+
+Run from src/:
+  python -m benchmarks.backfill --sessions 40 --messages 24 --workers 0 2
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from llmimic.backfill import backfill, find_chat_logs
+from llmimic.chat_log import ChatLog
+from llmimic.memory import MemoryInstance
+from .memory_pipeline import MESSAGES, build_registry, build_tokenizer
+
+def standin_registry():
+  """The stand-in analyzers (a module-level function, so worker processes can build their own)."""
+  return build_registry(build_tokenizer())
+
+def write_logs(log_dir: str, sessions: int, messages: int, seed: int = 0) -> None:
+  rng = random.Random(seed)
+  for session in range(sessions):
+    log = ChatLog(os.path.join(log_dir, f"chat_2026-01-01_00-00-{session:02d}.jsonl"))
+    log.start_session({"id": f"session-{session}", "date-time": f"2026-01-01_00-00-{session % 60:02d}", "user_data": {}})
+    for message_id, (role, content) in enumerate([("system", "You are a helpful companion."), ("user", "I am John."),
+                                                  ("assistant", "Hi John!")]):
+      log.append({"role": role, "content": content}, message_id)
+    for message_id in range(3, 3 + messages):
+      content = f"{rng.choice(MESSAGES)} {rng.choice(MESSAGES)}" if rng.random() < 0.8 else rng.choice(MESSAGES)
+      log.append({"role": "user" if message_id % 2 else "assistant", "content": content}, message_id)
+    log.close()
+
+def run_before(log_dir: str, memory_dir: str) -> float:
+  instance = MemoryInstance(memory_dir, registry=standin_registry(), async_processing=False)
+  instance.check_for_memories("user", MESSAGES[0])  # Warm-up.
+  count = 0
+  start = time.perf_counter()
+  for path in find_chat_logs([log_dir]):
+    for entry in ChatLog.read(path)["messages"][3:]:
+      instance.check_for_memories(entry["message"]["role"], entry["message"]["content"])
+      count += 1
+  elapsed = time.perf_counter() - start
+  instance.close()
+  return count / elapsed
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--sessions", type=int, default=40, help="Chat logs to backfill.")
+  parser.add_argument("--messages", type=int, default=24, help="Messages per chat log after the pinned ones.")
+  parser.add_argument("--workers", type=int, nargs="+", default=[0, 2], help="Worker processes for the backfill runs.")
+  parser.add_argument("--chunk-size", type=int, default=128, help="New messages per chunk.")
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    log_dir = os.path.join(tmp_dir, "chat_logs")
+    os.makedirs(log_dir)
+    write_logs(log_dir, args.sessions, args.messages)
+    before = run_before(log_dir, os.path.join(tmp_dir, "before"))
+    print(f"{'run':<12} {'messages/s':>11} {'analyzed':>9} {'speedup':>8}")
+    print(f"{'before':<12} {before:>11.1f} {args.sessions * args.messages:>9} {1:>7.2f}x")
+    for workers in args.workers:
+      stats = backfill([log_dir], os.path.join(tmp_dir, f"after_{workers}"), workers=workers, chunk_size=args.chunk_size,
+                       summarize=False, registry_factory=standin_registry)
+      rate = stats["messages_per_second"]
+      print(f"{f'workers={workers}':<12} {rate:>11.1f} {stats['analyzed']:>9} {rate / before:>7.2f}x")
+
+if __name__ == "__main__":
+  main()
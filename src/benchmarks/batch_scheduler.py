@@ -0,0 +1,89 @@
+"""Aggregate generation throughput under concurrent load, with and without dynamic batching, on CPU.
+
+Uses a small randomly initialised Llama built from a config (nothing is downloaded). A number of
+client threads each send a stream of requests, like users chatting at the same time. "sequential"
+runs them one at a time on the shared model (what N separate LLMInstances queueing on one device
+amounts to), the other rows go through BatchScheduler with different max batch sizes.
+
+Run from src/:
+  python -m benchmarks.batch_scheduler --clients 16 --requests 4 --batch-sizes 1 4 8 16
+"""
+import argparse
+import random
+import threading
+import time
+import torch
+from llmimic.session_manager import BatchScheduler
+from .prefix_cache import build_tiny_llama
+
+class _PadTokenizer:
+  """The scheduler only needs the pad/eos IDs from the tokenizer."""
+  pad_token_id = 0
+  eos_token_id = 2
+
+def run_clients(clients: int, requests: int, prompt_tokens: int, send) -> tuple:
+  """Runs the client threads and times them.
+
+  Args:
+    clients (int): Concurrent clients.
+    requests (int): Requests each client sends, one after the other.
+    prompt_tokens (int): Mean prompt length.
+    send (Callable[[list], list]): Generates for one prompt, returns the new token IDs.
+
+  Returns:
+    tuple: (elapsed seconds, generated tokens)
+  """
+  generated = [0] * clients
+
+  def client(index: int) -> None:
+    rng = random.Random(index)
+    for _ in range(requests):
+      length = rng.randint(prompt_tokens // 2, prompt_tokens * 3 // 2)
+      generated[index] += len(send([rng.randrange(3, 2000) for _ in range(length)]))
+
+  threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+  start = time.perf_counter()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return time.perf_counter() - start, sum(generated)
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--clients", type=int, default=16, help="Concurrent clients.")
+  parser.add_argument("--requests", type=int, default=4, help="Requests per client.")
+  parser.add_argument("--prompt-tokens", type=int, default=200, help="Mean prompt length.")
+  parser.add_argument("--reply-tokens", type=int, default=32, help="Tokens generated per reply.")
+  parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16], help="max_batch_size values to try.")
+  parser.add_argument("--max-wait", type=float, default=0.02, help="Scheduler max_wait in seconds.")
+  args = parser.parse_args()
+
+  model = build_tiny_llama(2000, args.prompt_tokens * 2 + args.reply_tokens + 8)
+  # min_new_tokens keeps the amount of work the same for every row despite the random weights.
+  generate_kwargs = {"do_sample": False, "max_new_tokens": args.reply_tokens, "min_new_tokens": args.reply_tokens}
+  model_lock = threading.Lock()
+
+  def sequential(input_ids: list) -> list:
+    input_tensor = torch.tensor([input_ids])
+    with model_lock, torch.inference_mode():
+      output = model.generate(input_ids=input_tensor, attention_mask=torch.ones_like(input_tensor), pad_token_id=0, **generate_kwargs)
+    return output[0, len(input_ids):].tolist()
+
+  print(f"{args.clients} clients x {args.requests} requests, ~{args.prompt_tokens} prompt tokens, {args.reply_tokens} reply tokens")
+  print(f"{'mode':>12} {'elapsed':>9} {'tokens/s':>9} {'mean batch':>11}")
+  elapsed, tokens = run_clients(args.clients, args.requests, args.prompt_tokens, sequential)
+  baseline = tokens / elapsed
+  print(f"{'sequential':>12} {elapsed:>8.2f}s {baseline:>9.1f} {1.0:>11.1f}")
+
+  for batch_size in args.batch_sizes:
+    scheduler = BatchScheduler(model, _PadTokenizer(), max_batch_size=batch_size, max_wait=args.max_wait)
+    elapsed, tokens = run_clients(args.clients, args.requests, args.prompt_tokens,
+                                  lambda input_ids: scheduler.submit(input_ids, **generate_kwargs).result())
+    metrics = scheduler.metrics()
+    scheduler.close()
+    print(f"{f'batch<={batch_size}':>12} {elapsed:>8.2f}s {tokens / elapsed:>9.1f} {metrics['mean_batch_size']:>11.1f}"
+          f"  ({tokens / elapsed / baseline:.1f}x)")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,96 @@
+"""Chess games per hour on CPU: many games against one model, with and without ChessService.
+
+Every game is the AI against a random mover, capped at --max-plies. "engine" is how games ran before:
+each ChessInstance picks its moves with its own MoveEngine (constrained decoding, the full prompt
+tokenized and prefilled every move), games running in --concurrency threads on the shared model.
+"service" plays the same games through one ChessService, which batches the AI moves of all running
+games into shared forward passes and keeps each game's KV cache between moves. The model is the
+stand-in from benchmarks.chess_moves, so nothing is downloaded.
+
+Run from src/:
+  python -m benchmarks.chess_games --games 32 --concurrency 16
+"""
+import argparse
+import contextlib
+import io
+import logging
+import random
+import threading
+import time
+import torch
+from llmimic import logger
+from llmimic.chess import ChessInstance, ChessService
+from .chess_moves import build_standin
+
+def play(instance: ChessInstance, seed: int, max_plies: int) -> int:
+  """Plays a game with the AI as white against a random mover.
+
+  Returns:
+    int: The number of plies played.
+  """
+  rng = random.Random(seed)
+  while not instance.board.is_game_over() and len(instance.moves_uci) < max_plies:
+    if len(instance.moves_uci) % 2 == 0:
+      instance.prompt_ai_move()
+    else:
+      instance.submit_player_move(rng.choice(list(instance.board.legal_moves)).uci())
+  instance.close()
+  return len(instance.moves_uci)
+
+def run(model, tokenizer, mode: str, games: int, concurrency: int, max_plies: int, level: str) -> dict:
+  service = ChessService(model, tokenizer, max_batch_size=concurrency) if mode == "service" else None
+  seeds = list(range(games))
+  plies = []
+  lock = threading.Lock()
+
+  def worker():
+    while True:
+      with lock:
+        if not seeds:
+          return
+        seed = seeds.pop()
+      instance = ChessInstance(level, model=model, tokenizer=tokenizer, service=service)
+      played = play(instance, seed, max_plies)
+      with lock:
+        plies.append(played)
+
+  torch.manual_seed(0)
+  # The game prints a line per move; send it nowhere so the terminal isn't what gets measured.
+  with contextlib.redirect_stdout(io.StringIO()):
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    elapsed = time.perf_counter() - start
+  result = {"games_per_hour": games / elapsed * 3600, "ai_moves_per_second": sum((p + 1) // 2 for p in plies) / elapsed}
+  if service is not None:
+    metrics = service.metrics()
+    service.close()
+    result["mean_batch_size"] = metrics["mean_batch_size"]
+    result["reused"] = metrics["reused_tokens"] / max(metrics["reused_tokens"] + metrics["prefilled_tokens"], 1)
+  return result
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--games", type=int, default=32, help="Games per mode.")
+  parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16], help="Games running at once.")
+  parser.add_argument("--max-plies", type=int, default=80, help="Plies after which a game is stopped.")
+  parser.add_argument("--level", default="normal", help="The AI's difficulty level.")
+  parser.add_argument("--train-steps", type=int, default=300, help="Training steps for the stand-in model.")
+  args = parser.parse_args()
+
+  logger.setLevel(logging.WARNING)  # Per-move INFO lines would otherwise dominate the timing.
+  model, tokenizer = build_standin(args.train_steps)
+  print(f"{'concurrency':>11} {'mode':<8} {'games/hour':>11} {'AI moves/s':>11} {'batch':>6} {'reused':>7}")
+  for concurrency in args.concurrency:
+    for mode in ("engine", "service"):
+      result = run(model, tokenizer, mode, args.games, concurrency, args.max_plies, args.level)
+      batch = f"{result['mean_batch_size']:>6.1f}" if "mean_batch_size" in result else f"{'-':>6}"
+      reused = f"{result['reused']:>6.0%}" if "reused" in result else f"{'-':>6}"
+      print(f"{concurrency:>11} {mode:<8} {result['games_per_hour']:>11.0f} {result['ai_moves_per_second']:>11.1f} "
+            f"{batch} {reused:>7}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,143 @@
+"""Chess move generation: moves per second and forward passes per move, by difficulty level.
+
+"sequential" is how ChessInstance used to pick moves: one sampled generate() call per attempt until a
+legal move comes out or `retries` runs out. "batched" and "constrained" are MoveEngine's strategies.
+The model is a small Llama stand-in for lazy-guy12/chess-llama with a square-level WordPiece tokenizer
+("e2e4" is "e2" "##e4", so moves take several tokens), trained for --train-steps on random legal games
+so that it knows the format; nothing is downloaded. "fails" counts moves that came back as "0000".
+
+Run from src/:
+  python -m benchmarks.chess_moves --positions 40 --levels very_easy normal hard
+"""
+import argparse
+import random
+import time
+import chess
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+from llmimic.chess import ChessInstance, MoveEngine
+
+def build_tokenizer() -> PreTrainedTokenizerFast:
+  squares = [chess.square_name(square) for square in chess.SQUARES]
+  vocab_list = ["<pad>", "<s>", "</s>", "<unk>", "1-0"] + squares + ["##" + square for square in squares]
+  vocab_list += ["##" + piece for piece in "qrbn"]
+  backend = Tokenizer(models.WordPiece({token: i for i, token in enumerate(vocab_list)}, unk_token="<unk>"))
+  backend.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+  backend.decoder = decoders.WordPiece()
+  return PreTrainedTokenizerFast(tokenizer_object=backend, bos_token="<s>", eos_token="</s>", pad_token="<pad>",
+                                 unk_token="<unk>")
+
+def random_game(rng: random.Random, max_moves: int = 60) -> list:
+  board = chess.Board()
+  moves = []
+  while not board.is_game_over() and len(moves) < max_moves:
+    move = rng.choice(list(board.legal_moves))
+    board.push(move)
+    moves.append(move.uci())
+  return moves
+
+def build_standin(train_steps: int = 300, seed: int = 0) -> tuple:
+  """A small chess Llama, trained on random legal games.
+
+  Returns:
+    tuple: (model, tokenizer)
+  """
+  tokenizer = build_tokenizer()
+  torch.manual_seed(seed)
+  config = LlamaConfig(vocab_size=len(tokenizer), hidden_size=128, intermediate_size=256, num_hidden_layers=4,
+                       num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=512,
+                       pad_token_id=tokenizer.pad_token_id, bos_token_id=tokenizer.bos_token_id,
+                       eos_token_id=tokenizer.eos_token_id)
+  model = LlamaForCausalLM(config)
+  rng = random.Random(seed)
+  optimizer = torch.optim.AdamW(model.parameters(), lr=3e-3)
+  model.train()
+  for _ in range(train_steps):
+    batch = tokenizer([MoveEngine.build_prompt(random_game(rng)) for _ in range(16)], padding=True, return_tensors="pt")
+    labels = batch["input_ids"].masked_fill(batch["attention_mask"] == 0, -100)
+    loss = model(**batch, labels=labels).loss
+    loss.backward()
+    optimizer.step()
+    optimizer.zero_grad()
+  model.eval()
+  return model, tokenizer
+
+def legacy_move(game: ChessInstance) -> tuple:
+  """ChessInstance._play_llama as it used to be: one sample per generate() call.
+
+  Returns:
+    tuple: (move, forward passes)
+  """
+  inputs = game.tokenizer(MoveEngine.build_prompt(game.moves_uci), return_tensors="pt")
+  params = game.get_difficulty_params()
+  passes = 0
+  for _ in range(params["retries"]):
+    generated = game.model.generate(input_ids=inputs["input_ids"], max_new_tokens=5, do_sample=True,
+                                    top_k=params["top_k"], temperature=params["temperature"],
+                                    pad_token_id=game.tokenizer.pad_token_id)
+    passes += generated.shape[1] - inputs["input_ids"].shape[1]
+    words = game.tokenizer.decode(generated[0], skip_special_tokens=True).split()
+    move_index = len(game.moves_uci) + 1
+    move = words[move_index] if len(words) > move_index else ""
+    try:
+      if game.board.is_legal(chess.Move.from_uci(move)):
+        return move, passes
+    except ValueError:
+      pass
+  return "0000", passes
+
+def positions(count: int, seed: int = 1) -> list:
+  """Move lists of random positions a few to forty plies into a game."""
+  rng = random.Random(seed)
+  result = []
+  while len(result) < count:
+    moves = random_game(rng, max_moves=rng.randint(2, 40))
+    board = chess.Board()
+    for move in moves:
+      board.push_uci(move)
+    if not board.is_game_over():
+      result.append(moves)
+  return result
+
+def run(model, tokenizer, level: str, strategy: str, games: list) -> dict:
+  instance = ChessInstance(level, model=model, tokenizer=tokenizer,
+                           move_strategy="batched" if strategy == "sequential" else strategy)
+  passes = fails = 0
+  start = time.perf_counter()
+  for moves in games:
+    instance.board = chess.Board()
+    for move in moves:
+      instance.board.push_uci(move)
+    instance.moves_uci = list(moves)
+    if strategy == "sequential":
+      move, used = legacy_move(instance)
+    else:
+      move = instance._play_llama()
+      used = instance.move_engine.last_forward_passes
+    passes += used
+    fails += move == "0000"
+  elapsed = time.perf_counter() - start
+  return {"moves_per_second": len(games) / elapsed, "passes": passes / len(games), "fails": fails}
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--positions", type=int, default=40, help="Positions to pick a move in, per level and strategy.")
+  parser.add_argument("--levels", nargs="+", default=["very_easy", "easy", "normal", "intermediate", "hard"])
+  parser.add_argument("--strategies", nargs="+", default=["sequential", "batched", "constrained"],
+                      choices=["sequential", "batched", "constrained"])
+  parser.add_argument("--train-steps", type=int, default=300, help="Training steps for the stand-in model.")
+  args = parser.parse_args()
+
+  model, tokenizer = build_standin(args.train_steps)
+  games = positions(args.positions)
+  print(f"{'level':<13} {'strategy':<12} {'moves/s':>8} {'passes/move':>12} {'fails':>6}")
+  for level in args.levels:
+    for strategy in args.strategies:
+      torch.manual_seed(0)
+      result = run(model, tokenizer, level, strategy, games)
+      print(f"{level:<13} {strategy:<12} {result['moves_per_second']:>8.1f} {result['passes']:>12.2f} "
+            f"{result['fails']:>6}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,294 @@
+"""Chess self-play: how strong each difficulty level plays and what its moves cost.
+
+Every level in --levels plays --games games against every opponent in --opponents, alternating colours,
+spread over --processes worker processes. Opponents:
+  random        a random legal move.
+  engine        a local stand-in engine: material-only alpha-beta search to --engine-depth plies, or a
+                UCI engine (e.g. Stockfish) at that depth if --uci-engine is given.
+  level:<name>  the chess LLM at another difficulty level.
+A game ends on checkmate/stalemate/draw rules, an illegal AI move (a loss for that side) or after
+--max-plies, which counts as a draw. Each game is a row in a Parquet file (--output): level, opponent,
+colour, result, termination, length, final material balance, and per-move lists for the AI side of
+latency, candidates tried (the "retries" used, always 1 in constrained mode) and forward passes.
+The report aggregates strength (score, Elo difference against the opponent) next to cost (latency and
+retries per move) for every level, and can be rerun on an existing file with --report.
+
+The model is lazy-guy12/chess-llama from the shared registry; --standin uses the small model trained
+by benchmarks.chess_moves instead, so it runs offline.
+
+Run from src/:
+  python -m benchmarks.chess_selfplay --games 20 --opponents random engine --processes 4
+  python -m benchmarks.chess_selfplay --report selfplay.parquet
+"""
+import argparse
+import contextlib
+import io
+import logging
+import math
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import chess
+import chess.engine
+import torch
+from llmimic import logger
+from llmimic.chess import ChessInstance
+
+LEVELS = ["very_easy", "easy", "normal", "intermediate", "hard"]
+PIECE_VALUES = {chess.PAWN: 1, chess.KNIGHT: 3, chess.BISHOP: 3, chess.ROOK: 5, chess.QUEEN: 9, chess.KING: 0}
+MATE_SCORE = 1000
+
+def material(board: chess.Board, color: chess.Color) -> int:
+  """Material balance from color's point of view, in pawns."""
+  balance = 0
+  for piece in board.piece_map().values():
+    value = PIECE_VALUES[piece.piece_type]
+    balance += value if piece.color == color else -value
+  return balance
+
+def _search(board: chess.Board, depth: int, alpha: int, beta: int) -> int:
+  if board.is_checkmate():
+    return -MATE_SCORE - depth
+  if depth == 0 or board.is_game_over():
+    return material(board, board.turn)
+  # Captures first, so the cut-offs come early.
+  for move in sorted(board.legal_moves, key=lambda move: not board.is_capture(move)):
+    board.push(move)
+    score = -_search(board, depth - 1, -beta, -alpha)
+    board.pop()
+    if score >= beta:
+      return beta
+    alpha = max(alpha, score)
+  return alpha
+
+def search_move(board: chess.Board, depth: int, rng: random.Random) -> str:
+  """The stand-in engine: the best move by material after depth plies, ties broken at random."""
+  best_score, best_moves = None, []
+  moves = list(board.legal_moves)
+  rng.shuffle(moves)
+  for move in moves:
+    board.push(move)
+    score = -_search(board, depth - 1, -MATE_SCORE * 2, MATE_SCORE * 2)
+    board.pop()
+    if best_score is None or score > best_score:
+      best_score, best_moves = score, [move]
+    elif score == best_score:
+      best_moves.append(move)
+  return rng.choice(best_moves).uci()
+
+# Per worker process, set up by _init_worker.
+_worker = {}
+
+def _init_worker(model_dir, strategy: str, threads: int, uci_engine, engine_depth: int) -> None:
+  logger.setLevel(logging.WARNING)  # Per-move INFO lines would otherwise dominate the timing.
+  torch.set_num_threads(threads)
+  model = tokenizer = None
+  if model_dir is not None:
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from transformers.utils import logging as transformers_logging
+    transformers_logging.disable_progress_bar()
+    model = AutoModelForCausalLM.from_pretrained(model_dir).eval()
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+  engine = None
+  if uci_engine is not None:
+    engine = chess.engine.SimpleEngine.popen_uci(uci_engine)
+  _worker.update(model=model, tokenizer=tokenizer, strategy=strategy, engine=engine, engine_depth=engine_depth)
+
+def _instance(level: str) -> ChessInstance:
+  return ChessInstance(level, model=_worker["model"], tokenizer=_worker["tokenizer"], move_strategy=_worker["strategy"])
+
+def _opponent_move(opponent: str, board: chess.Board, rival, rng: random.Random):
+  """The opponent's move, or None if it came up with an illegal one."""
+  if rival is not None:
+    success, move = rival.prompt_ai_move()
+    return move if success else None
+  if opponent == "random":
+    return rng.choice(list(board.legal_moves)).uci()
+  if _worker["engine"] is not None:
+    return _worker["engine"].play(board, chess.engine.Limit(depth=_worker["engine_depth"])).move.uci()
+  return search_move(board, _worker["engine_depth"], rng)
+
+def play_game(level: str, opponent: str, ai_white: bool, seed: int, max_plies: int) -> dict:
+  """Plays one game of the AI at `level` against `opponent`.
+
+  Returns:
+    dict: One row of the results file.
+  """
+  rng = random.Random(seed)
+  torch.manual_seed(seed)
+  ai = _instance(level)
+  rival = _instance(opponent.split(":", 1)[1]) if opponent.startswith("level:") else None
+  board = ai.board
+  latencies, candidates, passes = [], [], []
+  score = 0.5
+  with contextlib.redirect_stdout(io.StringIO()):
+    while True:
+      if board.is_game_over(claim_draw=True):
+        outcome = board.outcome(claim_draw=True)
+        termination = outcome.termination.name.lower()
+        if outcome.winner is not None:
+          score = 1.0 if outcome.winner == ai_white else 0.0
+        break
+      if len(ai.moves_uci) >= max_plies:
+        termination = "max_plies"
+        break
+      if board.turn == ai_white:
+        start = time.perf_counter()
+        success, move = ai.prompt_ai_move()
+        latencies.append((time.perf_counter() - start) * 1000)
+        candidates.append(ai.move_engine.last_candidates)
+        passes.append(ai.move_engine.last_forward_passes)
+        if not success:
+          termination, score = "illegal_move", 0.0
+          break
+        if rival is not None:
+          rival.submit_player_move(move)
+      else:
+        move = _opponent_move(opponent, board, rival, rng)
+        if move is None:
+          termination, score = "opponent_illegal_move", 1.0
+          break
+        ai.submit_player_move(move)
+  return {
+    "level": level,
+    "opponent": opponent,
+    "ai_color": "white" if ai_white else "black",
+    "seed": seed,
+    "result": {1.0: "win", 0.5: "draw", 0.0: "loss"}[score],
+    "score": score,
+    "termination": termination,
+    "plies": len(ai.moves_uci),
+    "material": material(board, ai_white),
+    "move_latency_ms": latencies,
+    "move_candidates": candidates,
+    "move_forward_passes": passes,
+  }
+
+def write_results(rows: list, path: str) -> None:
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+  schema = pa.schema([
+    ("level", pa.dictionary(pa.int8(), pa.string())),
+    ("opponent", pa.dictionary(pa.int8(), pa.string())),
+    ("ai_color", pa.dictionary(pa.int8(), pa.string())),
+    ("seed", pa.int32()),
+    ("result", pa.dictionary(pa.int8(), pa.string())),
+    ("score", pa.float32()),
+    ("termination", pa.dictionary(pa.int8(), pa.string())),
+    ("plies", pa.int16()),
+    ("material", pa.int16()),
+    ("move_latency_ms", pa.list_(pa.float32())),
+    ("move_candidates", pa.list_(pa.int16())),
+    ("move_forward_passes", pa.list_(pa.int16())),
+  ])
+  pq.write_table(pa.Table.from_pylist(rows, schema=schema), path, compression="zstd")
+
+def read_results(path: str) -> list:
+  import pyarrow.parquet as pq
+  return pq.read_table(path).to_pylist()
+
+def elo_difference(score: float) -> float:
+  """Elo difference implied by a score fraction, capped at +-800 for perfect scores."""
+  score = min(max(score, 1e-3), 1 - 1e-3)
+  return max(min(400 * math.log10(score / (1 - score)), 800.0), -800.0)
+
+def summarize(rows: list) -> list:
+  """Strength and cost per (level, opponent).
+
+  Returns:
+    list: One dict per pairing, in level order.
+  """
+  groups = {}
+  for row in rows:
+    groups.setdefault((row["level"], row["opponent"]), []).append(row)
+  order = {level: i for i, level in enumerate(LEVELS)}
+  summary = []
+  for (level, opponent), games in sorted(groups.items(), key=lambda item: (order.get(item[0][0], len(order)), item[0])):
+    latencies = sorted(latency for game in games for latency in game["move_latency_ms"])
+    candidates = [count for game in games for count in game["move_candidates"]]
+    passes = [count for game in games for count in game["move_forward_passes"]]
+    score = sum(game["score"] for game in games) / len(games)
+    summary.append({
+      "level": level,
+      "opponent": opponent,
+      "games": len(games),
+      "wins": sum(game["result"] == "win" for game in games),
+      "draws": sum(game["result"] == "draw" for game in games),
+      "losses": sum(game["result"] == "loss" for game in games),
+      "score": score,
+      "elo": elo_difference(score),
+      "illegal": sum(game["termination"] == "illegal_move" for game in games),
+      "material": sum(game["material"] for game in games) / len(games),
+      "plies": sum(game["plies"] for game in games) / len(games),
+      "latency_ms": sum(latencies) / len(latencies) if latencies else 0.0,
+      "latency_p95_ms": latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+      "candidates": sum(candidates) / len(candidates) if candidates else 0.0,
+      "max_candidates": max(candidates, default=0),
+      "passes": sum(passes) / len(passes) if passes else 0.0,
+    })
+  return summary
+
+def print_report(summary: list) -> None:
+  print(f"{'level':<13} {'opponent':<18} {'games':>5} {'W-D-L':>10} {'score':>6} {'elo':>5} {'illegal':>7} "
+        f"{'material':>8} {'plies':>6} {'ms/move':>8} {'p95 ms':>7} {'retries':>7} {'max':>4} {'passes':>6}")
+  for entry in summary:
+    record = f"{entry['wins']}-{entry['draws']}-{entry['losses']}"
+    print(f"{entry['level']:<13} {entry['opponent']:<18} {entry['games']:>5} {record:>10} {entry['score']:>6.2f} "
+          f"{entry['elo']:>+5.0f} {entry['illegal']:>7} {entry['material']:>+8.1f} {entry['plies']:>6.1f} "
+          f"{entry['latency_ms']:>8.1f} {entry['latency_p95_ms']:>7.1f} {entry['candidates']:>7.2f} "
+          f"{entry['max_candidates']:>4} {entry['passes']:>6.2f}")
+
+def run(args, model_dir) -> list:
+  tasks = [(level, opponent, i % 2 == 0, i, args.max_plies)
+           for level in args.levels for opponent in args.opponents for i in range(args.games)]
+  # Spawned, not forked: torch's thread pools don't survive a fork.
+  context = multiprocessing.get_context("spawn")
+  with ProcessPoolExecutor(max_workers=args.processes, mp_context=context, initializer=_init_worker,
+                           initargs=(model_dir, args.strategy, args.threads, args.uci_engine, args.engine_depth)) as pool:
+    futures = [pool.submit(play_game, *task) for task in tasks]
+    return [future.result() for future in futures]
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--levels", nargs="+", default=LEVELS, choices=LEVELS)
+  parser.add_argument("--opponents", nargs="+", default=["random", "engine"],
+                      help="random, engine or level:<name>.")
+  parser.add_argument("--games", type=int, default=10, help="Games per level and opponent.")
+  parser.add_argument("--max-plies", type=int, default=200, help="Plies after which a game is a draw.")
+  parser.add_argument("--strategy", default="constrained", choices=["constrained", "batched"],
+                      help="MoveEngine strategy; retries only come into play with batched.")
+  parser.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+  parser.add_argument("--threads", type=int, default=1, help="Torch threads per process.")
+  parser.add_argument("--engine-depth", type=int, default=2, help="Search depth of the engine opponent.")
+  parser.add_argument("--uci-engine", help="Path to a UCI engine to use as the engine opponent.")
+  parser.add_argument("--standin", action="store_true", help="Use the offline stand-in model.")
+  parser.add_argument("--train-steps", type=int, default=300, help="Training steps for the stand-in model.")
+  parser.add_argument("--output", default="selfplay.parquet", help="Where the per-game results are written.")
+  parser.add_argument("--report", metavar="PATH", help="Only print the report for an existing results file.")
+  args = parser.parse_args()
+
+  if args.report:
+    print_report(summarize(read_results(args.report)))
+    return
+  for opponent in args.opponents:
+    if opponent not in ("random", "engine") and not (opponent.startswith("level:") and opponent[6:] in LEVELS):
+      parser.error(f"Unknown opponent: {opponent}")
+
+  start = time.perf_counter()
+  with tempfile.TemporaryDirectory() as model_dir:
+    if args.standin:
+      from .chess_moves import build_standin
+      model, tokenizer = build_standin(args.train_steps)
+      model.save_pretrained(model_dir)
+      tokenizer.save_pretrained(model_dir)
+    rows = run(args, model_dir if args.standin else None)
+  elapsed = time.perf_counter() - start
+  write_results(rows, args.output)
+  print(f"{len(rows)} games in {elapsed:.1f}s ({len(rows) / elapsed * 3600:.0f} games/hour), written to {args.output}")
+  print_report(summarize(rows))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,96 @@
+"""Zero-shot classification throughput (messages per second) at different batch sizes.
+
+Uses a tiny, randomly initialised BART built locally as a stand-in for bart-large-mnli, so it
+runs offline in seconds. The absolute numbers mean nothing, the ratios between rows do.
+"baseline" is the zero-shot pipeline that TextClassifier used before, one message at a time.
+
+Run from src/:
+  python -m benchmarks.classifier_throughput --messages 64
+"""
+import argparse
+import time
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers, processors
+from transformers import BartConfig, BartForSequenceClassification, PreTrainedTokenizerFast, pipeline
+from llmimic.memory.text_classifier import TextClassifier
+
+MESSAGES = [
+  "Good morning! How did you sleep?",
+  "I can't believe we finally adopted the puppy together.",
+  "Did you see the game last night?",
+  "I'm sorry about the fight yesterday, I was being unfair.",
+  "lol ok",
+  "Remember that time we got lost in Lisbon? Best day ever.",
+  "The weather is awful today.",
+  "I think I'm falling in love with you.",
+]
+
+def build_tiny_model() -> tuple:
+  """Builds a word-level tokenizer over the benchmark vocabulary and a tiny BART NLI head.
+
+  Returns:
+    tuple: (model, tokenizer)
+  """
+  special = ["<pad>", "<s>", "</s>", "<unk>"]
+  words = set()
+  for text in MESSAGES + [TextClassifier.hypothesis_template, TextClassifier.personal_gate_label]:
+    words.update(text.lower().replace(".", " ").replace("'", " ").split())
+  vocab = {token: i for i, token in enumerate(special + sorted(words))}
+
+  backend = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+  backend.pre_tokenizer = pre_tokenizers.Whitespace()
+  backend.post_processor = processors.TemplateProcessing(
+    single="<s> $A </s>",
+    pair="<s> $A </s> </s> $B </s>",
+    special_tokens=[("<s>", vocab["<s>"]), ("</s>", vocab["</s>"])]
+  )
+  tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, bos_token="<s>", eos_token="</s>",
+                                      pad_token="<pad>", unk_token="<unk>")
+  tokenizer.model_input_names = ["input_ids", "attention_mask"]
+
+  config = BartConfig(
+    vocab_size=len(vocab), d_model=64, encoder_layers=2, decoder_layers=2,
+    encoder_attention_heads=4, decoder_attention_heads=4, encoder_ffn_dim=128, decoder_ffn_dim=128,
+    max_position_embeddings=256, pad_token_id=vocab["<pad>"], bos_token_id=vocab["<s>"],
+    eos_token_id=vocab["</s>"], decoder_start_token_id=vocab["</s>"],
+    num_labels=3, label2id={"contradiction": 0, "neutral": 1, "entailment": 2},
+    id2label={0: "contradiction", 1: "neutral", 2: "entailment"},
+  )
+  torch.manual_seed(0)
+  return BartForSequenceClassification(config).eval(), tokenizer
+
+def throughput(fn, messages: list) -> float:
+  start = time.perf_counter()
+  fn(messages)
+  return len(messages) / (time.perf_counter() - start)
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--messages", type=int, default=64, help="Messages to classify per run.")
+  parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16, 64],
+                      help="Messages classified per classify_batch call.")
+  args = parser.parse_args()
+
+  model, tokenizer = build_tiny_model()
+  messages = [MESSAGES[i % len(MESSAGES)] for i in range(args.messages)]
+  classifier = TextClassifier(model=model, tokenizer=tokenizer, batch_size=256)
+  labels = classifier.personal_labels + classifier.throwaway_labels
+
+  try:
+    zero_shot = pipeline("zero-shot-classification", model=model, tokenizer=tokenizer, device="cpu")
+    rate = throughput(lambda batch: [zero_shot(text, labels) for text in batch], messages)
+    print(f"{'baseline (pipeline)':<28} {rate:10.1f} msg/s")
+  except Exception as e:
+    print(f"{'baseline (pipeline)':<28} skipped: {e}")
+
+  for two_stage in (False, True):
+    classifier.two_stage = two_stage
+    for batch_size in args.batch_sizes:
+      def run(batch):
+        for start in range(0, len(batch), batch_size):
+          classifier.classify_batch(batch[start:start + batch_size])
+      name = f"{'two-stage' if two_stage else 'single-stage'} batch={batch_size}"
+      print(f"{name:<28} {throughput(run, messages):10.1f} msg/s")
+
+if __name__ == "__main__":
+  main()
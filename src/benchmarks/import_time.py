@@ -0,0 +1,70 @@
+"""Import time of the package, checked against a budget.
+
+Each module is imported in a fresh interpreter with `python -X importtime` and the cumulative time of
+the import is read from its report (median over --runs). It also checks that none of the heavy
+dependencies (torch, transformers, ...) got pulled in by the import; those are supposed to load on
+first real use. Exits with status 1 if a module is over budget or imports something heavy, so it
+can run in CI.
+
+Run from src/:
+  python -m benchmarks.import_time --budget-ms 150
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ("torch", "transformers", "datasets", "nltk", "requests", "chess", "numpy")
+
+def measure(module: str) -> tuple:
+  """Imports a module in a fresh interpreter.
+
+  Args:
+    module (str): The module to import.
+
+  Returns:
+    tuple: (cumulative import time in ms, {module: self time in ms}, heavy modules that got imported)
+  """
+  code = f"import sys, {module}; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+  result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True)
+  total = None
+  self_times = {}
+  for line in result.stderr.splitlines():
+    if not line.startswith("import time:") or "|" not in line:
+      continue
+    fields = line[len("import time:"):].split("|")
+    try:
+      self_us, cumulative_us = int(fields[0]), int(fields[1])
+    except ValueError:
+      continue  # The header line.
+    name = fields[2].strip()
+    self_times[name] = self_times.get(name, 0) + self_us / 1000
+    if name == module:
+      total = cumulative_us / 1000
+  heavy = [name for name in result.stdout.strip().split(",") if name]
+  return total or 0.0, self_times, heavy
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("modules", nargs="*", default=["llmimic", "llmimic.memory"], help="Modules to import.")
+  parser.add_argument("--budget-ms", type=float, default=150.0, help="Max cumulative import time per module.")
+  parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module (the median is used).")
+  parser.add_argument("--top", type=int, default=8, help="How many of the slowest imported modules to list.")
+  args = parser.parse_args()
+
+  failed = False
+  for module in args.modules:
+    runs = [measure(module) for _ in range(args.runs)]
+    total = statistics.median(run[0] for run in runs)
+    _, self_times, heavy = runs[-1]
+    over = total > args.budget_ms
+    failed = failed or over or bool(heavy)
+    print(f"{module}: {total:.1f}ms (budget {args.budget_ms:.0f}ms){'  OVER BUDGET' if over else ''}")
+    if heavy:
+      print(f"  heavy modules imported eagerly: {', '.join(heavy)}")
+    for name, ms in sorted(self_times.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+      print(f"  {ms:>8.1f}ms  {name}")
+  sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,135 @@
+"""Latency and memory of each inference backend, per model, on CPU.
+
+By default the models are small randomly initialised stand-ins built from configs (nothing is
+downloaded), shaped like the real ones: a Llama for the persona LLM, BART for the summarizer and the
+zero-shot classifier, BERT for NER and RoBERTa for sentiment. --hub uses the real model IDs instead.
+Every (model, backend) pair runs in a fresh process, so the RSS column is that backend's own peak.
+
+Run from src/:
+  python -m benchmarks.inference_backends --runs 10 --threads 4
+  python -m benchmarks.inference_backends --models classifier ner --backends torch int8
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+BACKENDS = {
+  "torch": {},
+  "int8": {"quantize": "int8"},
+  "compile": {"compile": True},
+  "int8+compile": {"quantize": "int8", "compile": True},
+  "onnx": {"onnx": True},
+}
+
+# name: (kind, hub model ID, config class, config kwargs)
+MODELS = {
+  "llm": ("causal-lm", "chuanli11/Llama-3.2-3B-Instruct-uncensored", "LlamaConfig",
+          dict(vocab_size=8000, hidden_size=512, intermediate_size=1376, num_hidden_layers=6,
+               num_attention_heads=8, num_key_value_heads=4, max_position_embeddings=1024)),
+  "summarizer": ("seq2seq-lm", "facebook/bart-large-cnn", "BartConfig",
+                 dict(vocab_size=8000, d_model=512, encoder_layers=4, decoder_layers=4, encoder_attention_heads=8,
+                      decoder_attention_heads=8, encoder_ffn_dim=2048, decoder_ffn_dim=2048)),
+  "classifier": ("sequence-classification", "facebook/bart-large-mnli", "BartConfig",
+                 dict(vocab_size=8000, d_model=512, encoder_layers=4, decoder_layers=4, encoder_attention_heads=8,
+                      decoder_attention_heads=8, encoder_ffn_dim=2048, decoder_ffn_dim=2048, num_labels=3)),
+  "ner": ("token-classification", "dslim/bert-base-NER", "BertConfig",
+          dict(vocab_size=8000, hidden_size=512, num_hidden_layers=6, num_attention_heads=8,
+               intermediate_size=2048, num_labels=9)),
+  "sentiment": ("sequence-classification", "cardiffnlp/twitter-roberta-base-sentiment", "RobertaConfig",
+                dict(vocab_size=8000, hidden_size=512, num_hidden_layers=6, num_attention_heads=8,
+                     intermediate_size=2048, num_labels=3)),
+}
+
+def build_standin(name: str, directory: str) -> str:
+  """Saves a randomly initialised stand-in for a model, so the backends can load it like a real one.
+
+  Returns:
+    str: The model directory.
+  """
+  import torch
+  import transformers
+  from llmimic.inference_backend import _AUTO_CLASSES
+  kind, _, config_class, config_kwargs = MODELS[name]
+  torch.manual_seed(0)
+  config = getattr(transformers, config_class)(**config_kwargs)
+  model = getattr(transformers, _AUTO_CLASSES[kind]).from_config(config)
+  path = os.path.join(directory, name)
+  model.save_pretrained(path)
+  return path
+
+def run_one(name: str, path: str, backend_config: dict, runs: int, threads: int) -> dict:
+  """Loads one model with one backend and times its typical workload (runs in its own process)."""
+  import torch
+  from llmimic.inference_backend import InferenceBackend, configure_threads
+  configure_threads(threads)
+  kind = MODELS[name][0]
+  backend = InferenceBackend(device="cpu", dtype="float32", **backend_config)
+
+  start = time.perf_counter()
+  model = backend.load_model(kind, path)
+  load_time = time.perf_counter() - start
+  if backend.onnx and not InferenceBackend._is_onnx(model):
+    return {"skipped": "optimum[onnxruntime] not installed"}
+
+  vocab_size = model.config.vocab_size
+  generator = torch.Generator().manual_seed(0)
+  if kind == "causal-lm":
+    input_ids = torch.randint(3, vocab_size, (1, 128), generator=generator)
+    step = lambda: model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), max_new_tokens=16,
+                                  min_new_tokens=16, do_sample=False, pad_token_id=0)
+  elif kind == "seq2seq-lm":
+    input_ids = torch.randint(3, vocab_size, (1, 256), generator=generator)
+    step = lambda: model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), max_new_tokens=16,
+                                  min_new_tokens=16, do_sample=False, num_beams=1)
+  else:
+    input_ids = torch.randint(3, vocab_size, (8, 64), generator=generator)
+    if model.config.eos_token_id is not None:
+      input_ids[:, -1] = model.config.eos_token_id  # BART's classification head reads the EOS position.
+    step = lambda: model(input_ids=input_ids, attention_mask=torch.ones_like(input_ids))
+
+  timings = []
+  with torch.inference_mode():
+    step()  # Warm-up (and compilation, for torch.compile).
+    for _ in range(runs):
+      start = time.perf_counter()
+      step()
+      timings.append(time.perf_counter() - start)
+  # ru_maxrss is in KiB on Linux and bytes on macOS.
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+  p90 = statistics.quantiles(timings, n=10)[-1] if len(timings) > 1 else timings[0]
+  return {"load": load_time, "median": statistics.median(timings), "p90": p90, "rss": peak_rss}
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--models", nargs="+", default=list(MODELS), choices=list(MODELS), help="Models to benchmark.")
+  parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS), help="Backends to compare.")
+  parser.add_argument("--runs", type=int, default=10, help="Timed runs per model and backend.")
+  parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads (default: torch's choice).")
+  parser.add_argument("--hub", action="store_true", help="Use the real model IDs (downloads them) instead of stand-ins.")
+  args = parser.parse_args()
+
+  context = multiprocessing.get_context("spawn")
+  with tempfile.TemporaryDirectory() as directory:
+    print(f"{'model':<11} {'backend':<13} {'load':>7} {'median':>9} {'p90':>9} {'peak RSS':>9} {'speedup':>8}")
+    for name in args.models:
+      path = MODELS[name][1] if args.hub else build_standin(name, directory)
+      baseline = None
+      for backend_name in args.backends:
+        # A fresh process per backend, so the RSS and thread settings of one don't leak into the next.
+        with context.Pool(1) as pool:
+          result = pool.apply(run_one, (name, path, BACKENDS[backend_name], args.runs, args.threads))
+        if "skipped" in result:
+          print(f"{name:<11} {backend_name:<13} skipped: {result['skipped']}")
+          continue
+        if baseline is None:
+          baseline = result["median"]
+        print(f"{name:<11} {backend_name:<13} {result['load']:>6.2f}s {result['median'] * 1000:>7.1f}ms "
+              f"{result['p90'] * 1000:>7.1f}ms {result['rss']:>7.0f}MB {baseline / result['median']:>7.2f}x")
+
+if __name__ == "__main__":
+  main()
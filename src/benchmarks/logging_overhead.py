@@ -0,0 +1,109 @@
+"""What logging costs the thread serving a turn, with the old setup and the new logging modes.
+
+Replays the log calls of one chat turn plus one chess move with a few rejected candidates (the move
+history grows with every turn, like a real game). "before" is how the package logged until now:
+f-strings built eagerly, the full chess prompt at INFO, and console and file handlers writing in the
+calling thread through the formatter that formatted every record twice. The other rows use the current
+call sites (lazy %-style arguments, the prompt at DEBUG) with the setups configure_logger offers.
+"turn" is the time spent in the calling thread; "drain" is the time the queue listener still needed
+afterwards to write everything out. The console goes to os.devnull and the files to a temp dir,
+so no terminal speed is measured.
+
+Run from src/:
+  python -m benchmarks.logging_overhead --turns 2000
+"""
+import argparse
+import contextlib
+import logging
+import os
+import tempfile
+import time
+from colorama import Fore, Style
+from llmimic.logger import ColoredFormatter, configure_logger, flush_logger, setup_logger
+
+class DoubleFormattingFormatter(ColoredFormatter):
+  """The console formatter as it was: formats the record, then formats the message again."""
+  def format(self, record):
+    logging.Formatter.format(self, record)
+    color = self.COLORS.get(record.levelno, Fore.WHITE)
+    return f"{color}[{color}{record.levelname}{Style.RESET_ALL}] [{record.name}] [{record.funcName}] - {record.getMessage()}"
+
+def turn_before(log: logging.Logger, turn: int, moves: list, path: str) -> None:
+  log.info("Submitting prompt for generation.")
+  log.debug(f"Message appended to chat {path}")
+  log.debug(f"Prefix cache: reusing {turn * 40} tokens, prefilling {25}.")
+  log.info(f"Prefix cache reused {turn * 40} tokens, prefilled {25}.")
+  log.debug(f"Message appended to chat {path}")
+  log.info(f"Prompt response generated, total time: {0.8:.2f} seconds.")
+  log.info(f"AI Input Moves (UCI): {' '.join(['1-0'] + moves)}")
+  for candidate in range(1, 4):
+    log.debug(f"Candidate {candidate} ({'e2e5'!r}) isn't a legal move.")
+  log.debug(f"AI picked {'e2e4'} after {2} forward pass(es), {4} candidate(s).")
+  log.info(f"Move applied: {'e2e4'} (UCI)")
+
+def turn_after(log: logging.Logger, turn: int, moves: list, path: str) -> None:
+  log.info("Submitting prompt for generation.")
+  log.debug("Message appended to chat %s", path)
+  log.debug("Prefix cache: reusing %d tokens, prefilling %d.", turn * 40, 25)
+  log.debug("Prefix cache reused %d tokens, prefilled %d.", turn * 40, 25)
+  log.debug("Message appended to chat %s", path)
+  log.info("Prompt response generated, total time: %s.", "0.80 seconds")
+  if log.isEnabledFor(logging.DEBUG):
+    log.debug("AI Input Moves (UCI): %s", " ".join(["1-0"] + moves))
+  for candidate in range(1, 4):
+    log.debug("Candidate %d (%r) isn't a legal move.", candidate, "e2e5")
+  log.debug("AI picked %s after %d forward pass(es), %d candidate(s).", "e2e4", 2, 4)
+  log.info("Move applied: %s (UCI)", "e2e4")
+
+SETUPS = [
+  # name, replay, setup_logger/configure_logger settings
+  ("before", turn_before, {"use_queue": False, "console": True}),
+  ("sync", turn_after, {"use_queue": False, "console": True}),
+  ("sync, no console", turn_after, {"use_queue": False, "console": False}),
+  ("queue", turn_after, {"use_queue": True, "console": True}),
+  ("queue, no console", turn_after, {"use_queue": True, "console": False}),
+  ("queue, debug 1/10", turn_after, {"use_queue": True, "console": True, "debug_sample_rate": 0.1}),
+  ("queue, debug 20/s", turn_after, {"use_queue": True, "console": True, "debug_rate_limit": 20}),
+  ("queue, INFO", turn_after, {"use_queue": True, "console": True, "level": "INFO"}),
+]
+
+def run(name: str, replay, settings: dict, turns: int, logs_dir: str) -> dict:
+  settings = dict(settings)
+  with open(os.devnull, "w") as devnull:
+    # The console handler binds to whatever sys.stderr is when it's created.
+    with contextlib.redirect_stderr(devnull):
+      log = setup_logger(f"bench.{name}", level=logging.DEBUG, logs_dir=logs_dir,
+                         console=settings.pop("console"), use_queue=settings.pop("use_queue"))
+    log.propagate = False
+    configure_logger(log, **settings)
+    if replay is turn_before:
+      for handler in logging.getLogger(f"bench.{name}").handlers:
+        if isinstance(handler.formatter, ColoredFormatter):
+          handler.setFormatter(DoubleFormattingFormatter('%(message)s'))
+    moves = []
+    start = time.perf_counter()
+    for turn in range(turns):
+      moves.append("e2e4" if turn % 2 else "e7e5")
+      replay(log, turn, moves[-160:], "/chat_logs/chat_2026-10-18_12-00-00.json")
+    elapsed = time.perf_counter() - start
+    flush_logger(log)
+    drained = time.perf_counter() - start - elapsed
+    configure_logger(log, use_queue=False)
+    for handler in list(log.handlers):
+      log.removeHandler(handler)
+      handler.close()
+  return {"turn_us": elapsed / turns * 1e6, "drain_ms": drained * 1e3}
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--turns", type=int, default=2000, help="Turns replayed per setup.")
+  args = parser.parse_args()
+
+  print(f"{'setup':<20} {'turn (us)':>10} {'drain (ms)':>11}")
+  with tempfile.TemporaryDirectory() as logs_dir:
+    for name, replay, settings in SETUPS:
+      result = run(name, replay, settings, args.turns, logs_dir)
+      print(f"{name:<20} {result['turn_us']:>10.1f} {result['drain_ms']:>11.1f}")
+
+if __name__ == "__main__":
+  main()
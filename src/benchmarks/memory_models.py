@@ -0,0 +1,55 @@
+"""Per-turn latency of memory processing with and without the model registry.
+
+"Before" builds a fresh registry every turn, which is what check_for_memories used to do
+(construct all three pipelines, use them once, throw them away). "After" keeps one
+MemoryInstance alive so the pipelines stay warm.
+
+Run from src/:
+  python -m benchmarks.memory_models --turns 5
+"""
+import argparse
+import statistics
+import tempfile
+import time
+from llmimic.memory import MemoryInstance
+from llmimic.model_registry import ModelRegistry
+
+TURNS = [
+  ("user", "Hey! I just got back from Paris with Sarah, we had the best time."),
+  ("assistant", "That sounds wonderful! What was your favorite part of Paris?"),
+  ("user", "Honestly the little bakery near the Louvre. I think I'm in love with her."),
+  ("assistant", "That's such a sweet thing to say. Have you told Sarah yet?"),
+]
+
+def run(turns: int, warm: bool, memory_dir: str) -> list:
+  timings = []
+  instance = MemoryInstance(memory_dir, registry=ModelRegistry(), async_processing=False) if warm else None
+  for i in range(turns):
+    role, text = TURNS[i % len(TURNS)]
+    start = time.perf_counter()
+    if not warm:
+      instance = MemoryInstance(memory_dir, registry=ModelRegistry(), async_processing=False)
+    instance.check_for_memories(role, text)
+    timings.append(time.perf_counter() - start)
+    if not warm:
+      instance.close()
+  if warm:
+    instance.close()
+  return timings
+
+def report(name: str, timings: list) -> None:
+  steady = timings[1:] or timings
+  print(f"{name:<8} first={timings[0]:8.3f}s  mean={statistics.mean(steady):8.3f}s  "
+        f"median={statistics.median(steady):8.3f}s  total={sum(timings):8.3f}s")
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--turns", type=int, default=5, help="Messages to push through memory processing.")
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as memory_dir:
+    report("before", run(args.turns, warm=False, memory_dir=memory_dir))
+    report("after", run(args.turns, warm=True, memory_dir=memory_dir))
+
+if __name__ == "__main__":
+  main()
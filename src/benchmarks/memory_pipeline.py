@@ -0,0 +1,158 @@
+"""Memory analysis throughput (messages per second): the unified pipeline against the old code path.
+
+"before" is how check_for_memories_batch used to run: one batched classification, then per message
+an NER call on the whole text and a datasets.Dataset of its sentences for sentiment (with the debug
+print). "after" is the current MemoryInstance.check_for_memories_batch: sentences split once, shared
+by NER and sentiment, and one batched call per model for every queued message.
+The models are small randomly initialised stand-ins (BERT for NER, RoBERTa for sentiment, BART for
+the zero-shot classifier) over a word-level vocabulary, so it runs offline; the ratios are what matter.
+
+Run from src/:
+  python -m benchmarks.memory_pipeline --messages 64 --batch-sizes 1 8
+"""
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers, processors
+from transformers import (BartConfig, BartForSequenceClassification, BertConfig, BertForTokenClassification,
+                          PreTrainedTokenizerFast, RobertaConfig, RobertaForSequenceClassification, pipeline)
+from llmimic.memory import MemoryInstance
+from llmimic.memory.entity_recognizer import EntityRecognizer
+from llmimic.memory.sentences import sent_tokenize
+from llmimic.memory.sentiment_analyzer import SentimentAnalyzer
+from llmimic.memory.text_classifier import TextClassifier
+from llmimic.model_registry import ModelRegistry
+
+MESSAGES = [
+  "Hey! I just got back from Paris with Sarah. We had the best time.",
+  "That sounds wonderful! What was your favorite part of Paris?",
+  "Honestly the little bakery near the Louvre. I think I'm in love with her. Is that crazy?",
+  "That's such a sweet thing to say. Have you told Sarah yet?",
+  "lol ok",
+  "Work was awful today. My boss Tom yelled at everyone. I just want to go home.",
+  "I'm sorry to hear that. Do you want to talk about it?",
+  "Remember that time we got lost in Lisbon? Best day ever. We should go back in May.",
+]
+NER_LABELS = ["O", "B-PER", "I-PER", "B-ORG", "I-ORG", "B-LOC", "I-LOC", "B-MISC", "I-MISC"]
+
+def build_tokenizer() -> PreTrainedTokenizerFast:
+  """A word-level tokenizer over every word the benchmark (and the classifier's hypotheses) uses."""
+  special = ["<pad>", "<s>", "</s>", "<unk>"]
+  words = set()
+  texts = MESSAGES + [TextClassifier.hypothesis_template, TextClassifier.personal_gate_label]
+  classifier = TextClassifier.__new__(TextClassifier)
+  classifier._TextClassifier__generate_candidate_labels()
+  texts += classifier.personal_labels + classifier.throwaway_labels
+  for text in texts:
+    words.update(text.lower().replace(".", " ").replace("'", " ").replace("!", " ").replace("?", " ").split())
+  vocab = {token: i for i, token in enumerate(special + sorted(words))}
+  backend = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+  backend.pre_tokenizer = pre_tokenizers.Whitespace()
+  backend.post_processor = processors.TemplateProcessing(
+    single="<s> $A </s>",
+    pair="<s> $A </s> </s> $B </s>",
+    special_tokens=[("<s>", vocab["<s>"]), ("</s>", vocab["</s>"])]
+  )
+  tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, bos_token="<s>", eos_token="</s>",
+                                      pad_token="<pad>", unk_token="<unk>")
+  tokenizer.model_input_names = ["input_ids", "attention_mask"]
+  return tokenizer
+
+def build_registry(tokenizer: PreTrainedTokenizerFast) -> ModelRegistry:
+  """A registry holding the three stand-in analyzers."""
+  torch.manual_seed(0)
+  size = dict(hidden_size=256, num_hidden_layers=4, num_attention_heads=4, intermediate_size=1024,
+              vocab_size=len(tokenizer), pad_token_id=tokenizer.pad_token_id, max_position_embeddings=514)
+  ner_model = BertForTokenClassification(BertConfig(
+    **size, num_labels=len(NER_LABELS), id2label=dict(enumerate(NER_LABELS)),
+    label2id={label: i for i, label in enumerate(NER_LABELS)})).eval()
+  sentiment_model = RobertaForSequenceClassification(RobertaConfig(**size, num_labels=3)).eval()
+  nli_model = BartForSequenceClassification(BartConfig(
+    vocab_size=len(tokenizer), d_model=256, encoder_layers=2, decoder_layers=2, encoder_attention_heads=4,
+    decoder_attention_heads=4, encoder_ffn_dim=1024, decoder_ffn_dim=1024, max_position_embeddings=512,
+    pad_token_id=tokenizer.pad_token_id, bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id,
+    decoder_start_token_id=tokenizer.eos_token_id, num_labels=3,
+    label2id={"contradiction": 0, "neutral": 1, "entailment": 2},
+    id2label={0: "contradiction", 1: "neutral", 2: "entailment"})).eval()
+
+  entity_recognizer = EntityRecognizer.__new__(EntityRecognizer)
+  entity_recognizer.ner_model = pipeline("token-classification", model=ner_model, tokenizer=tokenizer,
+                                         aggregation_strategy="simple", device="cpu")
+  sentiment_analyzer = SentimentAnalyzer.__new__(SentimentAnalyzer)
+  sentiment_analyzer.sentiment_analyzer = pipeline("text-classification", model=sentiment_model, tokenizer=tokenizer,
+                                                   device="cpu")
+  text_classifier = TextClassifier(model=nli_model, tokenizer=tokenizer)
+
+  registry = ModelRegistry()
+  registry.register("entity_recognizer", lambda: entity_recognizer)
+  registry.register("sentiment_analyzer", lambda: sentiment_analyzer)
+  registry.register("text_classifier", lambda: text_classifier)
+  return registry
+
+def legacy_sentiment(analyzer: SentimentAnalyzer, text: str, batch_size: int = 8) -> list:
+  """SentimentAnalyzer.analyze_sentiment as it used to be: a Dataset per message and a print per batch."""
+  from datasets import Dataset, disable_progress_bars
+  disable_progress_bars()  # Keep the terminal out of the measurement, same as the print below.
+  dataset = Dataset.from_dict({"text": sent_tokenize(text)})
+
+  def process_batch(batch):
+    print(batch)
+    results = analyzer.sentiment_analyzer(batch["text"], batch_size=batch_size)
+    sentiments = []
+    for i, res in enumerate(results):
+      if res['label'] != analyzer.neutral_label:
+        sentiments.append({"label": analyzer.label_mapping.get(res['label'], 'unknown'), "score": res['score'],
+                           "sentence": batch["text"][i]})
+      else:
+        sentiments.append(None)
+    return {"sentiments": sentiments}
+
+  processed = dataset.map(process_batch, batched=True)
+  return [item for item in processed["sentiments"] if item is not None]
+
+def legacy_batch(instance: MemoryInstance, messages: list) -> None:
+  """check_for_memories_batch as it used to be: only classification was batched across messages."""
+  classifications = instance.text_classifier.classify_batch([text for _, text in messages])
+  for (role, text), classification in zip(messages, classifications):
+    entity_list = instance.entity_recognizer.analyze_entities(text)
+    instance.entity_recognizer.process_entity_memory(entity_list, role, text, instance.memory_store)
+    sentiment_data = legacy_sentiment(instance.sentiment_analyzer, text)
+    instance.sentiment_analyzer.append_to_memory(role, sentiment_data, instance.memory_store)
+    instance.text_classifier.append_to_memory(classification, role, text, instance.memory_store)
+
+def run(process_batch, instance: MemoryInstance, count: int, batch_size: int) -> float:
+  """Pushes `count` messages through in batches of `batch_size` (as the worker would hand them over).
+
+  Returns:
+    float: Messages per second.
+  """
+  messages = [("user" if i % 2 == 0 else "assistant", MESSAGES[i % len(MESSAGES)]) for i in range(count)]
+  # The old path prints every batch; send it nowhere so the terminal isn't what gets measured.
+  with contextlib.redirect_stdout(io.StringIO()):
+    process_batch(instance, messages[:batch_size])  # Warm-up.
+    start = time.perf_counter()
+    for i in range(0, count, batch_size):
+      process_batch(instance, messages[i:i + batch_size])
+  return count / (time.perf_counter() - start)
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--messages", type=int, default=64, help="Messages per run.")
+  parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8], help="Queued messages handled together.")
+  args = parser.parse_args()
+
+  registry = build_registry(build_tokenizer())
+  with tempfile.TemporaryDirectory() as memory_dir:
+    instance = MemoryInstance(memory_dir, registry=registry, async_processing=False)
+    print(f"{'batch':>5} {'before':>12} {'after':>12} {'speedup':>8}")
+    for batch_size in args.batch_sizes:
+      before = run(legacy_batch, instance, args.messages, batch_size)
+      after = run(MemoryInstance.check_for_memories_batch, instance, args.messages, batch_size)
+      print(f"{batch_size:>5} {before:>8.1f} m/s {after:>8.1f} m/s {after / before:>7.2f}x")
+    instance.close()
+
+if __name__ == "__main__":
+  main()
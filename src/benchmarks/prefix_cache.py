@@ -0,0 +1,71 @@
+"""Time to first token with and without prefix KV-cache reuse, on CPU.
+
+Uses a small randomly initialised Llama built from a config (nothing is downloaded). Each turn the
+prompt grows by a user message and the previous reply, on top of a fixed persona/system prefix,
+just like a real session. "cold" prefills the whole prompt every turn, "cached" goes through
+PrefixCachedGenerator and only prefills what's new.
+
+Run from src/:
+  python -m benchmarks.prefix_cache --turns 10 --prefix-tokens 1500
+"""
+import argparse
+import random
+import time
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+from llmimic.prefix_cache import PrefixCachedGenerator
+
+def build_tiny_llama(vocab_size: int, max_positions: int) -> LlamaForCausalLM:
+  config = LlamaConfig(
+    vocab_size=vocab_size, hidden_size=256, intermediate_size=688, num_hidden_layers=4,
+    num_attention_heads=8, num_key_value_heads=4, max_position_embeddings=max_positions,
+    pad_token_id=0, bos_token_id=1, eos_token_id=2,
+  )
+  torch.manual_seed(0)
+  return LlamaForCausalLM(config).eval()
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--turns", type=int, default=10, help="Conversation turns to simulate.")
+  parser.add_argument("--prefix-tokens", type=int, default=1500, help="Persona/system prefix length.")
+  parser.add_argument("--turn-tokens", type=int, default=60, help="Tokens each user message adds.")
+  parser.add_argument("--reply-tokens", type=int, default=40, help="Tokens generated per reply.")
+  args = parser.parse_args()
+
+  vocab_size = 2000
+  model = build_tiny_llama(vocab_size, args.prefix_tokens + args.turns * (args.turn_tokens + args.reply_tokens) + 64)
+  generator = PrefixCachedGenerator(model, tokenizer=None)
+  rng = random.Random(0)
+  tokens = lambda n: [rng.randrange(3, vocab_size) for _ in range(n)]
+  generate_kwargs = {"do_sample": False, "pad_token_id": 0}
+
+  prompt = tokens(args.prefix_tokens)
+  print(f"{'turn':>4} {'prompt':>7} {'cold TTFT':>10} {'cached TTFT':>12} {'prefilled':>10}")
+  totals = [0.0, 0.0]
+  for turn in range(1, args.turns + 1):
+    prompt = prompt + tokens(args.turn_tokens)
+    input_tensor = torch.tensor([prompt])
+
+    start = time.perf_counter()
+    with torch.inference_mode():
+      model.generate(input_ids=input_tensor, attention_mask=torch.ones_like(input_tensor), max_new_tokens=1, **generate_kwargs)
+    cold = time.perf_counter() - start
+
+    start = time.perf_counter()
+    generator.generate_ids(prompt, max_new_tokens=1, **generate_kwargs)
+    cached = time.perf_counter() - start
+    prefilled = generator.last_prefilled_tokens
+
+    # Let the generator produce the actual reply so its cache covers it, like a real turn would.
+    reply = generator.generate_ids(prompt, max_new_tokens=args.reply_tokens, min_new_tokens=args.reply_tokens, **generate_kwargs)
+    prompt = prompt + reply
+
+    totals[0] += cold
+    totals[1] += cached
+    print(f"{turn:>4} {len(input_tensor[0]):>7} {cold * 1000:>8.1f}ms {cached * 1000:>10.1f}ms {prefilled:>10}")
+
+  print(f"mean TTFT: cold {totals[0] / args.turns * 1000:.1f}ms, cached {totals[1] / args.turns * 1000:.1f}ms "
+        f"({totals[0] / max(totals[1], 1e-9):.1f}x)")
+
+if __name__ == "__main__":
+  main()
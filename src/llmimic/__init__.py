@@ -10,18 +10,30 @@ __all__ = ['logger']
 import time
 
 class ExecutionTimer:
+  """Stopwatch kept for scripts that use it; the package itself times its stages with tracing spans.
+  Nested start()/stop() pairs on one timer each get their own time.
+  """
   def __init__(self):
-    self.start_time = None
+    self._starts = []
+
+  @property
+  def start_time(self):
+    return self._starts[-1] if self._starts else None
 
   def start(self):
-    self.start_time = time.time()
+    self._starts.append(time.perf_counter())
 
   def stop(self) -> str:
-    if self.start_time is None:
+    if not self._starts:
         raise ValueError("Timer was not started.")
-    elapsed_time = time.time() - self.start_time
-    self.start_time = None
-    minutes, seconds = divmod(int(elapsed_time), 60)
-    return f"{minutes}m{seconds}s"
+    from .tracing import format_seconds
+    return format_seconds(time.perf_counter() - self._starts.pop())
+
+from .llm_instance import LLMInstance
 
-from .llm_instance import LLMInstance
\ No newline at end of file
+def __getattr__(name):
+  # AsyncLLMInstance brings in asyncio, so it's only imported when someone asks for it.
+  if name == "AsyncLLMInstance":
+    from .async_instance import AsyncLLMInstance
+    return AsyncLLMInstance
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,116 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import Executor
+from typing import AsyncIterator, Optional
+from . import logger, UserData
+from .llm_instance import LLMInstance
+from .tracing import span
+
+class AsyncLLMInstance:
+  """asyncio front-end for LLMInstance, for embedding in async web apps.
+  Everything that blocks (model loading and inference, the weather request, persona/preset/chat log
+  and memory file I/O) runs in an executor, so the event loop stays free. Calls on one instance are
+  serialized, the same way a single LLMInstance handles one turn at a time.
+  """
+  def __init__(self, instance: Optional[LLMInstance] = None, executor: Optional[Executor] = None):
+    """Init for AsyncLLMInstance.
+
+    Args:
+      instance (LLMInstance, optional): The instance to wrap. Defaults to None (create one).
+      executor (Executor, optional): Where blocking work runs. Defaults to None (the loop's default executor).
+    """
+    self.instance = instance if instance is not None else LLMInstance()
+    self.executor = executor
+    self._lock = None
+
+  def _turn_lock(self) -> asyncio.Lock:
+    # Created lazily so the lock belongs to the loop that actually uses the instance.
+    if self._lock is None:
+      self._lock = asyncio.Lock()
+    return self._lock
+
+  async def _run(self, fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Run in a copy of the caller's context, so spans opened in the executor nest under the caller's.
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(self.executor, functools.partial(context.run, fn, *args, **kwargs))
+
+  def is_active(self) -> bool:
+    return self.instance.is_active()
+
+  async def start(self, user_data: UserData, preset_name: str) -> bool:
+    """Async version of LLMInstance.start.
+    The weather request goes out right away and runs alongside persona and preset loading and the
+    model load; the chat log and memory store are opened once those are done.
+
+    Args:
+      user_data (UserData): The user's data.
+      preset_name (str): The preset from configs/presets.json for session.
+
+    Returns:
+      bool: Whether successful.
+    """
+    instance = self.instance
+    async with self._turn_lock():
+      if instance.is_active():
+        logger.error("A session or chat is already active.")
+        return False
+      with span("session.start") as session_span:
+        weather = None
+        if instance.get_weather:
+          weather = asyncio.ensure_future(self._run(instance._get_weather_info, instance.weather_api_key, instance.lat, instance.lon))
+        try:
+          llm_persona_info, preset_loaded = await asyncio.gather(
+            self._run(instance._construct_persona_info),
+            self._run(instance.get_preset_data, preset_name),
+          )
+          if not preset_loaded:
+            logger.error("Failed to load preset data.")
+            return False
+          await self._run(instance._load_pipeline)
+          weather_info = await weather if weather is not None else None
+        finally:
+          if weather is not None and not weather.done():
+            weather.cancel()
+        user_info = instance._construct_user_data(user_data=user_data, weather_info=weather_info)
+        await self._run(instance._open_session, user_data, llm_persona_info, user_info)
+      logger.info(f"Chat logs, initial messages, and LLM session active, total time: {session_span.format_elapsed()}.")
+      logger.info(f"Session started for a {user_data.race} {user_data.sex} named {user_data.name}, born {user_data.birthday}.")
+      return True
+
+  async def generate_response(self, prompt: str) -> str:
+    """Async version of LLMInstance.generate_response.
+
+    Args:
+      prompt (str): The prompt to submit.
+
+    Returns:
+      str: The generated response.
+    """
+    async with self._turn_lock():
+      return await self._run(self.instance.generate_response, prompt)
+
+  async def stream_response(self, prompt: str) -> AsyncIterator[str]:
+    """Async version of LLMInstance.stream_response.
+
+    Args:
+      prompt (str): The prompt to submit.
+
+    Yields:
+      str: Chunks of the reply.
+    """
+    async with self._turn_lock():
+      chunks = self.instance.astream_response(prompt)
+      try:
+        async for chunk in chunks:
+          yield chunk
+      finally:
+        # Closed right away rather than whenever it's garbage collected, so generation stops with the stream.
+        await chunks.aclose()
+
+  async def stop(self) -> None:
+    """Async version of LLMInstance.stop (waits for pending memory work without blocking the loop).
+    """
+    async with self._turn_lock():
+      await self._run(self.instance.stop)
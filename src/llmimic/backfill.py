@@ -0,0 +1,331 @@
+"""Offline backfill: replays old chat logs through memory extraction and summarization.
+
+Every chat log (chat_*.jsonl, or an exported chat_*.json) is read one file at a time. Its user and
+assistant messages are deduplicated on (role, normalized text), across every log and every earlier
+run, and handed in chunks to a pool of worker processes, each holding its own copy of the memory
+analyzers and the summarizer. Whatever a chunk produces is written to the memory store in one
+transaction, together with the checkpoint saying which messages and which log files are done, so
+an interrupted run resumes where it stopped without writing anything twice.
+
+Run from src/:
+  python -m llmimic.backfill                     # every log in llmimic/chat_logs, config.json settings
+  python -m llmimic.backfill old_logs/ --workers 4 --no-summarize
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+from . import logger
+from .config_registry import get_shared_config_registry
+from .memory.analysis_cache import AnalysisCache
+from .memory.memory_store import MemoryStore
+from .model_registry import ModelRegistry
+from .tracing import span
+
+PINNED_MESSAGES = 3   # The system prompt, user info and intro every session starts with
+SUMMARY_BLOCK_SIZE = 8
+
+def message_digest(role: str, text: str) -> str:
+  """The key messages are deduplicated on: the role and the text, normalized like the analysis cache does it.
+
+  Args:
+    role (str): The role of the message.
+    text (str): The message.
+
+  Returns:
+    str: A hex digest.
+  """
+  return hashlib.sha256(f"{role}\0{AnalysisCache.normalize(text)}".encode("utf-8")).hexdigest()
+
+def find_chat_logs(paths: list) -> list:
+  """Expands directories into the chat logs inside them.
+
+  Args:
+    paths (list): Chat log files and directories holding them.
+
+  Returns:
+    list: The chat log files, sorted by name (so by date) within each directory.
+  """
+  files = []
+  for path in paths:
+    if os.path.isdir(path):
+      names = sorted(name for name in os.listdir(path) if name.startswith("chat_") and name.endswith((".json", ".jsonl")))
+      files.extend(os.path.join(path, name) for name in names)
+    else:
+      files.append(path)
+  return [os.path.abspath(path) for path in files]
+
+def read_chat_log(path: str) -> dict:
+  """Reads one chat log into a session: where it came from and its original messages.
+  A .jsonl log is streamed line by line and only its "message" records are read; the "update"
+  records older logs may still contain are ignored.
+
+  Args:
+    path (str): The .jsonl log or exported .json file.
+
+  Returns:
+    dict: "path", "signature", "session_id", "timestamp" and "messages" ((message_id, role, content) tuples).
+  """
+  stat = os.stat(path)
+  session_info = {}
+  messages = []
+  if path.endswith(".json"):
+    with open(path, 'r', encoding='utf-8') as file:
+      chat_data = json.load(file)
+    session_info = chat_data.get("session_info", {})
+    messages = [(entry["message_id"], entry["message"]["role"], entry["message"]["content"]) for entry in chat_data.get("messages", [])]
+  else:
+    with open(path, 'r', encoding='utf-8') as file:
+      for line_number, line in enumerate(file, start=1):
+        line = line.strip()
+        if not line:
+          continue
+        try:
+          record = json.loads(line)
+        except json.JSONDecodeError:
+          logger.warning(f"Skipping unreadable line {line_number} in {path}")
+          continue
+        if record.get("type") == "session":
+          session_info = record["session_info"]
+        elif record.get("type") == "message":
+          messages.append((record["message_id"], record["message"]["role"], record["message"]["content"]))
+  try:
+    timestamp = datetime.strptime(session_info["date-time"], "%Y-%m-%d_%H-%M-%S").isoformat()
+  except (KeyError, TypeError, ValueError):
+    timestamp = datetime.fromtimestamp(stat.st_mtime).isoformat()
+  return {
+    "path": path,
+    "signature": f"{stat.st_mtime_ns}:{stat.st_size}",
+    "session_id": session_info.get("id") or os.path.splitext(os.path.basename(path))[0],
+    "timestamp": timestamp,
+    "messages": messages
+  }
+
+def build_registry(memory_backend: Optional[dict] = None, summarizer_backend: Optional[dict] = None,
+                   onnx_dir: Optional[str] = None, classifier: Optional[dict] = None) -> ModelRegistry:
+  """The default worker registry: the memory analyzers and the summarizer, set up like a session would.
+
+  Args:
+    memory_backend (dict, optional): The inference.memory config section. Defaults to None.
+    summarizer_backend (dict, optional): The inference.summarizer config section. Defaults to None.
+    onnx_dir (str, optional): Where exported ONNX models are kept. Defaults to None.
+    classifier (dict, optional): The memory_classifier config section. Defaults to None.
+
+  Returns:
+    ModelRegistry: A registry of its own (the models load on first use).
+  """
+  from .inference_backend import InferenceBackend
+  from .memory.memory_instance import register_memory_models
+  from .summarizer import register_summarizer_models
+  registry = ModelRegistry()
+  register_memory_models(registry, backend=InferenceBackend.from_config(memory_backend, onnx_dir=onnx_dir),
+                         classifier={key: value for key, value in (classifier or {}).items() if key in ("two_stage", "batch_size")})
+  register_summarizer_models(registry, backend=InferenceBackend.from_config(summarizer_backend, onnx_dir=onnx_dir))
+  return registry
+
+_worker_registry = None
+
+def _init_worker(registry_factory: Callable[..., ModelRegistry], factory_args: tuple, torch_threads: Optional[int]) -> None:
+  global _worker_registry
+  from .inference_backend import configure_threads
+  configure_threads(torch_threads)
+  _worker_registry = registry_factory(*factory_args)
+
+def _transcript(messages: list) -> str:
+  return "\n".join(f"{role}: {content}" for _, role, content in messages)
+
+def process_chunk(chunk: list, batch_size: int = 64, summarize: bool = True) -> dict:
+  """Analyzes and summarizes a chunk of sessions with this process's registry. Nothing is written here.
+
+  Args:
+    chunk (list): Sessions as planned by backfill: "messages" to analyze ((role, text, digest) tuples)
+      and the "transcript" blocks to summarize.
+    batch_size (int, optional): Messages per analyzer call. Defaults to 64.
+    summarize (bool, optional): Summarize the sessions too. Defaults to True.
+
+  Returns:
+    dict: The arguments for MemoryStore.write_batch.
+  """
+  from .memory.memory_instance import analyze_messages
+  registry = _worker_registry
+  pending = [(session["timestamp"], role, text, digest) for session in chunk for role, text, digest in session["messages"]]
+  results = []
+  for i in range(0, len(pending), batch_size):
+    batch = pending[i:i + batch_size]
+    with span("backfill.analyze", messages=len(batch)):
+      analyzed = analyze_messages(registry, [(role, text) for _, role, text, _ in batch])
+    for (timestamp, _, _, _), result in zip(batch, analyzed):
+      result["timestamp"] = timestamp
+    results.extend(analyzed)
+
+  summaries = []
+  blocks = [block for session in chunk for block in session["transcript"]]
+  if summarize and blocks:
+    summarizer = registry.get("summarizer")
+    with span("backfill.summarize", texts=len(blocks)):
+      block_summaries = summarizer.summarize_texts(blocks, batch_size=batch_size)
+      # Sessions longer than a block get a second pass over their block summaries, all in one call.
+      merged, position = [], 0
+      for session in chunk:
+        merged.append(block_summaries[position:position + len(session["transcript"])])
+        position += len(session["transcript"])
+      multi = [i for i, parts in enumerate(merged) if len(parts) > 1]
+      if multi:
+        for i, summary in zip(multi, summarizer.summarize_texts(["\n".join(merged[i]) for i in multi], batch_size=batch_size)):
+          merged[i] = [summary]
+    for session, parts in zip(chunk, merged):
+      if parts:
+        summaries.append({"source": session["session_id"], "timestamp": session["timestamp"],
+                          "messages": session["conversation"], "summary": parts[0]})
+
+  return {
+    "results": results,
+    "summaries": summaries,
+    "processed_messages": [digest for _, _, _, digest in pending],
+    "processed_sources": [(session["path"], session["signature"]) for session in chunk]
+  }
+
+def _plan_chunks(files: list, store: MemoryStore, chunk_size: int, summarize: bool, stats: dict) -> Iterator[list]:
+  """Reads the logs one at a time and groups their new messages into chunks of whole sessions."""
+  seen = set()
+  chunk, size = [], 0
+  for path in files:
+    try:
+      session = read_chat_log(path)
+    except (OSError, ValueError, KeyError) as e:
+      logger.error(f"Skipping chat log {path}: {e}")
+      stats["failed_files"] += 1
+      continue
+    if store.processed_source(path) == session["signature"]:
+      stats["skipped_files"] += 1
+      continue
+    conversation = [message for message in session["messages"]
+                    if message[0] >= PINNED_MESSAGES and message[1] in ("user", "assistant") and message[2]]
+    stats["messages"] += len(conversation)
+    candidates = {}
+    for _, role, content in conversation:
+      digest = message_digest(role, content)
+      if digest in seen or digest in candidates:
+        stats["duplicates"] += 1
+      else:
+        candidates[digest] = (role, content, digest)
+    done = store.processed_messages(list(candidates))
+    stats["duplicates"] += len(done)
+    seen.update(candidates)
+    session["messages"] = [message for digest, message in candidates.items() if digest not in done]
+    session["conversation"] = len(conversation)
+    session["transcript"] = [_transcript(conversation[i:i + SUMMARY_BLOCK_SIZE])
+                             for i in range(0, len(conversation), SUMMARY_BLOCK_SIZE)] if summarize else []
+    chunk.append(session)
+    size += len(session["messages"])
+    if size >= chunk_size:
+      yield chunk
+      chunk, size = [], 0
+  if chunk:
+    yield chunk
+
+def backfill(paths: list, memory_dir: str, workers: int = 1, chunk_size: int = 256, batch_size: int = 64,
+             summarize: bool = True, registry_factory: Callable[..., ModelRegistry] = build_registry,
+             factory_args: tuple = (), torch_threads: Optional[int] = None) -> dict:
+  """Replays chat logs through memory extraction (and summarization) into a memory store.
+  Safe to interrupt: finished chunks are checkpointed in the store, and the next run skips the log
+  files that haven't changed since and the messages that were already processed.
+
+  Args:
+    paths (list): Chat log files and directories holding them.
+    memory_dir (str): The memory directory the store lives in (a persona's memory_data).
+    workers (int, optional): Worker processes, 0 to run everything in this process. Defaults to 1.
+    chunk_size (int, optional): New messages per chunk (the unit of work and of checkpointing). Defaults to 256.
+    batch_size (int, optional): Messages per analyzer call, texts per summarizer call. Defaults to 64.
+    summarize (bool, optional): Also write a summary of every session. Defaults to True.
+    registry_factory (Callable[..., ModelRegistry], optional): Builds each worker's models; has to be
+      a module-level function, as it's sent to the workers. Defaults to build_registry.
+    factory_args (tuple, optional): Arguments for registry_factory. Defaults to ().
+    torch_threads (int, optional): Torch threads per worker. Defaults to the CPU count split between the workers.
+
+  Returns:
+    dict: Counts ("files", "skipped_files", "failed_files", "messages", "duplicates", "analyzed", "summaries"),
+      "elapsed" seconds and "messages_per_second" (messages read, duplicates included).
+  """
+  files = find_chat_logs(paths)
+  stats = {"files": len(files), "skipped_files": 0, "failed_files": 0, "messages": 0, "duplicates": 0, "analyzed": 0,
+           "summaries": 0}
+  if torch_threads is None and workers > 0:
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+  store = MemoryStore(memory_dir)
+  store.migrate_json()
+  executor = None
+  start = time.perf_counter()
+
+  def write(output: dict) -> None:
+    store.write_batch(**output)
+    stats["analyzed"] += len(output["results"])
+    stats["summaries"] += len(output["summaries"])
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    logger.info(f"Backfill: {stats['analyzed']} message(s) analyzed, {stats['duplicates']} duplicate(s) skipped, "
+                f"{stats['messages'] / elapsed:.1f} messages/s.")
+
+  try:
+    chunks = _plan_chunks(files, store, chunk_size, summarize, stats)
+    if workers <= 0:
+      _init_worker(registry_factory, factory_args, torch_threads)
+      for chunk in chunks:
+        write(process_chunk(chunk, batch_size, summarize))
+    else:
+      # Spawned workers don't inherit the parent's threads or torch state.
+      executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker,
+                                     initargs=(registry_factory, factory_args, torch_threads))
+      # A few chunks in flight per worker keeps them busy; results are written in order.
+      in_flight = deque()
+      for chunk in chunks:
+        in_flight.append(executor.submit(process_chunk, chunk, batch_size, summarize))
+        if len(in_flight) > workers * 2:
+          write(in_flight.popleft().result())
+      while in_flight:
+        write(in_flight.popleft().result())
+  finally:
+    if executor is not None:
+      executor.shutdown(cancel_futures=True)
+    store.close()
+
+  stats["elapsed"] = time.perf_counter() - start
+  stats["messages_per_second"] = stats["messages"] / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+  logger.info(f"Backfill finished: {stats}")
+  return stats
+
+def main() -> None:
+  package_dir = os.path.dirname(os.path.abspath(__file__))
+  config_file = os.path.join(package_dir, "configs", "config.json")
+  config = get_shared_config_registry().load_json(config_file) if os.path.exists(config_file) else {}
+  options = config.get("backfill") or {}
+  inference = config.get("inference", {})
+
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("paths", nargs="*", default=[os.path.join(package_dir, "chat_logs")],
+                      help="Chat log files or directories (default: llmimic/chat_logs).")
+  parser.add_argument("--persona", default=config.get("persona_name", "generic"), help="Persona whose memory is backfilled.")
+  parser.add_argument("--memory-dir", help="Memory directory to write to instead of the persona's.")
+  parser.add_argument("--workers", type=int, default=options.get("workers", 1), help="Worker processes (0 runs inline).")
+  parser.add_argument("--chunk-size", type=int, default=options.get("chunk_size", 256), help="New messages per checkpointed chunk.")
+  parser.add_argument("--batch-size", type=int, default=options.get("batch_size", 64), help="Messages per analyzer call.")
+  parser.add_argument("--no-summarize", dest="summarize", action="store_false", default=options.get("summarize", True),
+                      help="Skip the session summaries.")
+  args = parser.parse_args()
+
+  memory_dir = args.memory_dir or os.path.join(package_dir, "persona", args.persona, "memory_data")
+  onnx_dir = os.path.abspath(os.path.join(package_dir, config.get("onnx_dir", "cache/onnx")))
+  stats = backfill(args.paths, memory_dir, workers=args.workers, chunk_size=args.chunk_size, batch_size=args.batch_size,
+                   summarize=args.summarize, factory_args=(inference.get("memory"), inference.get("summarizer"), onnx_dir,
+                                               config.get("memory_classifier")))
+  print(f"{stats['files']} log(s) ({stats['skipped_files']} unchanged, {stats['failed_files']} unreadable), "
+        f"{stats['messages']} message(s), {stats['duplicates']} duplicate(s), {stats['analyzed']} analyzed, "
+        f"{stats['summaries']} summary(ies) in {stats['elapsed']:.1f} s: {stats['messages_per_second']:.1f} messages/s")
+
+if __name__ == "__main__":
+  main()
@@ -1,30 +1,48 @@
-from transformers import AutoTokenizer
-from datasets import Dataset
 from datetime import datetime
 import uuid
-import json
 import os
-from . import logger, UserData, ExecutionTimer
-from .summarizer import Summarizer
+from . import logger, UserData
+from .chat_log import ChatLog
+from .context_window import ContextWindow
+from .inference_backend import InferenceBackend
+from .model_registry import ModelRegistry, get_shared_registry
+from .rolling_summary import RollingSummary
+from .summarizer import Summarizer, register_summarizer_models
+from .tracing import span
 
 class ChatInstance:
-  summarize_interval = 8  # How many new messages trigger summarization
-  recent_skip = 4         # How many latest messages to skip for summarization
-  max_length = 130        # Max token length before summarization
+  summary_block_size = 8           # How many messages go into one block summary
+  recent_skip = 4                  # How many latest messages always stay verbatim
+  summary_max_blocks = 4           # Block summaries kept before they're merged into the running summary
+  summarize_in_background = True   # Summarize on a worker thread instead of inside the turn
+  log_flush_every = 8              # How many log records to buffer before writing
 
-  def __init__(self, user_data: UserData):
+  def __init__(self, user_data: UserData, registry: ModelRegistry = None, backend: InferenceBackend = None):
     """Init for Chat class.
 
     Args:
       user_data (UserData): The data for usering.
+      registry (ModelRegistry, optional): Where the summarizer is kept. Defaults to the shared registry.
+      backend (InferenceBackend, optional): How the summarizer runs. Defaults to None (plain torch).
     """
     self.chat_id = None
     self.chat_json_path = None
+    self._chat_log = None
+    self.context_window = None
     self.message_history=[]
-    self._summarize_index=3
     self._message_index=0
-    self.summarizer=Summarizer()
-    self.timer=ExecutionTimer()
+    self.registry=registry if registry is not None else get_shared_registry()
+    register_summarizer_models(self.registry, backend=backend)
+    self.rolling_summary = RollingSummary(
+      self.message_history,
+      self.summarize_texts,
+      start=3,
+      block_size=self.summary_block_size,
+      recent_keep=self.recent_skip,
+      max_blocks=self.summary_max_blocks,
+      on_commit=self._commit_summary,
+      background=self.summarize_in_background,
+    )
     self._start(user_data=user_data)
 
   def _start(self, user_data: UserData) -> None:
@@ -42,57 +60,64 @@ class ChatInstance:
     # Create 'chat_logs' directory if it doesn't exist
     os.makedirs(chat_dir, exist_ok=True)
 
-    chat_filename = os.path.abspath(os.path.join(chat_dir, f"chat_{current_datetime}.json"))
+    chat_filename = os.path.abspath(os.path.join(chat_dir, f"chat_{current_datetime}.jsonl"))
     self.chat_json_path = chat_filename
 
-    chat_data = {
-        "session_info": {
-            "id": self.chat_id,
-            "date-time": current_datetime,
-            "user_data": {
-                "name": user_data.name,
-                "birthday": user_data.birthday,
-                "sex": user_data.sex,
-                "race": user_data.race,
-                "details": user_data.details
-            }
-        },
-        "messages": []
+    session_info = {
+        "id": self.chat_id,
+        "date-time": current_datetime,
+        "user_data": {
+            "name": user_data.name,
+            "birthday": user_data.birthday,
+            "sex": user_data.sex,
+            "race": user_data.race,
+            "details": user_data.details
+        }
     }
 
-    with open(chat_filename, 'w') as json_file:
-        json.dump(chat_data, json_file, indent=4)
+    self._chat_log = ChatLog(chat_filename, flush_every=self.log_flush_every)
+    self._chat_log.start_session(session_info)
 
     logger.info(f"Chat initialized. Chat data saved to {chat_filename}")
 
-  def _append_chat_log(self, message: str, message_id: int) -> None:
+  def _append_chat_log(self, message: dict, message_id: int) -> None:
     """Internal function for appending to chat log.
+    Only the new message is written (append-only JSONL), in batches.
 
     Args:
-      message (str): The message to append.
+      message (dict): The message to append.
       message_id (int): The message ID to append.
-    """    
-    if self.chat_json_path is None:
+    """
+    if self._chat_log is None:
       logger.error("No chat initialized. Please create a chat first.")
       return
-    
-    try:
-      with open(self.chat_json_path, 'r+') as file:
-        log_data = json.load(file)
-
-        log_data["messages"].append({
-          "message": message,
-          "message_id": message_id
-        })
-
-        file.seek(0)
-        json.dump(log_data, file, indent=4)
-        
-      logger.info(f"Message appended to chat {self.chat_json_path}")
-    
-    except FileNotFoundError:
-      logger.error(f"File {self.chat_json_path} not found. Please initialize the chat first.")
-  
+
+    self._chat_log.append(message, message_id)
+    logger.debug("Message appended to chat %s", self.chat_json_path)
+
+  def export_chat_log(self, export_path: str = None) -> dict:
+    """Compacts the append-only log into the session_info + messages JSON format.
+
+    Args:
+      export_path (str, optional): Where to write it. Defaults to the log path with a .json extension.
+
+    Returns:
+      dict: The compacted chat data.
+    """
+    if export_path is None:
+      export_path = os.path.splitext(self.chat_json_path)[0] + ".json"
+    return self._chat_log.export(export_path)
+
+  def close(self) -> None:
+    """Lets a running summary finish, flushes anything still buffered and closes the chat log."""
+    self.rolling_summary.close()
+    if self._chat_log is not None:
+      self._chat_log.close()
+
+  @property
+  def summarizer(self) -> Summarizer:
+    return self.registry.get("summarizer")
+
   def append_message(self, role: str, message: str) -> None:
     """Function for appending messages to the message history.
     Ensures chat log writing and message index incrementing.
@@ -106,60 +131,79 @@ class ChatInstance:
     self._append_chat_log(formatted_message, self._message_index)
     self._message_index += 1
 
-  def format_llm_text(self, role: str, content: str) -> dict:
-    """Easy function for formatting our LLM data.
+  def set_context_window(self, tokenizer, max_tokens: int) -> None:
+    """Enables the token-budgeted context window for build_prompt().
+    The window carries the rolling summary; turns that fall out of it before they're summarized are dropped.
 
     Args:
-      role (str): The role of the message (system, user, assistant).
-      content (str): The content of the message.
-
-    Returns:
-      dict: The formatted message.
+      tokenizer: The chat model's tokenizer.
+      max_tokens (int): Token budget for the prompt.
     """
-    return {"role": role, "content": content}
-  
-  def _get_summarizable_data(self) -> Dataset:
-    """Internal function that batches summarizable data into a Dataset.
+    with self.rolling_summary.lock:
+      self.context_window = ContextWindow(tokenizer, max_tokens, pinned=3)
+      self.context_window.sync(self.message_history)
+      self.context_window.set_summary(self.rolling_summary.text(), self.rolling_summary.upto)
+
+  def summarize_texts(self, texts: list) -> list:
+    """Summarizes chunks of conversation with the shared summarizer.
+
+    Args:
+      texts (list): The texts to summarize.
 
     Returns:
-      Dataset: The summarizable data.
+      list: One summary per text.
     """
-    start_idx = self._summarize_index
-    end_idx = len(self.message_history) - self.recent_skip
-    logger.info(f"Processing from {start_idx} to {end_idx}.")
+    with span("summary.summarize", texts=len(texts)) as summary_span:
+      summaries = self.summarizer.summarize_texts(texts)
+    logger.info(f"Summarizer took {summary_span.format_elapsed()} for {len(texts)} text(s).")
+    return summaries
+
+  def schedule_summary(self) -> None:
+    """Starts summarizing the turns that scrolled past the recent ones, if enough have built up.
+    Doesn't wait for it; build_prompt() uses whatever summary is committed at the time.
+    """
+    self.rolling_summary.schedule()
 
-    summarizable_data = []
-    tokenizer = AutoTokenizer.from_pretrained("facebook/bart-large-cnn")
-    for i in range(start_idx, end_idx):
-      tokenized_input = tokenizer(self.message_history[i]["content"], return_tensors="pt")
-      token_length = tokenized_input['input_ids'].size(1)
-      if token_length > self.max_length:
-        summarizable_data.append({"content": self.message_history[i]["content"], "index": i})
+  def _commit_summary(self, rolling_summary: RollingSummary) -> None:
+    """Called (under the summary lock) whenever a new rolling summary is ready.
+    Logs it and hands it to the context window, so the prompt and the log switch over together.
 
-    return Dataset.from_list(summarizable_data) if summarizable_data else None
+    Args:
+      rolling_summary (RollingSummary): The updated summary.
+    """
+    if self._chat_log is not None:
+      self._chat_log.summary(rolling_summary.summary, rolling_summary.blocks, rolling_summary.upto)
+    if self.context_window is not None:
+      self.context_window.set_summary(rolling_summary.text(), rolling_summary.upto)
 
-  def _update_message_history(self, summarized_data):
-    """Internal function to update the message history with the summarized messages.
+  def build_prompt(self, memories: str = None) -> list:
+    """The messages to send to the LLM for the next turn.
 
     Args:
-      summarized_data (_type_): The...summarized...data?
-    """
-    for summary in summarized_data:
-      idx = summary["index"]
-      self.message_history[idx]["content"] = summary["summary_text"]
-      self.append_chat_log(self.message_history[idx]["content"], idx)
+      memories (str, optional): Recalled memories for this turn, added as a system message after the summary. Defaults to None.
 
-  def check_and_summarize(self) -> None:
-    """Function to check if summary is need and perform it.
+    Returns:
+      list: The pinned messages, the rolling summary, the memories and the unsummarized turns (budgeted if a context window is set).
     """
-    if (len(self.message_history) - self._summarize_index) >= self.summarize_interval:
-      dataset = self._get_summarizable_data()
-      if dataset:
-        self.timer.start()
-        logger.info(f"Batching data for summary: {len(dataset)} entries.")
-        summarized_data = self.summarizer.summarize_batch(dataset, len(dataset))
-        timer_str=self.timer.stop()
-        logger.info(f"Summarizer itself took {timer_str} to finish.")
-        self._update_message_history(summarized_data)
-      self._summarize_index = len(self.message_history) - self.recent_skip
+    extra = [self.format_llm_text("system", memories)] if memories else []
+    with self.rolling_summary.lock:
+      if self.context_window is not None:
+        return self.context_window.build(self.message_history, extra=extra)
+      summary = self.rolling_summary.text()
+      upto = self.rolling_summary.upto
+      prompt = list(self.message_history[:3])
+      if summary:
+        prompt.append(self.format_llm_text("system", ContextWindow.summary_prefix + summary))
+      return prompt + extra + self.message_history[upto:]
 
+  def format_llm_text(self, role: str, content: str) -> dict:
+    """Easy function for formatting our LLM data.
+
+    Args:
+      role (str): The role of the message (system, user, assistant).
+      content (str): The content of the message.
+
+    Returns:
+      dict: The formatted message.
+    """
+    return {"role": role, "content": content}
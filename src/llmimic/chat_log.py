@@ -0,0 +1,165 @@
+import atexit
+import json
+import os
+import threading
+from typing import Optional
+from . import logger
+from .tracing import span
+
+class ChatLog:
+  """Append-only chat log: one JSON record per line, written in batches.
+  Nothing already on disk is ever rewritten, so appending a message costs the same no matter
+  how long the session gets. Records look like:
+    {"type": "session", "session_info": {...}}
+    {"type": "message", "message_id": 3, "message": {"role": ..., "content": ...}}
+    {"type": "update", "message_id": 3, "message": {"role": ..., "content": ...}}
+    {"type": "summary", "covers_upto": 19, "summary": "...", "blocks": [...]}
+  An update replaces the message with the same ID; nothing writes them anymore, but older logs
+  can have them. A summary record replaces the previous one: it's the rolling summary of every
+  message before covers_upto.
+  export() compacts everything back into the old session_info + messages JSON format.
+  """
+  def __init__(self, path: str, flush_every: int = 8):
+    """Init for ChatLog.
+
+    Args:
+      path (str): Path of the .jsonl file. Created if it doesn't exist.
+      flush_every (int, optional): How many records to buffer before writing. Defaults to 8.
+    """
+    self.path = path
+    self.flush_every = max(1, flush_every)
+    self._buffer = []
+    self._lock = threading.Lock()
+    self._file = open(path, 'a', encoding='utf-8')
+    atexit.register(self.close)
+
+  def start_session(self, session_info: dict) -> None:
+    """Writes the session header and flushes immediately.
+
+    Args:
+      session_info (dict): The session_info block.
+    """
+    self._write({"type": "session", "session_info": session_info})
+    self.flush()
+
+  def append(self, message: dict, message_id: int) -> None:
+    """Records a new message.
+
+    Args:
+      message (dict): The formatted message.
+      message_id (int): The message ID.
+    """
+    self._write({"type": "message", "message_id": message_id, "message": message})
+
+  def summary(self, summary: Optional[str], blocks: list, covers_upto: int) -> None:
+    """Records a new rolling summary and flushes, so the log never lags behind the prompt.
+
+    Args:
+      summary (str): The running summary.
+      blocks (list): The block summaries after it.
+      covers_upto (int): Every message before this ID is covered.
+    """
+    self._write({"type": "summary", "covers_upto": covers_upto, "summary": summary, "blocks": blocks})
+    self.flush()
+
+  def _write(self, record: dict) -> None:
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with self._lock:
+      self._buffer.append(line)
+      should_flush = len(self._buffer) >= self.flush_every
+    if should_flush:
+      self.flush()
+
+  def flush(self) -> None:
+    """Writes any buffered records to disk."""
+    with self._lock:
+      if not self._buffer or self._file is None:
+        return
+      with span("io.chat_log.flush", records=len(self._buffer)):
+        self._file.write("".join(self._buffer))
+        self._file.flush()
+      self._buffer.clear()
+
+  def close(self) -> None:
+    """Flushes and closes the log. Safe to call more than once."""
+    self.flush()
+    with self._lock:
+      if self._file is not None:
+        self._file.close()
+        self._file = None
+    atexit.unregister(self.close)
+
+  def export(self, export_path: Optional[str] = None) -> dict:
+    """Compacts the log into the session_info + messages format.
+
+    Args:
+      export_path (str, optional): Where to write the compacted JSON. Defaults to None (don't write).
+
+    Returns:
+      dict: The compacted chat data.
+    """
+    self.flush()
+    chat_data = self.read(self.path)
+    if export_path is not None:
+      tmp_path = export_path + ".tmp"
+      with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(chat_data, file, indent=4)
+      os.replace(tmp_path, export_path)
+      logger.info(f"Chat log exported to {export_path}")
+    return chat_data
+
+  @staticmethod
+  def read(path: str) -> dict:
+    """Replays a .jsonl log (or loads an old .json one) into the session_info + messages format.
+
+    Args:
+      path (str): Path of the log.
+
+    Returns:
+      dict: The chat data, with updates already applied (and the latest rolling summary, if there is one).
+    """
+    if path.endswith(".json"):
+      with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+    session_info = {}
+    messages = {}
+    summary = None
+    with open(path, 'r', encoding='utf-8') as file:
+      for line_number, line in enumerate(file, start=1):
+        line = line.strip()
+        if not line:
+          continue
+        try:
+          record = json.loads(line)
+        except json.JSONDecodeError:
+          # A crash mid-write can leave a partial last line, everything before it is still good.
+          logger.warning(f"Skipping unreadable line {line_number} in {path}")
+          continue
+        record_type = record.get("type")
+        if record_type == "session":
+          session_info = record["session_info"]
+        elif record_type == "message" or (record_type == "update" and record["message_id"] in messages):
+          messages[record["message_id"]] = record["message"]
+        elif record_type == "summary":
+          summary = {key: record[key] for key in ("covers_upto", "summary", "blocks")}
+
+    chat_data = {
+      "session_info": session_info,
+      "messages": [{"message": messages[message_id], "message_id": message_id} for message_id in sorted(messages)]
+    }
+    if summary is not None:
+      chat_data["summary"] = summary
+    return chat_data
+
+  @staticmethod
+  def load_message_history(path: str) -> list:
+    """Rebuilds message_history from a log.
+
+    Args:
+      path (str): Path of the log.
+
+    Returns:
+      list: The messages in order, ready to hand to the LLM.
+    """
+    return [entry["message"] for entry in ChatLog.read(path)["messages"]]
@@ -1 +1,3 @@
-from chess_instance import ChessInstance
\ No newline at end of file
+from .chess_instance import ChessInstance
+from .chess_service import ChessService, get_shared_chess_service, register_chess_models
+from .move_engine import MoveEngine
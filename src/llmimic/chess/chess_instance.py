@@ -1,6 +1,11 @@
+import logging
+import uuid
 import chess
-from transformers import LlamaTokenizerFast, LlamaForCausalLM
+from typing import Optional
 from llmimic import logger
+from llmimic.model_registry import get_shared_registry
+from .chess_service import ChessService, register_chess_models
+from .move_engine import MoveEngine
 
 class ChessInstance:
   """I wrote this chess class that prompts an LLM for moves and manages the various aspects of a game:
@@ -10,13 +15,41 @@ class ChessInstance:
   decisions were made as they were. Until I can refactor and rewrite some of this, I apologize for not being 
   100% on some things.
   """
-  def __init__(self, difficulty_level="normal"):
+  def __init__(self, difficulty_level="normal", model=None, tokenizer=None, move_strategy: str = "constrained",
+               service: Optional[ChessService] = None):
+    """Init for ChessInstance.
+
+    Args:
+      difficulty_level (str, optional): One of difficulty_settings. Defaults to "normal".
+      model (optional): The chess LLM. Defaults to lazy-guy12/chess-llama from the shared registry.
+      tokenizer (optional): Its tokenizer. Defaults to the one for lazy-guy12/chess-llama from the shared registry.
+      move_strategy (str, optional): "constrained" or "batched", see MoveEngine. Defaults to "constrained".
+      service (ChessService, optional): Picks the moves batched with other games, reusing this game's
+        KV cache between moves. Overrides model, tokenizer and move_strategy. Defaults to None.
+    """
     self.board = chess.Board()
     self.moves_uci = []
     self.difficulty_level = difficulty_level
-
-    self.tokenizer = LlamaTokenizerFast.from_pretrained('lazy-guy12/chess-llama')
-    self.model = LlamaForCausalLM.from_pretrained('lazy-guy12/chess-llama')
+    self.game_id = uuid.uuid4().hex
+    self.service = service
+
+    self._held = []
+    if service is not None:
+      model, tokenizer = service.model, service.tokenizer
+    elif model is None or tokenizer is None:
+      # Held until close(), so idle eviction doesn't drop the model mid-game.
+      registry = get_shared_registry()
+      register_chess_models(registry)
+      if model is None:
+        model = registry.acquire("chess_model")
+        self._held.append("chess_model")
+      if tokenizer is None:
+        tokenizer = registry.acquire("chess_tokenizer")
+        self._held.append("chess_tokenizer")
+    self.tokenizer = tokenizer
+    self.model = model
+    self.model.eval()
+    self.move_engine = MoveEngine(self.model, self.tokenizer, strategy=move_strategy)
 
     self.difficulty_settings = {
         "very_easy": {"temperature": 1.0, "top_k": 100, "retries": 100},
@@ -36,45 +69,19 @@ class ChessInstance:
 
   def _play_llama(self) -> str:
     """Internal function for prompting the chess LLM for the next move.
+    The difficulty's temperature and top_k shape the sampling; retries caps the candidates in batched mode.
 
     Returns:
       str: Next move in UCI format.
     """
-    input_text = "1-0 " + " ".join(self.moves_uci)
-    logger.info(f"AI Input Moves (UCI): {input_text}")
-    inputs = self.tokenizer(input_text, return_tensors="pt")
-    
-    params = self.get_difficulty_params()
-    temperature = params["temperature"]
-    top_k = params["top_k"]
-    max_retries = params["retries"]
-
-    for attempt in range(max_retries):
-      generated = self.model.generate(
-          input_ids=inputs['input_ids'],
-          max_new_tokens=5,
-          do_sample=True,
-          top_k=top_k,
-          temperature=temperature,
-      )
-
-      generated_move_full = self.tokenizer.decode(generated[0], skip_special_tokens=True)
-      logger.debug(f"Attempt {attempt + 1} - Full Generated Move: {generated_move_full}")
-
-      move_index = len(self.moves_uci) + 1
-      generated_move = generated_move_full.split()[move_index] if len(generated_move_full.split()) > move_index else ""
-      logger.debug(f"Attempt {attempt + 1} - Trimmed Move (UCI): {generated_move}")
-      
-      try:
-        generated_move_obj = chess.Move.from_uci(generated_move)
-        if self.board.is_legal(generated_move_obj):
-          return generated_move
-        else:
-          logger.debug(f"Move {generated_move} is illegal on the current board.")
-      except ValueError:
-        logger.debug(f"Invalid UCI move format: {generated_move}")
-
-    return "0000"
+    if logger.isEnabledFor(logging.DEBUG):
+      logger.debug("AI Input Moves (UCI): %s", MoveEngine.build_prompt(self.moves_uci))
+    if self.service is not None:
+      return self.service.choose_move(self.game_id, self.board, self.moves_uci, self.get_difficulty_params())
+    move = self.move_engine.choose_move(self.board, self.moves_uci, self.get_difficulty_params())
+    logger.debug("AI picked %s after %d forward pass(es), %d candidate(s).", move,
+                 self.move_engine.last_forward_passes, self.move_engine.last_candidates)
+    return move
 
   def get_valid_moves(self) -> dict:
     """Returns valid moves as a dictionary.
@@ -184,4 +191,12 @@ class ChessInstance:
       except ValueError as e:
         print(f"Invalid UCI move '{uci}': {e}")
         break
-    return san_moves
\ No newline at end of file
+    return san_moves
+
+  def close(self) -> None:
+    """Frees the game's cache in the service, if it plays through one, and hands back the registry's models."""
+    if self.service is not None:
+      self.service.end_game(self.game_id)
+    for name in self._held:
+      get_shared_registry().release(name)
+    self._held = []
\ No newline at end of file
@@ -0,0 +1,450 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Optional
+import chess
+import torch
+from transformers import DynamicCache
+from llmimic import logger
+from llmimic.model_registry import ModelRegistry, get_shared_registry
+from .move_engine import MoveEngine
+
+model_id = "lazy-guy12/chess-llama"
+
+def _load_chess_model():
+  from transformers import LlamaForCausalLM
+  model = LlamaForCausalLM.from_pretrained(model_id)
+  model.eval()
+  return model
+
+def _load_chess_tokenizer():
+  from transformers import LlamaTokenizerFast
+  return LlamaTokenizerFast.from_pretrained(model_id)
+
+def register_chess_models(registry: ModelRegistry) -> None:
+  """Registers the chess LLM and its tokenizer with a registry. Already registered names are left alone.
+
+  Args:
+    registry (ModelRegistry): The registry to register with.
+  """
+  registry.register("chess_model", _load_chess_model)
+  registry.register("chess_tokenizer", _load_chess_tokenizer)
+
+class _MoveRequest:
+  __slots__ = ("game_id", "board", "moves_uci", "params", "future", "enqueued_at")
+
+  def __init__(self, game_id: str, board: chess.Board, moves_uci: list, params: dict):
+    self.game_id = game_id
+    self.board = board
+    self.moves_uci = moves_uci
+    self.params = params
+    self.future = Future()
+    self.enqueued_at = time.monotonic()
+
+class _GameState:
+  """What the service keeps between a game's moves: its prompt tokens and the KV cache over them."""
+  __slots__ = ("moves", "prompt_ids", "fed_ids", "cache")
+
+  def __init__(self, base_ids: list):
+    self.moves = []
+    self.prompt_ids = list(base_ids)
+    self.fed_ids = []
+    self.cache = None  # [(keys, values)] per layer, each (1, heads, len(fed_ids), head_dim).
+
+class _Row:
+  """One game's decode in the current batch."""
+  __slots__ = ("request", "state", "node", "pending", "fed_ids", "cache", "passes")
+
+  def __init__(self, request: _MoveRequest, state: _GameState, node: dict, pending: list, fed_ids: list, cache):
+    self.request = request
+    self.state = state
+    self.node = node
+    self.pending = pending
+    self.fed_ids = fed_ids
+    self.cache = cache
+    self.passes = 0
+
+def _cache_from_layers(layers: list) -> DynamicCache:
+  """Builds a DynamicCache from (keys, values) per layer, on both cache APIs (4.47's legacy tuples and 4.56+'s layers)."""
+  if hasattr(DynamicCache, "from_legacy_cache"):
+    return DynamicCache.from_legacy_cache(tuple(layers))
+  return DynamicCache(layers)
+
+def _cache_layers(cache) -> list:
+  """(keys, values) per layer of a cache returned by the model, on both cache APIs."""
+  if hasattr(cache, "layers"):
+    return [(layer.keys, layer.values) for layer in cache.layers]
+  if hasattr(cache, "key_cache"):
+    return list(zip(cache.key_cache, cache.value_cache))
+  return [(keys, values) for keys, values in cache]
+
+class ChessService:
+  """Hosts one chess LLM for many concurrent games and picks their moves together.
+  Games submit move requests from their own threads; a scheduling thread collects them into batches
+  (up to max_batch_size, or whatever arrived within max_wait of the oldest) and runs MoveEngine's
+  constrained decoding for all of them in the same forward passes. A game's prompt only ever grows
+  by the moves played since its last request, so the service keeps each game's token IDs and KV
+  cache and only tokenizes and prefills the new moves. Moves are tokenized once each and reused
+  across games, as long as the tokenizer splits the prompt on the spaces between moves (checked
+  at startup); otherwise every request tokenizes the full prompt, and the cache is still reused up
+  to the first differing token. Games that don't tokenize cleanly fall back to MoveEngine's batched
+  sampling. At most max_games caches are kept, the least recently used go first.
+  """
+  def __init__(self, model=None, tokenizer=None, registry: Optional[ModelRegistry] = None, max_batch_size: int = 16,
+               max_wait: float = 0.005, max_games: int = 256):
+    """Init for ChessService. Starts the scheduling thread.
+
+    Args:
+      model (optional): The chess causal LM. Defaults to lazy-guy12/chess-llama from the registry.
+      tokenizer (optional): Its tokenizer. Defaults to the one for lazy-guy12/chess-llama from the registry.
+      registry (ModelRegistry, optional): Where the default model is kept. Defaults to the shared registry.
+      max_batch_size (int, optional): Max games per forward batch. Defaults to 16.
+      max_wait (float, optional): Max seconds a request waits for others to batch with. Defaults to 0.005.
+      max_games (int, optional): Games whose KV cache is kept between moves. Defaults to 256.
+    """
+    # Whatever comes from the registry is held until close(), so idle eviction leaves it alone.
+    self._registry = None
+    self._held = []
+    if model is None or tokenizer is None:
+      self._registry = registry if registry is not None else get_shared_registry()
+      register_chess_models(self._registry)
+      if model is None:
+        model = self._registry.acquire("chess_model")
+        self._held.append("chess_model")
+      if tokenizer is None:
+        tokenizer = self._registry.acquire("chess_tokenizer")
+        self._held.append("chess_tokenizer")
+    self.model = model
+    self.tokenizer = tokenizer
+    self.engine = MoveEngine(model, tokenizer)
+    self.max_batch_size = max_batch_size
+    self.max_wait = max_wait
+    self.max_games = max_games
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    self.pad_token_id = pad_token_id if pad_token_id is not None else 0
+
+    self._base_ids = tokenizer(MoveEngine.build_prompt([]).rstrip())["input_ids"]
+    self._move_ids = {}
+    self.incremental = self._check_incremental()
+    if not self.incremental:
+      logger.warning("Chess tokenizer doesn't split moves on spaces, tokenizing full prompts instead.")
+
+    self._games = OrderedDict()
+    self._pending = []
+    self._condition = threading.Condition()
+    self._closed = False
+    self._stats = {"batches": 0, "requests": 0, "forward_passes": 0, "reused_tokens": 0, "prefilled_tokens": 0}
+    self._thread = threading.Thread(target=self._run, name="ChessService", daemon=True)
+    self._thread.start()
+
+  def _tokenize_move(self, move: str) -> list:
+    ids = self._move_ids.get(move)
+    if ids is None:
+      ids = self.tokenizer(MoveEngine.build_prompt([move]))["input_ids"][len(self._base_ids):]
+      self._move_ids[move] = ids
+    return ids
+
+  def _check_incremental(self) -> bool:
+    """Whether a prompt is its base tokens plus each move's tokens, so moves can be tokenized on their own.
+    Tried on a short game with a capture, castling and a promotion.
+    """
+    moves = ["e2e4", "d7d5", "e4d5", "g8f6", "g1f3", "f6d5", "f1c4", "d5b6", "e1g1", "b6c4", "b2b4", "a7a5",
+             "b4a5", "a8a6", "a5a6", "c8e6", "a6b7", "c4d2", "b7b8q"]
+    expected = self.tokenizer(MoveEngine.build_prompt(moves))["input_ids"]
+    built = list(self._base_ids)
+    for move in moves:
+      ids = self._tokenize_move(move)
+      if not ids:
+        return False
+      built += ids
+    self._move_ids.clear()
+    return built == expected
+
+  def choose_move(self, game_id: str, board: chess.Board, moves_uci: list, params: dict) -> str:
+    """Picks the next move for a game, batched with whatever other games are asking. Blocks until it's picked.
+
+    Args:
+      game_id (str): Identifies the game (and its cache) across moves.
+      board (chess.Board): The current position.
+      moves_uci (list): The moves so far, in UCI format.
+      params (dict): The difficulty parameters (temperature, top_k, retries).
+
+    Returns:
+      str: The move in UCI format, or "0000" if the fallback sampling found no legal move.
+    """
+    return self.submit(game_id, board, moves_uci, params).result()
+
+  def submit(self, game_id: str, board: chess.Board, moves_uci: list, params: dict) -> Future:
+    """Queues a move request for a game.
+
+    Args:
+      game_id (str): Identifies the game (and its cache) across moves.
+      board (chess.Board): The current position.
+      moves_uci (list): The moves so far, in UCI format.
+      params (dict): The difficulty parameters (temperature, top_k, retries).
+
+    Raises:
+      RuntimeError: The service has been closed.
+
+    Returns:
+      Future: Resolves to the move in UCI format.
+    """
+    request = _MoveRequest(game_id, board.copy(), list(moves_uci), dict(params))
+    with self._condition:
+      if self._closed:
+        raise RuntimeError("Chess service is closed.")
+      self._pending.append(request)
+      self._condition.notify_all()
+    return request.future
+
+  def end_game(self, game_id: str) -> None:
+    """Drops a finished game's cache."""
+    with self._condition:
+      self._games.pop(game_id, None)
+
+  def _next_batch(self) -> list:
+    """Waits for the oldest request, then collects others until the batch is full or max_wait runs out.
+    A game only gets one request per batch, a second one waits for the next round.
+
+    Returns:
+      list: The requests to run together (empty once closed and drained).
+    """
+    with self._condition:
+      self._condition.wait_for(lambda: self._pending or self._closed)
+      if not self._pending:
+        return []
+      deadline = self._pending[0].enqueued_at + self.max_wait
+      while not self._closed:
+        remaining = deadline - time.monotonic()
+        if len(self._pending) >= self.max_batch_size or remaining <= 0:
+          break
+        self._condition.wait(remaining)
+      batch = []
+      games = set()
+      for request in self._pending:
+        if request.game_id not in games:
+          games.add(request.game_id)
+          batch.append(request)
+          if len(batch) == self.max_batch_size:
+            break
+      for request in batch:
+        self._pending.remove(request)
+      return batch
+
+  def _run(self) -> None:
+    while True:
+      batch = self._next_batch()
+      if not batch:
+        return
+      try:
+        self._play(batch)
+      except Exception as e:
+        logger.error(f"Batched move selection failed: {e}")
+        for request in batch:
+          if not request.future.done():
+            request.future.set_exception(e)
+
+  def _game_state(self, game_id: str, moves_uci: list) -> _GameState:
+    with self._condition:
+      state = self._games.get(game_id)
+      if state is None or state.moves != moves_uci[:len(state.moves)]:
+        state = _GameState(self._base_ids)
+        self._games[game_id] = state
+      self._games.move_to_end(game_id)
+      while len(self._games) > self.max_games:
+        self._games.popitem(last=False)
+      return state
+
+  def _prepare(self, request: _MoveRequest, legal: list) -> Optional[_Row]:
+    """Brings the game's prompt up to date and lines up its decode.
+
+    Returns:
+      _Row: The game's row, or None if the legal moves don't tokenize cleanly.
+    """
+    state = self._game_state(request.game_id, request.moves_uci)
+    if self.incremental:
+      for move in request.moves_uci[len(state.moves):]:
+        state.prompt_ids += self._tokenize_move(move)
+      continuations = {move: self._tokenize_move(move) for move in legal}
+    else:
+      prompt = MoveEngine.build_prompt(request.moves_uci)
+      state.prompt_ids = self.tokenizer(prompt)["input_ids"]
+      continuations = self.engine._continuations(prompt, legal)
+    state.moves = list(request.moves_uci)
+    if not continuations:
+      return None
+
+    # Keep at least one prompt token to feed, the first choice needs the logits after it.
+    prompt_ids = state.prompt_ids
+    reuse = 0
+    for cached, new in zip(state.fed_ids, prompt_ids[:-1]):
+      if cached != new:
+        break
+      reuse += 1
+    cache = None
+    if reuse and state.cache is not None:
+      cache = [(keys[:, :, :reuse], values[:, :, :reuse]) for keys, values in state.cache]
+    else:
+      reuse = 0
+    self._stats["reused_tokens"] += reuse
+    self._stats["prefilled_tokens"] += len(prompt_ids) - reuse
+    return _Row(request, state, MoveEngine._build_trie(continuations), prompt_ids[reuse:], prompt_ids[:reuse], cache)
+
+  def _play(self, batch: list) -> None:
+    rows = []
+    for request in batch:
+      legal = [move.uci() for move in request.board.legal_moves]
+      if not legal:
+        request.future.set_result("0000")
+        continue
+      row = self._prepare(request, legal)
+      if row is None:
+        logger.warning("Legal moves don't tokenize cleanly after the prompt, sampling candidates instead.")
+        self.end_game(request.game_id)
+        prompt = MoveEngine.build_prompt(request.moves_uci)
+        request.future.set_result(self.engine._sample_batched(request.board, prompt, len(request.moves_uci),
+                                                              request.params))
+        continue
+      rows.append(row)
+
+    active = rows
+    while active:
+      waiting = []
+      for row in active:
+        # Tokens with only one legal continuation are taken without running the model.
+        while not (None in row.node and len(row.node) == 1):
+          choices = [token for token in row.node if token is not None]
+          if len(choices) > 1:
+            waiting.append(row)
+            break
+          row.pending.append(choices[0])
+          row.node = row.node[choices[0]]
+        else:
+          self._finish(row)
+      if not waiting:
+        break
+      for row, logits in zip(waiting, self._forward(waiting)):
+        choices = [token for token in row.node if token is not None]
+        params = row.request.params
+        token = self.engine._pick(logits, choices, params["temperature"], params["top_k"])
+        row.pending = [token]
+        row.node = row.node[token]
+      active = waiting
+
+    with self._condition:
+      self._stats["batches"] += 1
+      self._stats["requests"] += len(batch)
+    logger.debug("Picked moves for a batch of %d game(s).", len(batch))
+
+  def _finish(self, row: _Row) -> None:
+    row.state.fed_ids = row.fed_ids
+    row.state.cache = row.cache
+    row.request.future.set_result(row.node[None])
+
+  def _forward(self, rows: list) -> torch.Tensor:
+    """Runs one forward pass over several games' pending tokens, on top of their own caches.
+    Caches and inputs are both left-padded: a row reads [cache padding][cache][input padding][input],
+    with the padding masked out and positions counted from the game's own cache length.
+
+    Args:
+      rows (list): The rows to run.
+
+    Returns:
+      torch.Tensor: The last position's logits for each row, shape (len(rows), vocab).
+    """
+    device = self.model.device
+    cache_lengths = [len(row.fed_ids) for row in rows]
+    pending_lengths = [len(row.pending) for row in rows]
+    longest_cache = max(cache_lengths)
+    longest_pending = max(pending_lengths)
+
+    input_ids, attention_mask, position_ids = [], [], []
+    for row, cached, count in zip(rows, cache_lengths, pending_lengths):
+      input_padding = longest_pending - count
+      input_ids.append([self.pad_token_id] * input_padding + row.pending)
+      attention_mask.append([0] * (longest_cache - cached) + [1] * cached + [0] * input_padding + [1] * count)
+      position_ids.append([0] * input_padding + list(range(cached, cached + count)))
+
+    past = DynamicCache()
+    if longest_cache:
+      template = next(row.cache for row in rows if row.cache is not None)
+      layers = []
+      for layer, (keys, values) in enumerate(template):
+        batch_keys, batch_values = [], []
+        for row, cached in zip(rows, cache_lengths):
+          shape = (1, keys.shape[1], longest_cache - cached, keys.shape[3])
+          if row.cache is None:
+            batch_keys.append(keys.new_zeros(shape))
+            batch_values.append(values.new_zeros(shape[:3] + (values.shape[3],)))
+          else:
+            row_keys, row_values = row.cache[layer]
+            batch_keys.append(torch.cat([row_keys.new_zeros(shape), row_keys], dim=2))
+            batch_values.append(torch.cat([row_values.new_zeros(shape[:3] + (row_values.shape[3],)), row_values], dim=2))
+        layers.append((torch.cat(batch_keys), torch.cat(batch_values)))
+      past = _cache_from_layers(layers)
+
+    with torch.inference_mode():
+      outputs = self.model(
+        input_ids=torch.tensor(input_ids, device=device),
+        attention_mask=torch.tensor(attention_mask, device=device),
+        position_ids=torch.tensor(position_ids, device=device),
+        past_key_values=past,
+        use_cache=True
+      )
+
+    # Split the batch cache back up, dropping the padding.
+    total = longest_cache + longest_pending
+    layers = _cache_layers(outputs.past_key_values)
+    for i, (row, cached, count) in enumerate(zip(rows, cache_lengths, pending_lengths)):
+      row.cache = [
+        (torch.cat([keys[i:i + 1, :, longest_cache - cached:longest_cache], keys[i:i + 1, :, total - count:]], dim=2),
+         torch.cat([values[i:i + 1, :, longest_cache - cached:longest_cache], values[i:i + 1, :, total - count:]], dim=2))
+        for keys, values in layers
+      ]
+      row.fed_ids = row.fed_ids + row.pending
+      row.passes += 1
+    with self._condition:
+      self._stats["forward_passes"] += 1
+    return outputs.logits[:, -1]
+
+  def metrics(self) -> dict:
+    """Batching and cache counters.
+
+    Returns:
+      dict: pending, games, batches, requests, mean_batch_size, forward_passes, reused_tokens and prefilled_tokens.
+    """
+    with self._condition:
+      stats = dict(self._stats)
+      stats["mean_batch_size"] = stats["requests"] / stats["batches"] if stats["batches"] else 0.0
+      stats["pending"] = len(self._pending)
+      stats["games"] = len(self._games)
+      return stats
+
+  def close(self) -> None:
+    """Finishes whatever is queued and stops the scheduling thread."""
+    with self._condition:
+      self._closed = True
+      self._condition.notify_all()
+    self._thread.join()
+    for name in self._held:
+      self._registry.release(name)
+    self._held = []
+
+_shared_service = None
+_shared_service_lock = threading.Lock()
+
+def get_shared_chess_service(**options) -> ChessService:
+  """Returns the process-wide chess service, so every game shares one model.
+
+  Args:
+    **options: ChessService arguments, only used when the service is first created.
+
+  Returns:
+    ChessService: The shared service.
+  """
+  global _shared_service
+  with _shared_service_lock:
+    if _shared_service is None:
+      _shared_service = ChessService(**options)
+    return _shared_service
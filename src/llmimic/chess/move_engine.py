@@ -0,0 +1,160 @@
+import chess
+import torch
+from llmimic import logger
+
+class MoveEngine:
+  """Gets the next move out of the chess LLM without the one-sample-per-generate() retry loop.
+  "constrained": decoding can only produce tokens that continue a legal UCI move. The legal moves are
+  tokenized in context and put in a token trie, the model's logits are masked to the trie's branches,
+  and temperature/top_k pick among what's left. So a single decode always ends on a legal move, and
+  tokens with only one legal continuation are appended without running the model at all.
+  "batched": samples candidates_per_call moves per generate() call (num_return_sequences) and checks
+  them against the board together, until one is legal or `retries` candidates have been tried.
+  Constrained decoding falls back to batched sampling if the tokenizer splits the moves inconsistently.
+  """
+  strategies = ("constrained", "batched")
+
+  def __init__(self, model, tokenizer, strategy: str = "constrained", candidates_per_call: int = 16):
+    """Init for MoveEngine.
+
+    Args:
+      model: The chess causal LM.
+      tokenizer: Its tokenizer.
+      strategy (str, optional): "constrained" or "batched". Defaults to "constrained".
+      candidates_per_call (int, optional): Moves sampled per generate() call in batched mode. Defaults to 16.
+    """
+    if strategy not in self.strategies:
+      raise ValueError(f"Unknown move strategy: {strategy}. Must be one of {self.strategies}")
+    self.model = model
+    self.tokenizer = tokenizer
+    self.strategy = strategy
+    self.candidates_per_call = candidates_per_call
+    self.last_forward_passes = 0
+    self.last_candidates = 0
+
+  @staticmethod
+  def build_prompt(moves_uci: list) -> str:
+    return "1-0 " + " ".join(moves_uci)
+
+  def choose_move(self, board: chess.Board, moves_uci: list, params: dict) -> str:
+    """Picks the next move for the side to play.
+
+    Args:
+      board (chess.Board): The current position.
+      moves_uci (list): The moves so far, in UCI format.
+      params (dict): The difficulty parameters (temperature, top_k, retries).
+
+    Returns:
+      str: The move in UCI format, or "0000" if batched sampling found no legal move.
+    """
+    prompt = self.build_prompt(moves_uci)
+    legal = [move.uci() for move in board.legal_moves]
+    if not legal:
+      return "0000"
+    if self.strategy == "constrained":
+      continuations = self._continuations(prompt, legal)
+      if continuations:
+        return self._decode_constrained(prompt, continuations, params["temperature"], params["top_k"])
+      logger.warning("Legal moves don't tokenize cleanly after the prompt, sampling candidates instead.")
+    return self._sample_batched(board, prompt, len(moves_uci), params)
+
+  def _continuations(self, prompt: str, legal: list) -> dict:
+    """Tokenizes every legal move as it would follow the prompt.
+
+    Args:
+      prompt (str): The move prompt.
+      legal (list): The legal moves, in UCI format.
+
+    Returns:
+      dict: {move: continuation token IDs}, empty if the tokenizer merges moves with the prompt.
+    """
+    separator = "" if prompt.endswith(" ") else " "
+    prompt_ids = self.tokenizer(prompt)["input_ids"]
+    encoded = self.tokenizer([prompt + separator + move for move in legal])["input_ids"]
+    continuations = {}
+    for move, ids in zip(legal, encoded):
+      if ids[:len(prompt_ids)] != prompt_ids or len(ids) == len(prompt_ids):
+        return {}
+      continuations[move] = ids[len(prompt_ids):]
+    return continuations
+
+  @staticmethod
+  def _build_trie(continuations: dict) -> dict:
+    # Nested {token: node}; a finished move sits under the None key.
+    trie = {}
+    for move, ids in continuations.items():
+      node = trie
+      for token in ids:
+        node = node.setdefault(token, {})
+      node[None] = move
+    return trie
+
+  def _pick(self, logits: torch.Tensor, choices: list, temperature: float, top_k: int) -> int:
+    scores = logits[choices].float() / max(temperature, 1e-5)
+    if top_k and top_k < len(choices):
+      kept = torch.topk(scores, top_k).indices
+      choices = [choices[i] for i in kept.tolist()]
+      scores = scores[kept]
+    return choices[torch.multinomial(torch.softmax(scores, dim=-1), 1).item()]
+
+  def _decode_constrained(self, prompt: str, continuations: dict, temperature: float, top_k: int) -> str:
+    """Walks the legal-move trie, only running the model where there's a choice to make.
+
+    Returns:
+      str: The move in UCI format (always legal).
+    """
+    node = self._build_trie(continuations)
+    pending = self.tokenizer(prompt)["input_ids"]
+    past = None
+    self.last_forward_passes = 0
+    self.last_candidates = 1
+    with torch.inference_mode():
+      while not (None in node and len(node) == 1):
+        choices = [token for token in node if token is not None]
+        if len(choices) == 1:
+          token = choices[0]
+        else:
+          input_ids = torch.tensor([pending], device=self.model.device)
+          outputs = self.model(input_ids=input_ids, past_key_values=past, use_cache=True)
+          past = outputs.past_key_values
+          self.last_forward_passes += 1
+          pending = []
+          token = self._pick(outputs.logits[0, -1], choices, temperature, top_k)
+        pending.append(token)
+        node = node[token]
+    return node[None]
+
+  def _sample_batched(self, board: chess.Board, prompt: str, move_count: int, params: dict) -> str:
+    """Samples candidates in batches and returns the first legal one, in sampling order.
+
+    Returns:
+      str: The move in UCI format, or "0000" if none of the `retries` candidates was legal.
+    """
+    inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+    move_index = move_count + 1
+    pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.tokenizer.eos_token_id
+    self.last_forward_passes = 0
+    self.last_candidates = 0
+    while self.last_candidates < params["retries"]:
+      count = min(self.candidates_per_call, params["retries"] - self.last_candidates)
+      generated = self.model.generate(
+        **inputs,
+        max_new_tokens=5,
+        do_sample=True,
+        top_k=params["top_k"],
+        temperature=params["temperature"],
+        num_return_sequences=count,
+        pad_token_id=pad_token_id,
+      )
+      self.last_forward_passes += generated.shape[1] - inputs["input_ids"].shape[1]
+      for sequence in self.tokenizer.batch_decode(generated, skip_special_tokens=True):
+        self.last_candidates += 1
+        words = sequence.split()
+        candidate = words[move_index] if len(words) > move_index else ""
+        try:
+          if board.is_legal(chess.Move.from_uci(candidate)):
+            return candidate
+        except ValueError:
+          pass
+        logger.debug("Candidate %d (%r) isn't a legal move.", self.last_candidates, candidate)
+    return "0000"
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Callable, Optional
+from . import logger
+from .tracing import span
+
+class _Entry:
+  __slots__ = ("signature", "digest", "data", "values")
+
+  def __init__(self, signature: tuple, digest: str, data: Any):
+    self.signature = signature
+    self.digest = digest
+    self.data = data
+    self.values = {}
+
+class ConfigRegistry:
+  """Parses the config, preset and persona JSON files once per process.
+  Each file is cached along with whatever has been derived from it (e.g. the flattened persona
+  string). An entry is only re-parsed when the file's mtime/size change and its content hash
+  actually differs, so touching a file costs one read and nothing else.
+  By default every lookup checks the file's mtime (one stat call). With watch() a background thread
+  does the checking instead and reloads changed files on its own. Either way, subscribers are told
+  about every reload.
+  """
+  def __init__(self):
+    self._entries = {}
+    self._lock = threading.RLock()
+    self._subscribers = []
+    self._watch_interval = None
+    self._watcher = None
+    self._stop_event = threading.Event()
+
+  def _signature(self, path: str) -> tuple:
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+  def _reload(self, path: str, entry: Optional[_Entry]) -> tuple:
+    """Reads the file and re-parses it if the content changed.
+
+    Args:
+      path (str): The absolute path.
+      entry (_Entry, optional): The current entry.
+
+    Raises:
+      FileNotFoundError: The file doesn't exist.
+      json.JSONDecodeError: The file isn't valid JSON.
+
+    Returns:
+      tuple: (entry, whether the content changed)
+    """
+    signature = self._signature(path)
+    with span("io.config.read"), open(path, "rb") as file:
+      raw = file.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    if entry is not None and entry.digest == digest:
+      entry.signature = signature
+      return entry, False
+    entry = _Entry(signature, digest, json.loads(raw))
+    self._entries[path] = entry
+    logger.debug(f"Parsed {path}.")
+    return entry, True
+
+  def load_json(self, path: str, transform: Optional[Callable[[Any], Any]] = None) -> Any:
+    """Returns the parsed file, or what transform makes of it, from cache when the file hasn't changed.
+    The result is shared between callers, so treat it as read-only.
+
+    Args:
+      path (str): The JSON file.
+      transform (Callable[[Any], Any], optional): Derives a value from the parsed JSON; cached per
+        function, so pass a module-level function or staticmethod. Defaults to None.
+
+    Raises:
+      FileNotFoundError: The file doesn't exist.
+      json.JSONDecodeError: The file isn't valid JSON.
+
+    Returns:
+      Any: The parsed (and transformed) data.
+    """
+    path = os.path.abspath(path)
+    changed = False
+    with self._lock:
+      entry = self._entries.get(path)
+      cached = entry is not None
+      try:
+        if entry is None:
+          entry, changed = self._reload(path, None)
+        elif self._watch_interval is None and self._signature(path) != entry.signature:
+          entry, changed = self._reload(path, entry)
+      except (OSError, ValueError):
+        self._entries.pop(path, None)
+        raise
+      if transform is None:
+        value = entry.data
+      elif transform in entry.values:
+        value = entry.values[transform]
+      else:
+        value = entry.values[transform] = transform(entry.data)
+    if changed and cached:
+      self._notify(path)
+    return value
+
+  def invalidate(self, path: Optional[str] = None) -> None:
+    """Drops a cached file (or all of them), it gets re-parsed on the next lookup.
+
+    Args:
+      path (str, optional): The file. Defaults to None (everything).
+    """
+    with self._lock:
+      if path is None:
+        self._entries.clear()
+      else:
+        self._entries.pop(os.path.abspath(path), None)
+
+  def subscribe(self, callback: Callable[[str], None]) -> None:
+    """Registers a callback that's called with the path whenever a cached file is reloaded with new content.
+
+    Args:
+      callback (Callable[[str], None]): The callback.
+    """
+    with self._lock:
+      self._subscribers.append(callback)
+
+  def unsubscribe(self, callback: Callable[[str], None]) -> None:
+    """Removes a callback registered with subscribe(), if it's there.
+
+    Args:
+      callback (Callable[[str], None]): The callback.
+    """
+    with self._lock:
+      if callback in self._subscribers:
+        self._subscribers.remove(callback)
+
+  def _notify(self, path: str) -> None:
+    logger.info(f"Reloaded {path}.")
+    with self._lock:
+      subscribers = list(self._subscribers)
+    for callback in subscribers:
+      try:
+        callback(path)
+      except Exception as e:
+        logger.error(f"Config reload callback failed for {path}: {e}")
+
+  def check(self) -> list:
+    """Re-checks every cached file and reloads the ones that changed.
+    A file that went missing or became invalid keeps its last good version.
+
+    Returns:
+      list: The paths that were reloaded with new content.
+    """
+    reloaded = []
+    with self._lock:
+      for path, entry in list(self._entries.items()):
+        try:
+          signature = self._signature(path)
+        except OSError:
+          signature = None
+        if signature == entry.signature:
+          continue
+        try:
+          if signature is None:
+            raise FileNotFoundError("the file is gone")
+          _, changed = self._reload(path, entry)
+        except (OSError, ValueError) as e:
+          logger.warning(f"Keeping the cached {path}, reloading it failed: {e}")
+          # Remembering the broken version's signature means the warning isn't repeated every round.
+          entry.signature = signature
+          continue
+        if changed:
+          reloaded.append(path)
+    for path in reloaded:
+      self._notify(path)
+    return reloaded
+
+  def watch(self, interval: Optional[float]) -> None:
+    """Hot reload: checks cached files every `interval` seconds on a background thread.
+    While watching, lookups no longer stat the file themselves.
+
+    Args:
+      interval (float): Seconds between checks, None to stop watching.
+    """
+    with self._lock:
+      self._watch_interval = interval
+      if interval is None or (self._watcher is not None and self._watcher.is_alive()):
+        return
+      self._stop_event.clear()
+      self._watcher = threading.Thread(target=self._watch, name="ConfigWatcher", daemon=True)
+      self._watcher.start()
+
+  def _watch(self) -> None:
+    while True:
+      interval = self._watch_interval
+      if interval is None or self._stop_event.wait(interval):
+        return
+      self.check()
+
+  def shutdown(self) -> None:
+    """Stops the watcher thread."""
+    with self._lock:
+      self._watch_interval = None
+      watcher = self._watcher
+      self._watcher = None
+    self._stop_event.set()
+    if watcher is not None:
+      watcher.join()
+
+_shared_registry = None
+_shared_registry_lock = threading.Lock()
+
+def get_shared_config_registry() -> ConfigRegistry:
+  """Returns the process-wide config registry used by every session.
+
+  Returns:
+    ConfigRegistry: The shared registry.
+  """
+  global _shared_registry
+  with _shared_registry_lock:
+    if _shared_registry is None:
+      _shared_registry = ConfigRegistry()
+    return _shared_registry
@@ -0,0 +1,175 @@
+from typing import Optional
+
+def encode_chat(tokenizer, messages: list, add_generation_prompt: bool = False) -> list:
+  """Applies a tokenizer's chat template and returns the token IDs as a plain list.
+
+  Args:
+    tokenizer: The chat model's tokenizer.
+    messages (list): The messages.
+    add_generation_prompt (bool, optional): Append the assistant header. Defaults to False.
+
+  Returns:
+    list: The token IDs.
+  """
+  ids = tokenizer.apply_chat_template(messages, tokenize=True, add_generation_prompt=add_generation_prompt)
+  # Newer transformers versions hand back a BatchEncoding instead of a plain list.
+  if isinstance(ids, dict) or hasattr(ids, "input_ids"):
+    ids = ids["input_ids"]
+  return list(ids)
+
+class ContextWindow:
+  """Builds the prompt for each turn within a token budget.
+  The first `pinned` messages (system message with the persona, user info, intro) are always kept,
+  the newest turns are kept for as long as they fit, and whatever falls out of the window is dropped
+  until the background rolling summary catches up and set_summary() swaps it in right after the
+  pinned messages.
+  Token counts come from the chat model's own chat template and are computed once per message.
+  """
+  summary_prefix = "Summary of the earlier conversation: "
+
+  def __init__(self, tokenizer, max_tokens: int, pinned: int = 3):
+    """Init for ContextWindow.
+
+    Args:
+      tokenizer: The chat model's tokenizer (its chat template is used for counting).
+      max_tokens (int): Token budget for the whole prompt.
+      pinned (int, optional): How many leading messages are never evicted. Defaults to 3.
+    """
+    self.tokenizer = tokenizer
+    self.max_tokens = max_tokens
+    self.pinned = pinned
+    self.token_counts = []
+    self.summary = None
+    self.summary_tokens = 0
+    self._summarized_upto = pinned
+    self._extra_tokens = 0
+    self._role_overheads = {}
+    self._fixed_overhead = self._measure_fixed_overhead()
+
+  def _template_length(self, messages: list, add_generation_prompt: bool = False) -> int:
+    return len(encode_chat(self.tokenizer, messages, add_generation_prompt=add_generation_prompt))
+
+  def _content_length(self, text: str) -> int:
+    return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+  def _measure_fixed_overhead(self) -> int:
+    """Tokens the template adds once per prompt (BOS, generation prompt and the like).
+
+    Returns:
+      int: The overhead in tokens.
+    """
+    if getattr(self.tokenizer, "chat_template", None) is None:
+      return 0
+    probe = [{"role": "system", "content": "x"}]
+    return (self._template_length(probe, add_generation_prompt=True)
+            - self._content_length("x") - self._role_overhead("system"))
+
+  def _role_overhead(self, role: str) -> int:
+    """Template tokens a message of this role adds on top of its content.
+    Measured against a conversation that already has a system message, so templates that inject
+    a default system header don't get counted once per message.
+
+    Args:
+      role (str): The message role.
+
+    Returns:
+      int: The overhead in tokens.
+    """
+    overhead = self._role_overheads.get(role)
+    if overhead is None:
+      if getattr(self.tokenizer, "chat_template", None) is None:
+        overhead = 0
+      else:
+        base = [{"role": "system", "content": "x"}]
+        overhead = (self._template_length(base + [{"role": role, "content": "x"}])
+                    - self._template_length(base) - self._content_length("x"))
+      self._role_overheads[role] = overhead
+    return overhead
+
+  def count_message(self, message: dict) -> int:
+    """Counts the chat template tokens for one message.
+
+    Args:
+      message (dict): The formatted message.
+
+    Returns:
+      int: The token count.
+    """
+    return self._content_length(message["content"]) + self._role_overhead(message["role"])
+
+  def sync(self, message_history: list) -> None:
+    """Counts any messages appended since the last call.
+
+    Args:
+      message_history (list): The full message history.
+    """
+    for message in message_history[len(self.token_counts):]:
+      self.token_counts.append(self.count_message(message))
+
+  def set_summary(self, summary: Optional[str], covers_upto: int) -> None:
+    """Swaps in a rolling summary produced elsewhere (e.g. in the background).
+
+    Args:
+      summary (str): The summary of everything before covers_upto.
+      covers_upto (int): Index of the first message the summary doesn't cover.
+    """
+    self.summary = summary or None
+    self.summary_tokens = self.count_message(self._summary_message()) if self.summary else 0
+    self._summarized_upto = max(self._summarized_upto, covers_upto)
+
+  def _summary_message(self) -> dict:
+    return {"role": "system", "content": self.summary_prefix + self.summary}
+
+  def _window_start(self, message_history: list, budget: int) -> int:
+    """Index of the oldest turn that still fits. The newest message is always included.
+
+    Args:
+      message_history (list): The full message history.
+      budget (int): Tokens left for turns.
+
+    Returns:
+      int: The index the window starts at.
+    """
+    start = len(message_history)
+    used = 0
+    while start > self._summarized_upto:
+      cost = self.token_counts[start - 1]
+      if used + cost > budget and start < len(message_history):
+        break
+      used += cost
+      start -= 1
+    return start
+
+  def build(self, message_history: list, extra: Optional[list] = None) -> list:
+    """Builds the prompt messages for the next generation.
+
+    Args:
+      message_history (list): The full message history.
+      extra (list, optional): Per-turn messages (e.g. recalled memories) that go after the summary. Defaults to None.
+
+    Returns:
+      list: Pinned messages, the rolling summary (if any), the extra messages and as many recent turns as fit.
+    """
+    self.sync(message_history)
+    extra = extra or []
+    self._extra_tokens = sum(self.count_message(message) for message in extra)
+    budget = self.max_tokens - self._fixed_overhead - sum(self.token_counts[:self.pinned]) - self._extra_tokens
+
+    # Turns that no longer fit are dropped; the rolling summary covers them once it catches up.
+    self._summarized_upto = max(self._summarized_upto, self._window_start(message_history, budget - self.summary_tokens))
+
+    prompt = list(message_history[:self.pinned])
+    if self.summary:
+      prompt.append(self._summary_message())
+    prompt.extend(extra)
+    prompt.extend(message_history[self._summarized_upto:])
+    return prompt
+
+  def prompt_tokens(self) -> int:
+    """Token count of the prompt the last build() produced.
+
+    Returns:
+      int: The token count.
+    """
+    return (sum(self.token_counts[:self.pinned]) + self.summary_tokens + self._extra_tokens
+            + sum(self.token_counts[self._summarized_upto:]) + self._fixed_overhead)
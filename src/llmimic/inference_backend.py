@@ -0,0 +1,211 @@
+import os
+import re
+from typing import Optional
+from . import logger
+
+# Model kinds, mapped to the transformers Auto class and the optimum.onnxruntime class that load them.
+_AUTO_CLASSES = {
+  "causal-lm": "AutoModelForCausalLM",
+  "seq2seq-lm": "AutoModelForSeq2SeqLM",
+  "sequence-classification": "AutoModelForSequenceClassification",
+  "token-classification": "AutoModelForTokenClassification",
+  "feature-extraction": "AutoModel",
+}
+_ORT_CLASSES = {
+  "causal-lm": "ORTModelForCausalLM",
+  "seq2seq-lm": "ORTModelForSeq2SeqLM",
+  "sequence-classification": "ORTModelForSequenceClassification",
+  "token-classification": "ORTModelForTokenClassification",
+  "feature-extraction": "ORTModelForFeatureExtraction",
+}
+
+class InferenceBackend:
+  """How a model is loaded and run: device, dtype, and the optional CPU optimizations.
+  Configured per model group under "inference" in configs/config.json:
+    device: "auto" (CUDA if there is one), "cpu" or "cuda".
+    dtype: "auto" (bfloat16 on CUDA, float32 on CPU) or a torch dtype name like "bfloat16".
+    quantize: "int8" for dynamic int8 quantization of the Linear layers (CPU only), or null.
+    compile: wrap the forward pass in torch.compile.
+    onnx: run through ONNX Runtime instead (needs optimum[onnxruntime], falls back to torch without it).
+  """
+  def __init__(self, device: str = "auto", dtype: str = "auto", quantize: Optional[str] = None, compile: bool = False,
+               onnx: bool = False, onnx_dir: Optional[str] = None):
+    """Init for InferenceBackend.
+
+    Args:
+      device (str, optional): "auto", "cpu" or "cuda". Defaults to "auto".
+      dtype (str, optional): "auto" or a torch dtype name. Defaults to "auto".
+      quantize (str, optional): "int8" or None. Defaults to None.
+      compile (bool, optional): Use torch.compile. Defaults to False.
+      onnx (bool, optional): Use ONNX Runtime. Defaults to False.
+      onnx_dir (str, optional): Where exported ONNX models are kept. Defaults to None (export every time).
+    """
+    self.requested_device = device
+    self.dtype = dtype
+    self.quantize = quantize
+    self.compile = compile
+    self.onnx = onnx
+    self.onnx_dir = onnx_dir
+
+  @classmethod
+  def from_config(cls, config: Optional[dict], onnx_dir: Optional[str] = None) -> "InferenceBackend":
+    """Builds a backend from its config.json section.
+
+    Args:
+      config (dict, optional): The section. Defaults to None (all defaults).
+      onnx_dir (str, optional): Where exported ONNX models are kept. Defaults to None.
+
+    Returns:
+      InferenceBackend: The backend.
+    """
+    config = config or {}
+    return cls(
+      device=config.get("device", "auto"),
+      dtype=config.get("dtype", "auto"),
+      quantize=config.get("quantize"),
+      compile=config.get("compile", False),
+      onnx=config.get("onnx", False),
+      onnx_dir=onnx_dir,
+    )
+
+  @property
+  def device(self) -> str:
+    if self.requested_device != "auto":
+      return self.requested_device
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+  def torch_dtype(self):
+    import torch
+    if self.dtype == "auto":
+      return torch.bfloat16 if self.device == "cuda" else torch.float32
+    return getattr(torch, self.dtype)
+
+  def describe(self) -> str:
+    parts = [self.device, str(self.torch_dtype()).replace("torch.", "")]
+    if self.quantize:
+      parts.append(self.quantize)
+    if self.compile:
+      parts.append("compiled")
+    if self.onnx:
+      parts.append("onnx")
+    return "/".join(parts)
+
+  def optimize(self, model):
+    """Applies quantization and compilation to a loaded torch model.
+
+    Args:
+      model: The model.
+
+    Returns:
+      The optimized model (quantization swaps the Linear layers in place).
+    """
+    import torch
+    if self.quantize == "int8":
+      if self.device != "cpu":
+        logger.warning("int8 dynamic quantization only runs on CPU, skipping it.")
+      else:
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    elif self.quantize:
+      logger.warning(f"Unknown quantization '{self.quantize}', skipping it.")
+    if self.compile:
+      # Only the forward pass gets compiled, so generate() and the rest of the model API stay as they are.
+      model.forward = torch.compile(model.forward, dynamic=True)
+    return model
+
+  def _load_onnx(self, kind: str, model_id: str):
+    """Loads (exporting it the first time) the ONNX Runtime version of a model.
+
+    Returns:
+      The ORT model, or None if optimum/onnxruntime isn't installed.
+    """
+    try:
+      import optimum.onnxruntime as ort
+    except ImportError:
+      logger.warning("ONNX Runtime backend requested but optimum[onnxruntime] isn't installed, using torch.")
+      return None
+    model_class = getattr(ort, _ORT_CLASSES[kind])
+    export_dir = None
+    if self.onnx_dir:
+      export_dir = os.path.join(self.onnx_dir, re.sub(r"[^\w.-]+", "--", model_id))
+      if os.path.exists(os.path.join(export_dir, "config.json")):
+        return model_class.from_pretrained(export_dir)
+    model = model_class.from_pretrained(model_id, export=True)
+    if export_dir:
+      model.save_pretrained(export_dir)
+      logger.info(f"Exported {model_id} to ONNX in {export_dir}.")
+    return model
+
+  def load_model(self, kind: str, model_id: str):
+    """Loads a model with this backend.
+
+    Args:
+      kind (str): "causal-lm", "seq2seq-lm", "sequence-classification", "token-classification" or "feature-extraction".
+      model_id (str): Hugging Face model ID or local path.
+
+    Returns:
+      The model, ready for inference.
+    """
+    if self.onnx:
+      model = self._load_onnx(kind, model_id)
+      if model is not None:
+        return model
+    import transformers
+    model_class = getattr(transformers, _AUTO_CLASSES[kind])
+    device = self.device
+    if self.requested_device == "auto" and device == "cuda":
+      # Let accelerate spread big models over whatever GPUs there are.
+      model = model_class.from_pretrained(model_id, torch_dtype=self.torch_dtype(), device_map="auto")
+    else:
+      model = model_class.from_pretrained(model_id, torch_dtype=self.torch_dtype()).to(device)
+    model.eval()
+    return self.optimize(model)
+
+  def pipeline(self, task: str, model_id: str, kind: str, tokenizer=None, **kwargs):
+    """Builds a transformers pipeline around a model loaded with this backend.
+
+    Args:
+      task (str): The pipeline task.
+      model_id (str): Hugging Face model ID or local path.
+      kind (str): The model kind, see load_model().
+      tokenizer (optional): The tokenizer. Defaults to None (load the model's own).
+      **kwargs: Passed on to pipeline().
+
+    Returns:
+      Pipeline: The pipeline.
+    """
+    from transformers import AutoTokenizer, pipeline
+    if tokenizer is None:
+      tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = self.load_model(kind, model_id)
+    # Models placed by device_map (or running in ONNX Runtime) must not be moved by the pipeline.
+    if getattr(model, "hf_device_map", None) is None and not self._is_onnx(model):
+      kwargs.setdefault("device", self.device)
+    return pipeline(task, model=model, tokenizer=tokenizer, **kwargs)
+
+  @staticmethod
+  def _is_onnx(model) -> bool:
+    return type(model).__module__.startswith("optimum.")
+
+_threads_configured = False
+
+def configure_threads(num_threads: Optional[int] = None, interop_threads: Optional[int] = None) -> None:
+  """Sets torch's CPU thread pools, once per process (torch only allows the inter-op one to be set once).
+
+  Args:
+    num_threads (int, optional): Intra-op threads. Defaults to None (torch's default).
+    interop_threads (int, optional): Inter-op threads. Defaults to None (torch's default).
+  """
+  global _threads_configured
+  if _threads_configured or (num_threads is None and interop_threads is None):
+    return
+  import torch
+  if num_threads is not None:
+    torch.set_num_threads(num_threads)
+  if interop_threads is not None:
+    try:
+      torch.set_interop_threads(interop_threads)
+    except RuntimeError as e:
+      logger.warning(f"Couldn't set the inter-op thread count: {e}")
+  _threads_configured = True
+  logger.info(f"Torch threads: {torch.get_num_threads()} intra-op, {torch.get_num_interop_threads()} inter-op.")
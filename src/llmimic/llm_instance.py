@@ -1,30 +1,62 @@
-from . import logger, UserData, ExecutionTimer
+from . import logger, UserData
 from .chat_instance import ChatInstance
 import json
 import os
-import torch
-from transformers import pipeline
+import threading
+import time
+from typing import AsyncIterator, Iterator, Optional
 from datetime import datetime
-import requests
 import re
 from .memory import MemoryInstance
+from .model_registry import get_shared_registry
+from .config_registry import get_shared_config_registry
+from .inference_backend import InferenceBackend, configure_threads
+from .context_window import encode_chat
+from .streaming import StreamTrimmer, iterate_in_thread
+from .tracing import format_seconds, get_shared_tracer, span
+from .logger import configure_logger
 
 class LLMInstance:
   """The main LLM instance class: calls chat_instance, memory_instance, chess_instance, etc.
   """
-  def __init__(self):
+  def __init__(self, scheduler=None):
     """Ensure configs in /configs/ are set properly before instancing.
+
+    Args:
+      scheduler (BatchScheduler, optional): Batches generation with other sessions on the same model. Defaults to None.
     """
     self.pipe=None
+    self.pipe_name=None
+    self.generator=None
+    self.scheduler=scheduler
     self.llm_active=False
     self.model_name = None
     self.persona_name = None
     self.preset = None
+    self.active_preset = None
     self.weather_api_key = None
     self.lat = None
     self.lon = None
     self.use_memory=False
     self.get_weather=False
+    self.weather_ttl=600
+    self.weather_timeout=10
+    self.weather_cache_file=None
+    self.model_idle_timeout=None
+    self.memory_async=True
+    self.memory_queue_size=32
+    self.memory_batch_size=8
+    self.memory_retrieval={}
+    self.memory_cache={}
+    self.memory_classifier={}
+    self.prefix_cache=True
+    self.prefix_cache_all_turns=True
+    self.torch_threads=None
+    self.torch_interop_threads=None
+    self.tracing={}
+    self.llm_backend=None
+    self.summarizer_backend=None
+    self.memory_backend=None
     self.memory_instance=None
     self.chat_instance = None
     self.load_config()
@@ -42,19 +74,47 @@ class LLMInstance:
     config_file=os.path.abspath(os.path.join(config_dir, "config.json"))
     if os.path.exists(config_file):
       try:
-        with open(config_file, "r") as file:
-          data = json.load(file)
-          self.model_name = data.get("llama_small_model")
-          self.persona_name = data.get("persona_name", "generic")
-          self.preset = data.get("preset", "default")
-          self.weather_api_key = data.get("weather_api_key", "YOUR_API_KEY_HERE")
-          self.lat = data.get("weather_lat")
-          self.lon = data.get("weather_lon")
-          self.use_memory = data.get("use_memory")
-          self.get_weather = data.get("get_weather")
-
-          if self.lat is None or self.lon is None:
-            raise ValueError("Latitude or Longitude is missing in the configuration.")
+        registry=get_shared_config_registry()
+        data = registry.load_json(config_file)
+        self.model_name = data.get("llama_small_model")
+        self.persona_name = data.get("persona_name", "generic")
+        self.preset = data.get("preset", "default")
+        self.weather_api_key = data.get("weather_api_key", "YOUR_API_KEY_HERE")
+        self.lat = data.get("weather_lat")
+        self.lon = data.get("weather_lon")
+        self.use_memory = data.get("use_memory")
+        self.get_weather = data.get("get_weather")
+        self.weather_ttl = data.get("weather_ttl", 600)
+        self.weather_timeout = data.get("weather_timeout", 10)
+        self.weather_cache_file = data.get("weather_cache_file")
+        self.model_idle_timeout = data.get("model_idle_timeout")
+        self.memory_async = data.get("memory_async", True)
+        self.memory_queue_size = data.get("memory_queue_size", 32)
+        self.memory_batch_size = data.get("memory_batch_size", 8)
+        self.memory_retrieval = data.get("memory_retrieval") or {}
+        self.memory_cache = data.get("memory_cache") or {}
+        self.memory_classifier = data.get("memory_classifier") or {}
+        self.prefix_cache = data.get("prefix_cache", True)
+        self.prefix_cache_all_turns = data.get("prefix_cache_all_turns", True)
+        self.torch_threads = data.get("torch_threads")
+        self.torch_interop_threads = data.get("torch_interop_threads")
+        self.tracing = data.get("tracing") or {}
+        get_shared_tracer().configure(enabled=self.tracing.get("enabled", True), max_spans=self.tracing.get("max_spans"))
+        self.logging = data.get("logging") or {}
+        configure_logger(logger, level=self.logging.get("level"), console=self.logging.get("console"),
+                         use_queue=self.logging.get("queue"), debug_sample_rate=self.logging.get("debug_sample_rate"),
+                         debug_rate_limit=self.logging.get("debug_rate_limit"))
+        inference = data.get("inference", {})
+        onnx_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), data.get("onnx_dir", "cache/onnx")))
+        self.llm_backend = InferenceBackend.from_config(inference.get("llm", {"dtype": "bfloat16"}), onnx_dir=onnx_dir)
+        self.summarizer_backend = InferenceBackend.from_config(inference.get("summarizer"), onnx_dir=onnx_dir)
+        self.memory_backend = InferenceBackend.from_config(inference.get("memory"), onnx_dir=onnx_dir)
+        # Opt-in hot reload: changed files get picked up by a background watcher (one per process, this only
+        # updates its interval). Running sessions re-apply config and preset changes, see _on_config_reload.
+        registry.watch(data.get("config_reload_interval"))
+
+        if self.lat is None or self.lon is None:
+          raise ValueError("Latitude or Longitude is missing in the configuration.")
       except json.JSONDecodeError as e:
         error_message = f"Error parsing {config_file}: {e}"
         logger.error(error_message)
@@ -88,39 +148,138 @@ class LLMInstance:
     if self.is_active():
       logger.error("A session or chat is already active.")
       return False
-    timer=ExecutionTimer()
-    timer.start()
-    llm_persona_info=self._construct_persona_info()
-    if self.get_preset_data(preset_name):
-      LLM_SYS=llm_persona_info + " " + self.system_message
-      self.pipe = pipeline(
-        "text-generation",
-        model=self.model_name,
-        torch_dtype=torch.bfloat16,
-        device_map="auto",
-      )
-    else:
-      logger.error("Failed to load preset data.")
-      return False
-    USER_INFO=self._construct_user_data(user_data=user_data)
+    with span("session.start") as session_span:
+      llm_persona_info=self._construct_persona_info()
+      if not self.get_preset_data(preset_name):
+        logger.error("Failed to load preset data.")
+        return False
+      with span("session.load_pipeline"):
+        self._load_pipeline()
+      user_info=self._construct_user_data(user_data=user_data)
+      with span("session.open"):
+        self._open_session(user_data, llm_persona_info, user_info)
+      self.active_preset=preset_name
+      get_shared_config_registry().subscribe(self._on_config_reload)
+    logger.info(f"Chat logs, initial messages, and LLM session active, total time: {session_span.format_elapsed()}.")
+    logger.info(f"Session started for a {user_data.race} {user_data.sex} named {user_data.name}, born {user_data.birthday}.")
+    return True
+
+  def _load_pipeline(self) -> None:
+    """Loads the text generation pipeline (and the prefix cache on top of it).
+    """
+    from .prefix_cache import PrefixCachedGenerator
+    configure_threads(self.torch_threads, self.torch_interop_threads)
+    # Loaded through the shared registry, so sessions using the same model share one copy of it.
+    # The session keeps hold of it until stop(), so idle eviction can't pull it out from under the session.
+    registry=get_shared_registry()
+    backend=self.llm_backend
+    self._release_pipeline()
+    pipe_name=f"text-generation:{self.model_name}"
+    registry.register(pipe_name, lambda: backend.pipeline("text-generation", self.model_name, "causal-lm"))
+    logger.info(f"Text generation backend: {backend.describe()}.")
+    self.pipe=registry.acquire(pipe_name)
+    self.pipe_name=pipe_name
+    if self.prefix_cache:
+      self.generator=PrefixCachedGenerator(self.pipe.model, self.pipe.tokenizer, cache_all_turns=self.prefix_cache_all_turns)
+
+  def _open_session(self, user_data: UserData, llm_persona_info: str, user_info: str) -> None:
+    """Creates the chat log with the initial messages and the memory instance.
+    Needs the preset and the pipeline to be loaded already.
+
+    Args:
+      user_data (UserData): The user's data.
+      llm_persona_info (str): The persona string from _construct_persona_info().
+      user_info (str): The user string from _construct_user_data().
+    """
+    LLM_SYS=llm_persona_info + " " + self.system_message
     LLM_INTRO="Okay, got it! I'll remember that for reference later! Let's get started! I'll wait for you to greet me."
-    self.chat_instance=ChatInstance(user_data=user_data)
+    self.chat_instance=ChatInstance(user_data=user_data, backend=self.summarizer_backend)
+    if self.context_tokens:
+      self.chat_instance.set_context_window(self.pipe.tokenizer, self.context_tokens - self.max_tokens)
     logger.info("User info and LLM intro created successfully.")
     
     self.chat_instance.append_message("system", LLM_SYS)
-    self.chat_instance.append_message("user", USER_INFO)
+    self.chat_instance.append_message("user", user_info)
     self.chat_instance.append_message("assistant", LLM_INTRO)
     
+    if self.model_idle_timeout is not None:
+      get_shared_registry().set_idle_timeout(self.model_idle_timeout)
     if self.use_memory:
-      self.memory_instance=MemoryInstance(os.path.abspath(os.path.join(os.path.dirname(__file__), f"persona/{self.persona_name}")))
+      self.memory_instance=MemoryInstance(
+        os.path.abspath(os.path.join(os.path.dirname(__file__), f"persona/{self.persona_name}")),
+        async_processing=self.memory_async,
+        max_queue_size=self.memory_queue_size,
+        max_batch_size=self.memory_batch_size,
+        backend=self.memory_backend,
+        retrieval={key: self.memory_retrieval[key] for key in ("min_sentiment", "ivf_threshold", "nprobe") if key in self.memory_retrieval}
+          if self.memory_retrieval.get("enabled") else None,
+        analysis_cache=self._analysis_cache_options(),
+        classifier={key: self.memory_classifier[key] for key in ("two_stage", "batch_size") if key in self.memory_classifier}
+      )
 
     self.llm_active=True
-    timer_str=timer.stop()
-    logger.info(f"Chat logs, initial messages, and LLM session active, total time: {timer_str}.")
-    logger.info(f"Session started for a {user_data.race} {user_data.sex} named {user_data.name}, born {user_data.birthday}.")
-    return True
 
-  def _process_dict(self, data, path="") -> str:
+  def stop(self) -> None:
+    """Ends the session: waits for pending memory work and closes the chat log.
+    """
+    get_shared_config_registry().unsubscribe(self._on_config_reload)
+    self.active_preset=None
+    if self.memory_instance is not None:
+      self.memory_instance.close()
+      self.memory_instance=None
+    if self.chat_instance is not None:
+      self.chat_instance.close()
+      self.chat_instance=None
+    if self.generator is not None:
+      self.generator.invalidate()
+    self._release_pipeline()
+    self.llm_active=False
+    self.export_traces()
+    logger.info("Session stopped.")
+
+  def _on_config_reload(self, path: str) -> None:
+    """Re-applies config.json or the session's preset when the config registry reloads them.
+    Generation settings and the context budget change from the next turn on. The model, the memory
+    setup and the persona and system message (already in the chat) only change for new sessions.
+
+    Args:
+      path (str): The reloaded file.
+    """
+    config_dir=os.path.abspath(os.path.join(os.path.dirname(__file__), "configs"))
+    if path == os.path.join(config_dir, "config.json"):
+      self.load_config()
+      logger.info("Config reloaded into the running session.")
+    elif path == os.path.join(config_dir, "presets.json") and self.active_preset is not None:
+      if not self.get_preset_data(self.active_preset):
+        return
+      if self.context_tokens and self.chat_instance is not None and self.pipe is not None:
+        self.chat_instance.set_context_window(self.pipe.tokenizer, self.context_tokens - self.max_tokens)
+      logger.info(f"Preset '{self.active_preset}' reloaded into the running session.")
+
+  def _release_pipeline(self) -> None:
+    """Hands the text generation pipeline back to the registry, it can be evicted once it's idle.
+    """
+    if self.pipe_name is not None:
+      get_shared_registry().release(self.pipe_name)
+      self.pipe=None
+      self.pipe_name=None
+      self.generator=None
+
+  def export_traces(self) -> None:
+    """Writes the span histograms (or spans) to the tracing export_path, if one is configured.
+    """
+    export_path=self.tracing.get("export_path")
+    if not export_path:
+      return
+    export_path=os.path.abspath(os.path.join(os.path.dirname(__file__), export_path))
+    try:
+      get_shared_tracer().write(export_path, self.tracing.get("export_format", "prometheus"))
+      logger.info(f"Traces exported to {export_path}.")
+    except (OSError, ValueError) as e:
+      logger.error(f"Trace export failed: {e}")
+
+  @staticmethod
+  def _process_dict(data, path="") -> str:
     """Internal function to process the persona data into a string.
 
     Args:
@@ -134,7 +293,7 @@ class LLMInstance:
     for key, value in data.items():
         current_path = f"{path}({key})" if path else key
         if isinstance(value, dict):
-          nested_result = self._process_dict(value, path=current_path)
+          nested_result = LLMInstance._process_dict(value, path=current_path)
           result.append(nested_result)
         elif isinstance(value, list):
           list_values = ", ".join(map(str, value)) if value else "None"
@@ -143,40 +302,47 @@ class LLMInstance:
           result.append(f"{current_path}: {value}")
     return ", ".join(result)
 
+  @staticmethod
+  def _format_persona(json_data) -> str:
+    """Turns the persona JSON into the string that gets fed to the LLM (cached per file by the config registry).
+
+    Args:
+      json_data (JSON): The JSON data retrieved from the persona.json file.
+
+    Returns:
+      str: The persona data with its prefix/suffix.
+    """
+    persona_info = LLMInstance._process_dict(json_data)
+
+    prefix = "Persona Information: "
+    suffix = " End of persona data."
+    return f"{prefix}{persona_info}{suffix}"
+
   def _construct_persona_info(self) -> str:
     """This is the main function for constructing the persona data.
     It grabs the JSON data, calls _process_dict(), appends prefix/suffix, etc.
+    The result is cached process-wide until the persona file changes.
 
     Returns:
       str: The complete persona string that gets fed to the LLM.
     """
     logger.info("Constructing persona data.")
-    timer=ExecutionTimer()
-    timer.start()
     persona_dir=os.path.abspath(os.path.join(os.path.dirname(__file__), f"persona/{self.persona_name}"))
     persona_json=os.path.abspath(os.path.join(persona_dir, f"{self.persona_name}.json"))
-    try:
-      with open(persona_json, 'r') as file:
-        json_data = json.load(file)
-
-      persona_info = self._process_dict(json_data)
-
-      prefix = "Persona Information: "
-      suffix = " End of persona data."
-      timer_str = timer.stop()
-      logger.info(f"Constructed persona data in {timer_str}.")
-      return f"{prefix}{persona_info}{suffix}"
-
-    except FileNotFoundError:
-      logger.error(f"File '{persona_json}' not found.")
-      timer_str = timer.stop()
-      logger.info(f"Failed to construct persona data in {timer_str}.")
-      return None
-    except json.JSONDecodeError:
-      logger.error(f"File '{persona_json}' is not a valid JSON file.")
-      timer_str = timer.stop()
-      logger.info(f"Failed to construct persona data in {timer_str}.")
-      return None
+    with span("persona.construct", persona=self.persona_name) as persona_span:
+      try:
+        persona_info = get_shared_config_registry().load_json(persona_json, transform=LLMInstance._format_persona)
+        logger.info(f"Constructed persona data in {persona_span.format_elapsed()}.")
+        return persona_info
+
+      except FileNotFoundError:
+        logger.error(f"File '{persona_json}' not found.")
+        logger.info(f"Failed to construct persona data in {persona_span.format_elapsed()}.")
+        return None
+      except json.JSONDecodeError:
+        logger.error(f"File '{persona_json}' is not a valid JSON file.")
+        logger.info(f"Failed to construct persona data in {persona_span.format_elapsed()}.")
+        return None
     
   def get_preset_data(self, preset_name='default') -> bool:
     """Function to get the preset data from configs/presets.json.
@@ -194,94 +360,96 @@ class LLMInstance:
     """
     config_dir=os.path.abspath(os.path.join(os.path.dirname(__file__), "configs"))
     preset_json=os.path.abspath(os.path.join(config_dir, "presets.json"))
-    try:
-      with open(preset_json, 'r') as file:
-        data = json.load(file)
-
-      if "presets" not in data:
-        raise KeyError("'presets' key not found in JSON file.")
-
-      presets = data["presets"]
-
-      if preset_name not in presets:
-        raise KeyError(f"Preset '{preset_name}' not found in JSON file.")
-
-      config = presets[preset_name]
-
-      setattr(self, "system_message", config.get("system_message", ""))
-      setattr(self, "max_tokens", config.get("max_tokens", 0))
-      setattr(self, "temperature", config.get("temperature", 0.0))
-      setattr(self, "top_p", config.get("top_p", 0.0))
-      setattr(self, "top_k", config.get("top_k", 0))
-      setattr(self, "repetition_penalty", config.get("repetition_penalty", 0.0))
-      setattr(self, "num_beams", config.get("num_beams", 1))
-      setattr(self, "length_penalty", config.get("length_penalty", 0.0))
-      return True
-
-    except FileNotFoundError:
-      logger.error(f"File '{preset_json}' not found.")
-      return False
-    except json.JSONDecodeError:
-      logger.error(f"File '{preset_json}' is not a valid JSON file.")
-      return False
-    except KeyError as e:
-      logger.error(f"{e}")
-      return False
+    with span("preset.load", preset=preset_name):
+      try:
+        data = get_shared_config_registry().load_json(preset_json)
+
+        if "presets" not in data:
+          raise KeyError("'presets' key not found in JSON file.")
+
+        presets = data["presets"]
+
+        if preset_name not in presets:
+          raise KeyError(f"Preset '{preset_name}' not found in JSON file.")
+
+        config = presets[preset_name]
+
+        setattr(self, "system_message", config.get("system_message", ""))
+        setattr(self, "max_tokens", config.get("max_tokens", 0))
+        setattr(self, "temperature", config.get("temperature", 0.0))
+        setattr(self, "top_p", config.get("top_p", 0.0))
+        setattr(self, "top_k", config.get("top_k", 0))
+        setattr(self, "repetition_penalty", config.get("repetition_penalty", 0.0))
+        setattr(self, "num_beams", config.get("num_beams", 1))
+        setattr(self, "length_penalty", config.get("length_penalty", 0.0))
+        setattr(self, "context_tokens", config.get("context_tokens", 0))
+        return True
+
+      except FileNotFoundError:
+        logger.error(f"File '{preset_json}' not found.")
+        return False
+      except json.JSONDecodeError:
+        logger.error(f"File '{preset_json}' is not a valid JSON file.")
+        return False
+      except KeyError as e:
+        logger.error(f"{e}")
+        return False
     
-  def _construct_user_data(self, user_data: UserData) -> str:
+  def _construct_user_data(self, user_data: UserData, weather_info: dict = None) -> str:
     """Function to construct LLM text chunks for UserData.
     If get_weather is enabled, this is where it's called.
 
     Args:
       user_data (UserData): The umm...data from the user.
+      weather_info (dict, optional): Weather that was already fetched. Defaults to None (fetch it here).
 
     Returns:
       str: The complete string of user data to feed the LLM.
     """
     logger.info("Constructing user data.")
-    timer=ExecutionTimer()
-    timer.start()
-    current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    if self.get_weather:
-      weather_info = self._get_weather_info(self.weather_api_key, self.lat, self.lon)
-
-      user_data = {
-          "name": user_data.name,
-          "race": user_data.race,
-          "sex": user_data.sex,
-          "birthday": user_data.birthday,
-          "details": user_data.details,
-          "current_time": current_time,
-          "weather": {
-            "city": weather_info['city'],
-            "country": weather_info['country'],
-            "weather_main": weather_info['weather_main'],
-            "description": weather_info['description'],
-            "temperature": weather_info['temperature'],
-            "feels_like": weather_info['feels_like']
-          }
-      }
-    else:
-      user_data = {
-      "name": user_data.name,
-      "race": user_data.race,
-      "sex": user_data.sex,
-      "birthday": user_data.birthday,
-      "details": user_data.details,
-      "current_time": current_time
-      }
-
-    prefix = "User Information: "
-    suffix = "End of user information."
-
-    user_data_message = prefix + str(user_data) + suffix
-    timer_str = timer.stop()
-    logger.info(f"Constructed user data in {timer_str}.")
-    return user_data_message
+    with span("user_data.construct") as user_span:
+      current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+      if self.get_weather:
+        if weather_info is None:
+          weather_info = self._get_weather_info(self.weather_api_key, self.lat, self.lon)
+
+        user_data = {
+            "name": user_data.name,
+            "race": user_data.race,
+            "sex": user_data.sex,
+            "birthday": user_data.birthday,
+            "details": user_data.details,
+            "current_time": current_time,
+            "weather": {
+              "city": weather_info['city'],
+              "country": weather_info['country'],
+              "weather_main": weather_info['weather_main'],
+              "description": weather_info['description'],
+              "temperature": weather_info['temperature'],
+              "feels_like": weather_info['feels_like']
+            }
+        }
+      else:
+        user_data = {
+        "name": user_data.name,
+        "race": user_data.race,
+        "sex": user_data.sex,
+        "birthday": user_data.birthday,
+        "details": user_data.details,
+        "current_time": current_time
+        }
+
+      prefix = "User Information: "
+      suffix = "End of user information."
+
+      user_data_message = prefix + str(user_data) + suffix
+      logger.info(f"Constructed user data in {user_span.format_elapsed()}.")
+      return user_data_message
 
   def _get_weather_info(self, api_key: str, lat: float, lon: float) -> dict:
     """Function to get the current weather at a location.
     Utilizes OpenWeatherAPI and requires an API key, a latitude, and a longitude.
+    Goes through the shared WeatherProvider, so it's usually answered from cache.
 
     Args:
       api_key (str): Your OpenWeatherAPI API key.
@@ -291,48 +459,13 @@ class LLMInstance:
     Returns:
       dict: The weather data for the chosen location (on success, N/A otherwise).
     """
-    base_url = "https://api.openweathermap.org/data/2.5/weather"
-    params = {
-    "lat": lat,
-    "lon": lon,
-    "appid": api_key,
-    "units": "imperial"
-    }
-
-    default_result = {
-    "weather_main": "N/A",
-    "description": "N/A",
-    "temperature": "N/A",
-    "feels_like": "N/A",
-    "wind_speed": "N/A",
-    "city": "N/A",
-    "country": "N/A"
-    }
-
-    try:
-        response = requests.get(base_url, params=params)
-        response.raise_for_status()
-        data = response.json()
-
-        if "weather" not in data or "main" not in data or "sys" not in data:
-          return default_result
-
-        weather = data.get("weather", [{}])[0]
-        main = data.get("main", {})
-        wind = data.get("wind", {})
-
-        result = {
-        "weather_main": weather.get("main", "N/A").lower(),
-        "description": weather.get("description", "N/A").lower(),
-        "temperature": main.get("temp", "N/A"),
-        "feels_like": main.get("feels_like", "N/A"),
-        "wind_speed": wind.get("speed", "N/A"),
-        "city": data.get("name", "N/A"),
-        "country": data.get("sys", {}).get("country", "N/A")
-        }
-        return result
-    except requests.RequestException as e:
-        return default_result
+    from .weather_provider import get_shared_weather_provider
+    weather_cache_file=None
+    if self.weather_cache_file:
+      weather_cache_file=os.path.abspath(os.path.join(os.path.dirname(__file__), self.weather_cache_file))
+    provider=get_shared_weather_provider(ttl=self.weather_ttl, timeout=self.weather_timeout, cache_path=weather_cache_file)
+    with span("weather.fetch"):
+      return provider.get(api_key, lat, lon)
     
   def trim_after_last_punctuation(self, text: str) -> str:
     """Trims the trailing end off of LLM responses (hung sentences).
@@ -350,6 +483,114 @@ class LLMInstance:
       return text[:last_punct_index + 1]
     return text
     
+  def _generation_kwargs(self) -> dict:
+    """The generation parameters from the loaded preset.
+
+    Returns:
+      dict: Keyword arguments for the pipeline or model.generate().
+    """
+    return {
+      "max_new_tokens": self.max_tokens,
+      "temperature": self.temperature,
+      "top_p": self.top_p,
+      "top_k": self.top_k,
+      "repetition_penalty": self.repetition_penalty,
+      "num_beams": self.num_beams,
+      "length_penalty": self.length_penalty,
+    }
+
+  def _begin_turn(self, prompt: str) -> list:
+    """Records the user prompt and builds the messages to generate from.
+
+    Args:
+      prompt (str): The user prompt.
+
+    Returns:
+      list: The prompt messages.
+    """
+    self.chat_instance.append_message("user", prompt)
+    memories = None
+    if self.memory_instance is not None:
+      memories = self._recall_memories(prompt)
+      self.memory_instance.submit("user", prompt)
+    return self.chat_instance.build_prompt(memories=memories)
+
+  def _analysis_cache_options(self) -> Optional[dict]:
+    """The AnalysisCache settings from the memory_cache config section, or None if caching is off.
+
+    Returns:
+      dict: max_entries and path (resolved against the package directory).
+    """
+    if not self.memory_cache.get("enabled"):
+      return None
+    options={"max_entries": self.memory_cache.get("max_entries", 10000)}
+    if self.memory_cache.get("path"):
+      options["path"]=os.path.abspath(os.path.join(os.path.dirname(__file__), self.memory_cache["path"]))
+    return options
+
+  def _recall_memories(self, prompt: str) -> Optional[str]:
+    """Pulls the stored memories relevant to the prompt, within the configured token budget.
+    A failed lookup only costs the memories for this turn.
+
+    Args:
+      prompt (str): The user prompt.
+
+    Returns:
+      str: The memories as a system message, or None.
+    """
+    if not self.memory_retrieval.get("enabled"):
+      return None
+    tokenizer = self.pipe.tokenizer
+    try:
+      with span("memory.recall"):
+        return self.memory_instance.recall(
+          prompt,
+          k=self.memory_retrieval.get("top_k", 5),
+          max_tokens=self.memory_retrieval.get("max_tokens", 256),
+          count_tokens=lambda text: len(tokenizer(text, add_special_tokens=False)["input_ids"]),
+          min_similarity=self.memory_retrieval.get("min_similarity", 0.3)
+        )
+    except Exception as e:
+      logger.error(f"Memory recall failed: {e}")
+      return None
+
+  def _generate_text(self, prompt_messages: list, **generation_kwargs) -> str:
+    """Runs the model on the prompt messages.
+
+    Args:
+      prompt_messages (list): The prompt messages.
+      **generation_kwargs: Generation parameters (plus e.g. a streamer).
+
+    Returns:
+      str: The raw generated reply.
+    """
+    if self.scheduler is not None and "streamer" not in generation_kwargs:
+      with span("llm.tokenize"):
+        input_ids = encode_chat(self.pipe.tokenizer, prompt_messages, add_generation_prompt=True)
+      # Queueing plus the batch this request ended up in; the batch's own stages are traced by the scheduler.
+      with span("llm.scheduled", prompt_tokens=len(input_ids)):
+        new_ids = self.scheduler.submit(input_ids, **generation_kwargs).result()
+      return self.pipe.tokenizer.decode(new_ids, skip_special_tokens=True)
+    if self.generator is not None:
+      response_text = self.generator.generate(prompt_messages, prefix_messages=3, **generation_kwargs)
+      logger.debug("Prefix cache reused %d tokens, prefilled %d.", self.generator.last_reused_tokens,
+                   self.generator.last_prefilled_tokens)
+      return response_text
+    with span("llm.generate"):
+      outputs = self.pipe(prompt_messages, **generation_kwargs)
+    return outputs[0]["generated_text"][-1]["content"]
+
+  def _finish_turn(self, trimmed_response: str) -> None:
+    """Records the (already trimmed) reply and hands it to summarization and memory.
+
+    Args:
+      trimmed_response (str): The final reply.
+    """
+    self.chat_instance.append_message("assistant", trimmed_response)
+    self.chat_instance.schedule_summary()
+    if self.memory_instance is not None:
+      self.memory_instance.submit("assistant", trimmed_response)
+
   def generate_response(self, prompt: str) -> str:
     """The bread and butter of response generation.
     This is also where summarization and memory happen.
@@ -361,27 +602,94 @@ class LLMInstance:
       str: The generated response, probably.
     """
     logger.info("Submitting prompt for generation.")
-    timer=ExecutionTimer()
-    timer.start()
-    self.chat_instance.append_message("user", prompt)
-    self.chat_instance.check_and_summarize()
-    self.memory_instance.check_for_memories("user", prompt)
-    outputs = self.pipe(
-      self.chat_instance.message_history,
-      max_new_tokens=self.max_tokens,
-      temperature=self.temperature,
-      top_p=self.top_p,
-      top_k=self.top_k,
-      repetition_penalty=self.repetition_penalty,
-      num_beams=self.num_beams,
-      length_penalty=self.length_penalty,
-    )
-    
-    response = outputs[0]["generated_text"][-1]
-    trimmed_response = self.trim_after_last_punctuation(response['content'])
-    self.chat_instance.append_message("assistant", trimmed_response)
-    self.chat_instance.check_and_summarize()
-    self.memory_instance.check_for_memories("assistant", trimmed_response)
-    timer_str=timer.stop()
-    logger.info(f"Prompt response generated, total time: {timer_str}.")
-    return trimmed_response
\ No newline at end of file
+    with span("turn.generate") as turn_span:
+      with span("turn.begin"):
+        prompt_messages = self._begin_turn(prompt)
+      response_text = self._generate_text(prompt_messages, **self._generation_kwargs())
+      trimmed_response = self.trim_after_last_punctuation(response_text)
+      with span("turn.finish"):
+        self._finish_turn(trimmed_response)
+    logger.info(f"Prompt response generated, total time: {turn_span.format_elapsed()}.")
+    return trimmed_response
+
+  def stream_response(self, prompt: str, stop_event: Optional[threading.Event] = None) -> Iterator[str]:
+    """Streaming version of generate_response: yields text as it's decoded.
+    Hung sentences are trimmed on the fly, so only text after the last sentence boundary is held back.
+    Once the stream is done, the final text goes to the chat log and memory like a normal turn. If the
+    caller stops reading early (or generation fails), generation is stopped and the turn is finished
+    with the text released so far, so the history never ends on an unanswered prompt.
+
+    Args:
+      prompt (str): The prompt to submit.
+      stop_event (threading.Event, optional): Setting it from another thread stops the stream the same way. Defaults to None.
+
+    Yields:
+      str: Chunks of the reply.
+    """
+    logger.info("Submitting prompt for streamed generation.")
+    # A span can't stay open across the yields without leaking into the consumer's context, so the
+    # turn is recorded once it's over.
+    start = time.perf_counter_ns()
+    with span("turn.begin"):
+      prompt_messages = self._begin_turn(prompt)
+
+    generation_kwargs = self._generation_kwargs()
+    if generation_kwargs["num_beams"] > 1:
+      # Beam search picks the winning beam at the very end, so there's nothing to stream before then.
+      logger.warning(f"Streaming doesn't support beam search, using num_beams=1 instead of {generation_kwargs['num_beams']}.")
+      generation_kwargs["num_beams"] = 1
+    from transformers import TextIteratorStreamer
+    from .prefix_cache import StopOnEvent
+    streamer = TextIteratorStreamer(self.pipe.tokenizer, skip_prompt=True, skip_special_tokens=True)
+    stop = stop_event if stop_event is not None else threading.Event()
+    generation_kwargs["stopping_criteria"] = list(generation_kwargs.get("stopping_criteria") or []) + [StopOnEvent(stop)]
+    errors = []
+
+    def _run():
+      try:
+        with span("turn.stream_generation"):
+          self._generate_text(prompt_messages, streamer=streamer, **generation_kwargs)
+      except Exception as e:
+        errors.append(e)
+        streamer.end()
+
+    thread = threading.Thread(target=_run, name="StreamGeneration", daemon=True)
+    thread.start()
+    trimmer = StreamTrimmer(self.trim_after_last_punctuation)
+    completed = False
+    try:
+      for chunk in streamer:
+        released = trimmer.feed(chunk)
+        if released:
+          yield released
+      thread.join()
+      if errors:
+        raise errors[0]
+
+      tail = trimmer.finish()
+      if tail:
+        yield tail
+      completed = True
+    finally:
+      if not completed or stop.is_set():
+        stop.set()
+        thread.join()
+        logger.warning("Streamed response ended early, keeping the part that was already released.")
+      with span("turn.finish"):
+        self._finish_turn(trimmer.released_text)
+    end = time.perf_counter_ns()
+    get_shared_tracer().record("turn.stream", start, end)
+    logger.info(f"Streamed response generated, total time: {format_seconds((end - start) / 1e9)}.")
+
+  def astream_response(self, prompt: str) -> AsyncIterator[str]:
+    """Async iterator version of stream_response. Generation runs on a worker thread,
+    so the event loop is never blocked.
+
+    Args:
+      prompt (str): The prompt to submit.
+
+    Returns:
+      AsyncIterator[str]: Chunks of the reply.
+    """
+    stop = threading.Event()
+    return iterate_in_thread(lambda: self.stream_response(prompt, stop_event=stop), on_close=stop.set)
@@ -1,5 +1,10 @@
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
+import threading
+import time
 from datetime import datetime
 from colorama import Fore, Style
 
@@ -13,21 +18,139 @@ class ColoredFormatter(logging.Formatter):
     }
 
     def format(self, record):
-        log_message = super().format(record)
+        # Builds the line straight from the record, the message is only merged with its arguments once.
+        record.message = record.getMessage()
         color = self.COLORS.get(record.levelno, Fore.WHITE)
-        log_message = f"[{color}{record.levelname}{Style.RESET_ALL}] [{record.name}] [{record.funcName}] - {record.getMessage()}"
-        return color + log_message
+        log_message = f"{color}[{color}{record.levelname}{Style.RESET_ALL}] [{record.name}] [{record.funcName}] - {record.message}"
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            log_message += "\n" + record.exc_text
+        return log_message
 
-def setup_logger(name: str = 'my_package', level: int = logging.DEBUG, logs_dir: str = './logs'):
+class SamplingFilter(logging.Filter):
+    """Thins out chatty records (DEBUG by default) per call site, so hot-path logging stays cheap.
+    sample_rate keeps that fraction of each call site's records (every n-th one, deterministically);
+    rate_limit caps each call site at that many records per second. The next record a call site gets
+    through says how many were dropped before it. Records above max_level always pass.
+    """
+    def __init__(self, sample_rate: float = 1.0, rate_limit: float = None, max_level: int = logging.DEBUG):
+        """
+        :param sample_rate: Fraction of records kept per call site (default is 1.0, keep everything).
+        :param rate_limit: Max records per second per call site (default is None, no limit).
+        :param max_level: The highest level that gets thinned out (default is logging.DEBUG).
+        """
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.rate_limit = rate_limit
+        self.max_level = max_level
+        self._sites = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def filter(self, record):
+        if record.levelno > self.max_level or (self.sample_rate >= 1.0 and self.rate_limit is None):
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            # [seen, dropped since the last kept one, tokens, last refill]
+            site = self._sites.get(key)
+            if site is None:
+                site = self._sites[key] = [0, 0, max(1.0, self.rate_limit or 0.0), now]
+            site[0] += 1
+            keep = self.sample_rate > 0 and (site[0] - 1) % max(1, round(1 / self.sample_rate)) == 0
+            if keep and self.rate_limit is not None:
+                # Room for at least one token, or a limit below 1/s would never let anything through.
+                site[2] = min(max(1.0, self.rate_limit), site[2] + (now - site[3]) * self.rate_limit)
+                site[3] = now
+                keep = site[2] >= 1
+                if keep:
+                    site[2] -= 1
+            if not keep:
+                site[1] += 1
+                self.dropped += 1
+                return False
+            dropped, site[1] = site[1], 0
+        if dropped:
+            record.msg = f"{record.getMessage()} ({dropped} similar record(s) dropped)"
+            record.args = None
+        return True
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that leaves all formatting to the listener thread.
+    The stock prepare() formats the record and copies it in the calling thread; here the message is
+    only merged with its arguments (which may change or not survive the trip otherwise).
+    """
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class _LoggerState:
+    """The handlers behind a logger set up by setup_logger, so configure_logger can rearrange them."""
+    def __init__(self, file_handler, console_handler):
+        self.file_handler = file_handler
+        self.console_handler = console_handler
+        self.console = True
+        self.queue_handler = None
+        self.listener = None
+        self.sampling_filter = None
+
+_states = {}
+_states_lock = threading.Lock()
+
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    return default if value is None else value.strip().lower() not in ("0", "false", "no", "off", "")
+
+def _attach(logger: logging.Logger, state: _LoggerState, use_queue: bool) -> None:
+    """(Re)wires the logger: straight to its handlers, or through a QueueHandler to a QueueListener thread."""
+    handlers = [state.file_handler] + ([state.console_handler] if state.console else [])
+    for handler in (state.file_handler, state.console_handler, state.queue_handler):
+        if handler is not None:
+            logger.removeHandler(handler)
+    if state.listener is not None:
+        state.listener.stop()  # Drains what's queued first.
+        atexit.unregister(state.listener.stop)
+        state.listener = None
+        state.queue_handler = None
+    if use_queue:
+        log_queue = queue.SimpleQueue()
+        state.queue_handler = _QueueHandler(log_queue)
+        state.listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        state.listener.start()
+        atexit.register(state.listener.stop)
+        logger.addHandler(state.queue_handler)
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
+
+def setup_logger(name: str = 'my_package', level: int = None, logs_dir: str = None, console: bool = None,
+                 use_queue: bool = None):
     """
     Creates a shared logger with file and console handlers for use across the package.
-    
+    With use_queue, records are handed to a QueueListener thread and formatted and written there,
+    so logging costs the calling thread little more than building the record.
+    The defaults can be overridden with the LLMIMIC_LOG_LEVEL, LLMIMIC_LOG_CONSOLE and LLMIMIC_LOG_QUEUE
+    environment variables; configure_logger changes them later.
+
     :param name: Name of the logger (default is 'my_package').
     :param level: Logging level (default is logging.DEBUG).
-    :param logs_dir: Directory to store log files (default is './logs').
+    :param logs_dir: Directory to store log files (default is the package's logs directory).
+    :param console: Also log to the console, with colors (default is True).
+    :param use_queue: Format and write records on a background thread (default is True).
     :return: Configured logger instance.
     """
-    logs_dir=os.path.abspath(os.path.join(os.path.dirname(__file__), "logs"))
+    if level is None:
+        level = logging.getLevelName(os.environ.get("LLMIMIC_LOG_LEVEL", "DEBUG").upper())
+        level = level if isinstance(level, int) else logging.DEBUG
+    console = _env_flag("LLMIMIC_LOG_CONSOLE", True) if console is None else console
+    use_queue = _env_flag("LLMIMIC_LOG_QUEUE", True) if use_queue is None else use_queue
+    logs_dir=os.path.abspath(logs_dir or os.path.join(os.path.dirname(__file__), "logs"))
     os.makedirs(logs_dir, exist_ok=True)
     log_filename = f"log_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.log"
     log_file = os.path.join(logs_dir, log_filename)
@@ -35,17 +158,61 @@ def setup_logger(name: str = 'my_package', level: int = logging.DEBUG, logs_dir:
     logger = logging.getLogger(name)
     logger.setLevel(level)
 
-    if not logger.handlers:
-        file_handler = logging.FileHandler(log_file)
-        file_handler.setLevel(level)
-        file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(file_formatter)
-        logger.addHandler(file_handler)
+    with _states_lock:
+        if not logger.handlers and name not in _states:
+            file_handler = logging.FileHandler(log_file)
+            file_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            file_handler.setFormatter(file_formatter)
+
+            console_handler = logging.StreamHandler()
+            console_formatter = ColoredFormatter('%(message)s')
+            console_handler.setFormatter(console_formatter)
+
+            state = _LoggerState(file_handler, console_handler)
+            state.console = console
+            _states[name] = state
+            _attach(logger, state, use_queue)
 
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(level)
-        console_formatter = ColoredFormatter('%(message)s')
-        console_handler.setFormatter(console_formatter)
-        logger.addHandler(console_handler)
+    return logger
+
+def configure_logger(logger: logging.Logger, level=None, console: bool = None, use_queue: bool = None,
+                     debug_sample_rate: float = None, debug_rate_limit: float = None):
+    """
+    Changes the settings of a logger made by setup_logger. Anything left as None stays as it is.
+
+    :param logger: The logger.
+    :param level: Logging level, as a number or a name like "INFO".
+    :param console: Log to the console (turn it off in production, the file log is kept).
+    :param use_queue: Format and write records on a background thread.
+    :param debug_sample_rate: Fraction of DEBUG records kept per call site (1.0 keeps everything).
+    :param debug_rate_limit: Max DEBUG records per second per call site (0 or less for no limit).
+    """
+    if level is not None:
+        logger.setLevel(logging.getLevelName(level.upper()) if isinstance(level, str) else level)
+    with _states_lock:
+        state = _states.get(logger.name)
+        if state is None:
+            return
+        queued = state.listener is not None
+        console = state.console if console is None else console
+        use_queue = queued if use_queue is None else use_queue
+        if console != state.console or use_queue != queued:  # Every session applies the config, most of the time nothing changes.
+            state.console = console
+            _attach(logger, state, use_queue)
+        if debug_sample_rate is not None or debug_rate_limit is not None:
+            if state.sampling_filter is None:
+                state.sampling_filter = SamplingFilter()
+                logger.addFilter(state.sampling_filter)
+            if debug_sample_rate is not None:
+                state.sampling_filter.sample_rate = debug_sample_rate
+            if debug_rate_limit is not None:
+                state.sampling_filter.rate_limit = debug_rate_limit if debug_rate_limit > 0 else None
 
-    return logger
\ No newline at end of file
+def flush_logger(logger: logging.Logger) -> None:
+    """Waits until every record queued so far has been written (a no-op without the queue)."""
+    with _states_lock:
+        state = _states.get(logger.name)
+        if state is None or state.listener is None:
+            return
+        state.listener.stop()
+        state.listener.start()
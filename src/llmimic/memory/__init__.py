@@ -1 +1,2 @@
-from .memory_instance import MemoryInstance
\ No newline at end of file
+from .memory_instance import MemoryInstance
+from .memory_store import MemoryStore
\ No newline at end of file
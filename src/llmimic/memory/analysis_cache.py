@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Optional
+from llmimic import logger
+
+class AnalysisCache:
+    """Content-addressed cache for memory analysis results (NER, sentiment, classification).
+    Keys are a hash of the model ID and the normalized text, so "lol", " lol " and the same intro
+    message in every session are analyzed once. Recent results sit in an in-memory LRU; with a path,
+    they're also kept in a SQLite file that every worker process can read and write, so one process's
+    results are hits for the others. Case is kept as is, because the models are case-sensitive.
+    Values have to be JSON-serializable.
+    """
+    def __init__(self, max_entries: int = 10000, path: Optional[str] = None, max_disk_entries: int = 1000000):
+        """Init for AnalysisCache.
+
+        Args:
+            max_entries (int, optional): Results kept in memory. Defaults to 10000.
+            path (str, optional): SQLite file shared between processes. Defaults to None (memory only).
+            max_disk_entries (int, optional): Results kept on disk before the least recently written go. Defaults to 1000000.
+        """
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._conn = None
+        self._writes_since_prune = 0
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, written REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_written ON results (written)")
+            self._conn.commit()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Unicode NFKC and collapsed whitespace."""
+        return " ".join(unicodedata.normalize("NFKC", text).split())
+
+    @classmethod
+    def key(cls, model_id: str, text: str) -> str:
+        return hashlib.sha256(f"{model_id}\0{cls.normalize(text)}".encode("utf-8")).hexdigest()
+
+    def _counters(self, model_id: str) -> dict:
+        counters = self._stats.get(model_id)
+        if counters is None:
+            counters = self._stats[model_id] = {"hits": 0, "disk_hits": 0, "misses": 0, "compute_seconds": 0.0}
+        return counters
+
+    def _remember(self, key: str, value) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load_from_disk(self, keys: list) -> dict:
+        if self._conn is None or not keys:
+            return {}
+        placeholders = ", ".join("?" for _ in keys)
+        try:
+            rows = self._conn.execute(f"SELECT key, value FROM results WHERE key IN ({placeholders})", keys).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Analysis cache read failed: {e}")
+            return {}
+        return {key: json.loads(value) for key, value in rows}
+
+    def _save_to_disk(self, items: list) -> None:
+        if self._conn is None or not items:
+            return
+        now = time.time()
+        try:
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO results (key, value, written) VALUES (?, ?, ?)",
+                                       [(key, json.dumps(value), now) for key, value in items])
+                self._writes_since_prune += len(items)
+                if self._writes_since_prune >= 1000:
+                    self._writes_since_prune = 0
+                    self._conn.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY written DESC LIMIT -1 OFFSET ?)",
+                                       (self.max_disk_entries,))
+        except sqlite3.Error as e:
+            logger.warning(f"Analysis cache write failed: {e}")
+
+    def get_many(self, model_id: str, texts: list, compute_fn: Callable[[list], list],
+                 decode: Optional[Callable] = None) -> list:
+        """Looks up results for several texts and computes only the missing ones, in one call.
+
+        Args:
+            model_id (str): The model (and variant) the results come from.
+            texts (list): The texts.
+            compute_fn (Callable[[list], list]): Computes results for a list of texts, in order.
+            decode (Callable, optional): Turns a value read back from the cache into what compute_fn returns
+                (e.g. lists back into tuples). Defaults to None (use it as is).
+
+        Returns:
+            list: One result per text, in order.
+        """
+        keys = [self.key(model_id, text) for text in texts]
+        results = {}
+        with self._lock:
+            counters = self._counters(model_id)
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    results[key] = self._entries[key]
+            on_disk = self._load_from_disk([key for key in dict.fromkeys(keys) if key not in results])
+            for key, value in on_disk.items():
+                self._remember(key, value)
+            results.update(on_disk)
+
+        # Texts that normalize the same way are computed once.
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in results and key not in missing:
+                missing[key] = text
+        if missing:
+            start = time.perf_counter()
+            computed = compute_fn(list(missing.values()))
+            elapsed = time.perf_counter() - start
+            # Round-trip through JSON so fresh results look exactly like ones read back from disk.
+            fresh = {key: json.loads(json.dumps(value)) for key, value in zip(missing, computed)}
+            with self._lock:
+                for key, value in fresh.items():
+                    self._remember(key, value)
+                self._save_to_disk(list(fresh.items()))
+                counters["compute_seconds"] += elapsed
+            results.update(fresh)
+
+        with self._lock:
+            disk_hits = sum(1 for key in keys if key in on_disk)
+            counters["misses"] += len(missing)
+            counters["disk_hits"] += disk_hits
+            counters["hits"] += len(keys) - len(missing) - disk_hits
+        return [decode(results[key]) if decode is not None else results[key] for key in keys]
+
+    def stats(self) -> dict:
+        """Hit and miss counts per model, with an estimate of the compute time the hits saved.
+
+        Returns:
+            dict: {"entries": int, "models": {model_id: {"hits", "disk_hits", "misses", "hit_rate",
+            "compute_seconds", "saved_seconds"}}}. saved_seconds is hits times the mean compute time per miss.
+        """
+        with self._lock:
+            models = {}
+            for model_id, counters in self._stats.items():
+                hits = counters["hits"] + counters["disk_hits"]
+                total = hits + counters["misses"]
+                per_miss = counters["compute_seconds"] / counters["misses"] if counters["misses"] else 0.0
+                models[model_id] = dict(counters, hit_rate=hits / total if total else 0.0, saved_seconds=hits * per_miss)
+            return {"entries": len(self._entries), "models": models}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_shared_analysis_cache(**options) -> AnalysisCache:
+    """Returns the process-wide analysis cache, so every memory instance shares its results.
+
+    Args:
+        **options: AnalysisCache arguments, only used when the cache is first created.
+
+    Returns:
+        AnalysisCache: The shared cache.
+    """
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = AnalysisCache(**options)
+        return _shared_cache
@@ -1,18 +1,21 @@
-import os
-import json
-from nltk.tokenize import sent_tokenize
-import torch
-from transformers import pipeline
-from datetime import datetime
+from typing import Optional
+from llmimic.inference_backend import InferenceBackend
+from .analysis_cache import AnalysisCache
+from .memory_store import MemoryStore
+from .sentences import sent_tokenize
 
 class EntityRecognizer:
-    def __init__(self):
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.ner_model = pipeline(
+    model_id = "dslim/bert-base-NER"
+    cache = None
+
+    def __init__(self, backend: Optional[InferenceBackend] = None, cache: Optional[AnalysisCache] = None):
+        self.cache = cache
+        backend = backend if backend is not None else InferenceBackend()
+        self.ner_model = backend.pipeline(
             "ner",
-            model="dslim/bert-base-NER",
-            aggregation_strategy="simple",
-            device=device
+            self.model_id,
+            "token-classification",
+            aggregation_strategy="simple"
         )
         
     def analyze_entities(self, text: str):
@@ -24,8 +27,42 @@ class EntityRecognizer:
         Returns:
             list?: The entities it found.
         """
-        ner_results = self.ner_model(text)
+        return self._cached([text], batch_size=1)[0]
+
+    def analyze_sentences(self, sentences: list, batch_size: int = 16) -> list:
+        """Analyzes several sentences (from one or more messages) in one batched call.
+
+        Args:
+            sentences (list): The sentences to analyze.
+            batch_size (int, optional): Sentences per forward pass. Defaults to 16.
 
+        Returns:
+            list: The (entity, label) tuples found in each sentence, in order.
+        """
+        if not sentences:
+            return []
+        return self._cached(sentences, batch_size)
+
+    def _analyze(self, texts: list, batch_size: int) -> list:
+        results = self.ner_model(texts, batch_size=batch_size)
+        return [self._merge_subwords(ner_results) for ner_results in results]
+
+    def _cached(self, texts: list, batch_size: int) -> list:
+        if self.cache is None:
+            return self._analyze(texts, batch_size)
+        return self.cache.get_many(self.model_id, texts, lambda misses: self._analyze(misses, batch_size),
+                                   decode=lambda entities: [tuple(entity) for entity in entities])
+
+    @staticmethod
+    def _merge_subwords(ner_results: list) -> list:
+        """Glues "##" word pieces back onto the entity before them.
+
+        Args:
+            ner_results (list): Aggregated NER pipeline output for one text.
+
+        Returns:
+            list: (entity, label) tuples.
+        """
         entities = []
         current_entity = None
         current_label = None
@@ -49,20 +86,32 @@ class EntityRecognizer:
 
         return entities
     
-    def process_entity_memory(self, entity_list, role: str, text: str, memory_dir: str):
-        """Processes the entity data into JSON data for our memory.
+    def process_entity_memory(self, entity_list, role: str, text: str, memory_store: MemoryStore, sentences: Optional[list] = None):
+        """Processes the entity data into our memory store.
 
         Args:
             entity_list (list?): The entities we found with analyze_entities.
             role (str): The role of the message.
             text (str): The message data itself.
-            memory_dir (str): The memory directory.
+            memory_store (MemoryStore): Where the memories are written.
+            sentences (list, optional): The message already split into sentences. Defaults to None (split it here).
         """
-        sentences = sent_tokenize(text)
+        memory_store.add_entities(role, self.memory_entries(entity_list, text, sentences=sentences))
 
-        os.makedirs(memory_dir, exist_ok=True)
+    @staticmethod
+    def memory_entries(entity_list, text: str, sentences: Optional[list] = None) -> list:
+        """The entity memories of a message: every entity with the sentences that mention it.
+
+        Args:
+            entity_list (list): The entities we found with analyze_entities.
+            text (str): The message data itself.
+            sentences (list, optional): The message already split into sentences. Defaults to None (split it here).
 
-        file_path = os.path.join(memory_dir, 'entity_recognition.json')
+        Returns:
+            list: Dicts with "entity", "label" and "sentences", as MemoryStore.add_entities takes them.
+        """
+        if sentences is None:
+            sentences = sent_tokenize(text)
 
         new_entries = []
 
@@ -74,20 +123,9 @@ class EntityRecognizer:
 
             if matching_sentences:
                 new_entries.append({
-                    "date-time": datetime.now().isoformat(),
-                    "role": role,
                     "entity": entity,
                     "label": label,
                     "sentences": combined_sentences
                 })
 
-        if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as file:
-                existing_data = json.load(file)
-        else:
-            existing_data = []
-
-        existing_data.extend(new_entries)
-
-        with open(file_path, 'w', encoding='utf-8') as file:
-            json.dump(existing_data, file, indent=4)
+        return new_entries
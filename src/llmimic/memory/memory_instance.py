@@ -1,43 +1,230 @@
-from .entity_recognizer import EntityRecognizer
-from .sentiment_analyzer import SentimentAnalyzer
-from .text_classifier import TextClassifier
+from .memory_store import MemoryStore
+from .memory_worker import MemoryWorker
 import os
-from llmimic import logger, ExecutionTimer
+from typing import TYPE_CHECKING, Callable, Optional
+from llmimic import logger
+from llmimic.model_registry import ModelRegistry, get_shared_registry
+from llmimic.inference_backend import InferenceBackend
+from llmimic.tracing import span
+from .analysis_cache import AnalysisCache, get_shared_analysis_cache
+from .memory_retriever import MemoryRetriever
+from .sentences import sent_tokenize
+
+if TYPE_CHECKING:
+  from .entity_recognizer import EntityRecognizer
+  from .sentiment_analyzer import SentimentAnalyzer
+  from .text_classifier import TextClassifier
+  from .text_embedder import TextEmbedder
+
+# The analyzer modules pull in torch/transformers, so they're only imported once a model is actually loaded.
+def _load_entity_recognizer(backend: Optional[InferenceBackend], cache: Optional[AnalysisCache]) -> "EntityRecognizer":
+  from .entity_recognizer import EntityRecognizer
+  return EntityRecognizer(backend=backend, cache=cache)
+
+def _load_sentiment_analyzer(backend: Optional[InferenceBackend], cache: Optional[AnalysisCache]) -> "SentimentAnalyzer":
+  from .sentiment_analyzer import SentimentAnalyzer
+  return SentimentAnalyzer(backend=backend, cache=cache)
+
+def _load_text_classifier(backend: Optional[InferenceBackend], cache: Optional[AnalysisCache],
+                          classifier: Optional[dict]) -> "TextClassifier":
+  from .text_classifier import TextClassifier
+  return TextClassifier(backend=backend, cache=cache, **(classifier or {}))
+
+def _load_text_embedder(backend: Optional[InferenceBackend]) -> "TextEmbedder":
+  from .text_embedder import TextEmbedder
+  return TextEmbedder(backend=backend)
+
+def register_memory_models(registry: ModelRegistry, backend: Optional[InferenceBackend] = None,
+                           cache: Optional[AnalysisCache] = None, classifier: Optional[dict] = None) -> None:
+  """Registers the memory analyzers with a registry. Already registered names are left alone.
+
+  Args:
+    registry (ModelRegistry): The registry to register with.
+    backend (InferenceBackend, optional): How the analyzers run. Defaults to None (plain torch).
+    cache (AnalysisCache, optional): Result cache in front of the analyzers. Defaults to None (no caching).
+    classifier (dict, optional): TextClassifier settings (two_stage, batch_size). Defaults to None (its defaults).
+  """
+  registry.register("entity_recognizer", lambda: _load_entity_recognizer(backend, cache))
+  registry.register("sentiment_analyzer", lambda: _load_sentiment_analyzer(backend, cache))
+  registry.register("text_classifier", lambda: _load_text_classifier(backend, cache, classifier))
+  registry.register("memory_embedder", lambda: _load_text_embedder(backend))
+
+def analyze_messages(registry: ModelRegistry, messages: list) -> list:
+  """Runs the memory analyzers over several messages without writing anything.
+  Every message is split into sentences once, and those sentences are shared by NER and sentiment,
+  so each of the three models sees all the messages in a single batched call.
+
+  Args:
+    registry (ModelRegistry): Where the analyzers are kept (see register_memory_models).
+    messages (list): (role, text) tuples.
+
+  Returns:
+    list: One dict per message with "role", "entities", "sentiments" and "classifications", as MemoryStore.write_batch takes them.
+  """
+  entity_recognizer=registry.get("entity_recognizer")
+  sentiment_analyzer=registry.get("sentiment_analyzer")
+  text_classifier=registry.get("text_classifier")
+  texts=[text for _, text in messages]
+  with span("memory.sentences"):
+    sentences_per_message=[sent_tokenize(text) for text in texts]
+  all_sentences=[sentence for sentences in sentences_per_message for sentence in sentences]
+
+  with span("memory.classify", texts=len(texts)):
+    classifications=text_classifier.classify_batch(texts)
+  with span("memory.ner", sentences=len(all_sentences)):
+    entities_per_sentence=entity_recognizer.analyze_sentences(all_sentences)
+  with span("memory.sentiment", sentences=len(all_sentences)):
+    sentiment_per_sentence=sentiment_analyzer.analyze_sentences(all_sentences)
+
+  results=[]
+  start=0
+  for (role, text), sentences, classification in zip(messages, sentences_per_message, classifications):
+    end=start + len(sentences)
+    entity_list=[entity for entities in entities_per_sentence[start:end] for entity in entities]
+    results.append({
+      "role": role,
+      "entities": entity_recognizer.memory_entries(entity_list, text, sentences=sentences),
+      "sentiments": [sentiment for sentiment in sentiment_per_sentence[start:end] if sentiment is not None],
+      "classifications": text_classifier.memory_entries(classification, text)
+    })
+    start=end
+  return results
 
 class MemoryInstance:
-  def __init__(self, memory_dir_path):
+  def __init__(self, memory_dir_path, registry: Optional[ModelRegistry] = None, async_processing: bool = True,
+               max_queue_size: int = 32, max_batch_size: int = 8, backend: Optional[InferenceBackend] = None,
+               retrieval: Optional[dict] = None, analysis_cache: Optional[dict] = None, classifier: Optional[dict] = None):
+    """Init for MemoryInstance.
+
+    Args:
+      memory_dir_path (str): The persona directory the memory data lives under.
+      registry (ModelRegistry, optional): Where the memory models are kept. Defaults to the shared registry.
+      async_processing (bool, optional): Process submitted messages on a background worker. Defaults to True.
+      max_queue_size (int, optional): Messages that can wait on the worker before submit() blocks. Defaults to 32.
+      max_batch_size (int, optional): Queued messages the worker processes together. Defaults to 8.
+      backend (InferenceBackend, optional): How the analyzers run. Defaults to None (plain torch).
+      retrieval (dict, optional): MemoryRetriever settings (min_sentiment, ivf_threshold, nprobe). Defaults to None (no retrieval).
+      analysis_cache (dict, optional): Settings for the shared AnalysisCache (max_entries, path). Defaults to None (no caching).
+      classifier (dict, optional): TextClassifier settings (two_stage, batch_size). Defaults to None (its defaults).
+    """
     self.memory_dir=os.path.abspath(os.path.join(memory_dir_path, "memory_data"))
-    self.entity_recognizer=None
-    self.sentiment_analyzer=None
-    self.text_classifier=None
-    self.timer=ExecutionTimer()
+    self.registry=registry if registry is not None else get_shared_registry()
+    self.analysis_cache=get_shared_analysis_cache(**analysis_cache) if analysis_cache is not None else None
+    register_memory_models(self.registry, backend=backend, cache=self.analysis_cache, classifier=classifier)
+    self.memory_store=MemoryStore(self.memory_dir)
+    self.memory_store.migrate_json()
+    self.retriever=MemoryRetriever(
+      self.memory_store,
+      lambda: self.registry.get("memory_embedder"),
+      os.path.join(self.memory_dir, "vector_index"),
+      **retrieval
+    ) if retrieval is not None else None
+    self.worker=MemoryWorker(
+      self.check_for_memories,
+      max_queue_size=max_queue_size,
+      batch_fn=self.check_for_memories_batch,
+      max_batch_size=max_batch_size
+    ) if async_processing else None
     logger.info("A memory instance has been initialized.")
 
+  @property
+  def entity_recognizer(self) -> "EntityRecognizer":
+    return self.registry.get("entity_recognizer")
+
+  @property
+  def sentiment_analyzer(self) -> "SentimentAnalyzer":
+    return self.registry.get("sentiment_analyzer")
+
+  @property
+  def text_classifier(self) -> "TextClassifier":
+    return self.registry.get("text_classifier")
+
   def check_for_memories(self, role: str, text: str):
     """This is a simple and horrible implementation currently.
     None of this stuff is properly implemented in any way.
     We're just working with data currently for future refactoring.
+    The models are loaded once through the registry and stay warm between calls.
+
+    Args:
+        role (str): The role of the text being checked.
+        text (str): The text to be checked.
+    """
+    self.check_for_memories_batch([(role, text)])
+
+  def check_for_memories_batch(self, messages: list):
+    """Same as check_for_memories, but for several messages at once.
+    The analyzers see all the queued messages in a single batched call each (see analyze_messages),
+    and everything found is written in one transaction.
+
+    Args:
+        messages (list): (role, text) tuples, in the order they should be written.
+    """
+    logger.info(f"Checking for memories in {len(messages)} message(s).")
+    with span("memory.batch", messages=len(messages)) as batch_span:
+      results=analyze_messages(self.registry, messages)
+      with span("memory.store"):
+        self.memory_store.write_batch(results)
+      if self.retriever is not None:
+        with span("memory.index_sync"):
+          self.retriever.sync()
+    logger.info(f"Memory processes finished in {batch_span.format_elapsed()}.")
+
+  def recall(self, query: str, k: int = 5, max_tokens: int = 256, count_tokens: Optional[Callable[[str], int]] = None,
+             min_similarity: float = 0.3) -> Optional[str]:
+    """Looks up the memories relevant to a query and formats them for the prompt.
+
+    Args:
+        query (str): The text to search for (usually the user prompt).
+        k (int, optional): Max memories. Defaults to 5.
+        max_tokens (int, optional): Token budget for the memories. Defaults to 256.
+        count_tokens (Callable[[str], int], optional): Token counter for the chat model. Defaults to a word count.
+        min_similarity (float, optional): Cosine similarity a memory needs. Defaults to 0.3.
+
+    Returns:
+        str: The memories as a system message, or None if retrieval is off or nothing relevant was found.
+    """
+    if self.retriever is None:
+      return None
+    memories=self.retriever.search(query, k=k, min_similarity=min_similarity)
+    return self.retriever.format_for_prompt(memories, max_tokens, count_tokens or (lambda text: len(text.split())))
+
+  def submit(self, role: str, text: str) -> None:
+    """Queues a message for memory processing and returns right away.
+    Falls back to processing inline if the background worker is disabled.
 
     Args:
         role (str): The role of the text being checked.
         text (str): The text to be checked.
-    """    
-    logger.info("Checking for memories.")
-    self.timer.start()
-    self.entity_recognizer=EntityRecognizer()
-    entity_list=self.entity_recognizer.analyze_entities(text)
-    self.entity_recognizer.process_entity_memory(entity_list, role, text, self.memory_dir)
-    del self.entity_recognizer
-    self.entity_recognizer=None
-    self.sentiment_analyzer=SentimentAnalyzer()
-    sentiment_data=self.sentiment_analyzer.analyze_sentiment(text)
-    self.sentiment_analyzer.append_to_sentiment_json(role, sentiment_data, self.memory_dir)
-    del self.sentiment_analyzer
-    self.sentiment_analyzer=None
-    self.text_classifier=TextClassifier()
-    classification=self.text_classifier.classify_text(text)
-    self.text_classifier.append_to_memory(classification, role, text, self.memory_dir)
-    del self.text_classifier
-    self.text_classifier=None
-    timer_str=self.timer.stop()
-    logger.info(f"Memory processes finished in {timer_str}.")
\ No newline at end of file
+    """
+    if self.worker is None:
+      self.check_for_memories(role, text)
+    else:
+      self.worker.submit(role, text)
+
+  def flush(self, timeout: Optional[float] = None) -> bool:
+    """Waits for every submitted message to be processed.
+
+    Args:
+      timeout (float, optional): Max seconds to wait. Defaults to None (wait forever).
+
+    Returns:
+      bool: True if the backlog is empty, False on timeout.
+    """
+    return self.worker.flush(timeout=timeout) if self.worker is not None else True
+
+  def metrics(self) -> dict:
+    """Queue depth and lag of the background worker (if it's enabled) and the analysis cache hit rates.
+
+    Returns:
+      dict: The worker metrics, plus "analysis_cache" (see AnalysisCache.stats()) when caching is on.
+    """
+    metrics=self.worker.metrics() if self.worker is not None else {}
+    if self.analysis_cache is not None:
+      metrics["analysis_cache"]=self.analysis_cache.stats()
+    return metrics
+
+  def close(self) -> None:
+    """Finishes the queued work, stops the worker and closes the memory store."""
+    if self.worker is not None:
+      self.worker.close()
+    self.memory_store.close()
@@ -0,0 +1,140 @@
+import threading
+from typing import TYPE_CHECKING, Callable, Optional
+from llmimic import logger
+from llmimic.tracing import span
+from .memory_store import MemoryStore
+
+if TYPE_CHECKING:
+    from .text_embedder import TextEmbedder
+    from .vector_index import VectorIndex
+
+class MemoryRetriever:
+    """Finds the stored memories that are relevant to a prompt.
+    Entity sentences, personal milestones and strongly felt sentences are embedded into a VectorIndex;
+    sync() only embeds the rows written since its last call (it remembers a cursor per table), in
+    batches, so it's cheap to run after every memory write. Each vector's key is the row ID times
+    four plus the table's tag, which is how a hit is looked up again in the MemoryStore.
+    """
+    # (table, key tag, text column)
+    sources = (("entities", 0, "sentences"), ("sentiments", 1, "sentence"), ("classifications", 2, "message"))
+    prompt_prefix = "Things you remember that may be relevant:"
+
+    def __init__(self, memory_store: MemoryStore, embedder_fn: Callable[[], "TextEmbedder"], index_dir: str,
+                 min_sentiment: float = 0.8, sync_batch_size: int = 256, ivf_threshold: int = 50000, nprobe: int = 16):
+        """Init for MemoryRetriever. Neither the embedder nor the index is loaded until they're needed.
+
+        Args:
+            memory_store (MemoryStore): Where the memories are read from.
+            embedder_fn (Callable[[], TextEmbedder]): Returns the (shared) embedder.
+            index_dir (str): Where the vector index lives.
+            min_sentiment (float, optional): Sentiment score a sentence needs to be indexed. Defaults to 0.8.
+            sync_batch_size (int, optional): Rows embedded and committed at a time. Defaults to 256.
+            ivf_threshold (int, optional): Vector count past which the index switches to IVF. Defaults to 50000.
+            nprobe (int, optional): IVF lists scanned per search. Defaults to 16.
+        """
+        self.memory_store = memory_store
+        self.embedder_fn = embedder_fn
+        self.index_dir = index_dir
+        self.min_sentiment = min_sentiment
+        self.sync_batch_size = sync_batch_size
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self._index = None
+        self._index_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    @property
+    def index(self) -> "VectorIndex":
+        with self._index_lock:
+            if self._index is None:
+                from .vector_index import VectorIndex
+                embedder = self.embedder_fn()
+                self._index = VectorIndex(self.index_dir, embedder.dimension, model_id=embedder.model_id,
+                                          ivf_threshold=self.ivf_threshold, nprobe=self.nprobe)
+            return self._index
+
+    def sync(self) -> int:
+        """Embeds and indexes the memories written since the last sync.
+
+        Returns:
+            int: How many memories were added to the index.
+        """
+        with self._sync_lock:
+            index = self.index
+            added = 0
+            for table, tag, column in self.sources:
+                min_score = self.min_sentiment if table == "sentiments" else None
+                while True:
+                    rows = self.memory_store.rows_after(table, index.cursor(table), self.sync_batch_size, min_score=min_score)
+                    if not rows:
+                        break
+                    with span("memory.embed", texts=len(rows)):
+                        vectors = self.embedder_fn().embed([row[column] for row in rows])
+                    index.add([row["id"] * 4 + tag for row in rows], vectors, cursors={table: rows[-1]["id"]})
+                    added += len(rows)
+                    if len(rows) < self.sync_batch_size:
+                        break
+            if added:
+                logger.info(f"Indexed {added} new memories ({len(index)} total).")
+            return added
+
+    def search(self, query: str, k: int = 5, min_similarity: float = 0.3) -> list:
+        """The memories most similar to a query.
+
+        Args:
+            query (str): The text to search for (usually the user prompt).
+            k (int, optional): Max memories. Defaults to 5.
+            min_similarity (float, optional): Cosine similarity a memory needs to be returned. Defaults to 0.3.
+
+        Returns:
+            list: Dicts with "text", "kind", "role", "timestamp" and "score", best first.
+        """
+        index = self.index
+        if len(index) == 0:
+            return []
+        with span("memory.embed", texts=1):
+            query_vector = self.embedder_fn().embed([query])[0]
+        # Several entity rows can share a sentence, so ask for extra hits to still have k after deduplication.
+        hits = [(key, score) for key, score in index.search(query_vector, k * 3) if score >= min_similarity]
+
+        ids_by_table = {}
+        for key, _ in hits:
+            table, _, _ = self.sources[key % 4]
+            ids_by_table.setdefault(table, []).append(key // 4)
+        rows_by_table = {table: self.memory_store.rows_by_id(table, ids) for table, ids in ids_by_table.items()}
+
+        memories = []
+        seen = set()
+        for key, score in hits:
+            table, _, column = self.sources[key % 4]
+            row = rows_by_table[table].get(key // 4)
+            if row is None or row[column] in seen:
+                continue
+            seen.add(row[column])
+            memories.append({"text": row[column], "kind": table, "role": row["role"], "timestamp": row["timestamp"], "score": score})
+            if len(memories) == k:
+                break
+        return memories
+
+    def format_for_prompt(self, memories: list, max_tokens: int, count_tokens: Callable[[str], int]) -> Optional[str]:
+        """Turns memories into a system message, keeping the best ones that fit the token budget.
+
+        Args:
+            memories (list): Memories from search(), best first.
+            max_tokens (int): Token budget for the message.
+            count_tokens (Callable[[str], int]): Counts tokens with the chat model's tokenizer.
+
+        Returns:
+            str: The message content, or None if no memory fits.
+        """
+        lines = []
+        used = count_tokens(self.prompt_prefix)
+        for memory in memories:
+            who = "You" if memory["role"] == "assistant" else "The user"
+            line = f"- ({memory['timestamp'][:10]}) {who}: {memory['text']}"
+            cost = count_tokens(line) + 1
+            if used + cost > max_tokens:
+                continue
+            lines.append(line)
+            used += cost
+        return "\n".join([self.prompt_prefix] + lines) if lines else None
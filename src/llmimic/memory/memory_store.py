@@ -0,0 +1,398 @@
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Optional
+from llmimic import logger
+from llmimic.tracing import span
+
+class MemoryStore:
+    """One SQLite database for all memory data (entities, sentiment and classifications).
+    Writes are plain inserts, so they cost the same no matter how much memory has piled up,
+    and the indexes on entity, label, role, classification and timestamp keep lookups from
+    scanning everything. The connection is shared between threads behind a lock.
+    """
+    db_filename = "memory.sqlite3"
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entities (
+            id INTEGER PRIMARY KEY,
+            timestamp TEXT NOT NULL,
+            role TEXT NOT NULL,
+            entity TEXT NOT NULL,
+            entity_key TEXT NOT NULL,
+            label TEXT NOT NULL,
+            sentences TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_entities_entity_key ON entities (entity_key);
+        CREATE INDEX IF NOT EXISTS idx_entities_label ON entities (label);
+        CREATE INDEX IF NOT EXISTS idx_entities_role ON entities (role);
+        CREATE INDEX IF NOT EXISTS idx_entities_timestamp ON entities (timestamp);
+
+        CREATE TABLE IF NOT EXISTS sentiments (
+            id INTEGER PRIMARY KEY,
+            timestamp TEXT NOT NULL,
+            role TEXT NOT NULL,
+            label TEXT NOT NULL,
+            score REAL NOT NULL,
+            sentence TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sentiments_label ON sentiments (label);
+        CREATE INDEX IF NOT EXISTS idx_sentiments_role ON sentiments (role);
+        CREATE INDEX IF NOT EXISTS idx_sentiments_timestamp ON sentiments (timestamp);
+
+        CREATE TABLE IF NOT EXISTS classifications (
+            id INTEGER PRIMARY KEY,
+            timestamp TEXT NOT NULL,
+            role TEXT NOT NULL,
+            classification TEXT NOT NULL,
+            message TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_classifications_classification ON classifications (classification);
+        CREATE INDEX IF NOT EXISTS idx_classifications_role ON classifications (role);
+        CREATE INDEX IF NOT EXISTS idx_classifications_timestamp ON classifications (timestamp);
+
+        CREATE TABLE IF NOT EXISTS summaries (
+            source TEXT PRIMARY KEY,
+            timestamp TEXT NOT NULL,
+            messages INTEGER NOT NULL,
+            summary TEXT NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS processed_messages (
+            digest TEXT PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS processed_sources (
+            source TEXT PRIMARY KEY,
+            signature TEXT NOT NULL,
+            timestamp TEXT NOT NULL
+        );
+    """
+
+    _ENTITY_SQL = "INSERT INTO entities (timestamp, role, entity, entity_key, label, sentences) VALUES (?, ?, ?, ?, ?, ?)"
+    _SENTIMENT_SQL = "INSERT INTO sentiments (timestamp, role, label, score, sentence) VALUES (?, ?, ?, ?, ?)"
+    _CLASSIFICATION_SQL = "INSERT INTO classifications (timestamp, role, classification, message) VALUES (?, ?, ?, ?)"
+
+    def __init__(self, memory_dir: str):
+        """Init for MemoryStore. Creates the database if it isn't there yet.
+
+        Args:
+            memory_dir (str): The memory directory the database lives in.
+        """
+        os.makedirs(memory_dir, exist_ok=True)
+        self.memory_dir = memory_dir
+        self.db_path = os.path.join(memory_dir, self.db_filename)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self._SCHEMA)
+        self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _insert_many(self, sql: str, rows: list) -> None:
+        if not rows:
+            return
+        with self._lock, span("io.memory_store.write", rows=len(rows)):
+            with self._conn:
+                self._conn.executemany(sql, rows)
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now().isoformat()
+
+    @staticmethod
+    def _entity_row(timestamp: str, role: str, entry: dict) -> tuple:
+        return (timestamp, role, entry["entity"], entry["entity"].lower(), entry["label"], entry["sentences"])
+
+    @staticmethod
+    def _sentiment_row(timestamp: str, role: str, entry: dict) -> tuple:
+        return (timestamp, role, entry["label"], float(entry["score"]), entry["sentence"])
+
+    @staticmethod
+    def _classification_row(timestamp: str, role: str, entry: dict) -> tuple:
+        return (timestamp, role, entry["classification"], entry["message"])
+
+    def write_batch(self, results: list, summaries: Optional[list] = None, processed_messages: Optional[list] = None,
+                    processed_sources: Optional[list] = None) -> None:
+        """Writes the memories of many messages in a single transaction, so they're all there or none are.
+        The processed_* lists are offline backfill checkpoints and are written in the same transaction.
+
+        Args:
+            results (list): Dicts with "role", "entities", "sentiments", "classifications" and optionally "timestamp".
+            summaries (list, optional): Dicts with "source", "messages", "summary" and optionally "timestamp";
+                a newer summary of the same source replaces the older one. Defaults to None.
+            processed_messages (list, optional): Message digests to mark as processed. Defaults to None.
+            processed_sources (list, optional): (source, signature) pairs to mark as processed. Defaults to None.
+        """
+        now = self._now()
+        entity_rows, sentiment_rows, classification_rows = [], [], []
+        for result in results:
+            timestamp = result.get("timestamp") or now
+            role = result["role"]
+            entity_rows.extend(self._entity_row(timestamp, role, entry) for entry in result["entities"])
+            sentiment_rows.extend(self._sentiment_row(timestamp, role, entry) for entry in result["sentiments"])
+            classification_rows.extend(self._classification_row(timestamp, role, entry) for entry in result["classifications"])
+        summary_rows = [(entry["source"], entry.get("timestamp") or now, entry["messages"], entry["summary"]) for entry in summaries or []]
+        rows = len(entity_rows) + len(sentiment_rows) + len(classification_rows) + len(summary_rows)
+        with self._lock, span("io.memory_store.write", rows=rows):
+            with self._conn:
+                self._conn.executemany(self._ENTITY_SQL, entity_rows)
+                self._conn.executemany(self._SENTIMENT_SQL, sentiment_rows)
+                self._conn.executemany(self._CLASSIFICATION_SQL, classification_rows)
+                self._conn.executemany("INSERT OR REPLACE INTO summaries (source, timestamp, messages, summary) VALUES (?, ?, ?, ?)",
+                                       summary_rows)
+                self._conn.executemany("INSERT OR IGNORE INTO processed_messages (digest) VALUES (?)",
+                                       [(digest,) for digest in processed_messages or []])
+                self._conn.executemany("INSERT OR REPLACE INTO processed_sources (source, signature, timestamp) VALUES (?, ?, ?)",
+                                       [(source, signature, now) for source, signature in processed_sources or []])
+
+    def processed_messages(self, digests: list) -> set:
+        """Which of the given message digests an offline backfill has already processed.
+
+        Args:
+            digests (list): The digests.
+
+        Returns:
+            set: The ones already processed.
+        """
+        found = set()
+        with self._lock:
+            # SQLite caps the number of parameters per statement.
+            for i in range(0, len(digests), 500):
+                chunk = digests[i:i + 500]
+                placeholders = ", ".join("?" for _ in chunk)
+                rows = self._conn.execute(f"SELECT digest FROM processed_messages WHERE digest IN ({placeholders})", tuple(chunk))
+                found.update(row[0] for row in rows)
+        return found
+
+    def processed_source(self, source: str) -> Optional[str]:
+        """The signature a source (chat log) had when an offline backfill last finished it.
+
+        Args:
+            source (str): The source.
+
+        Returns:
+            str: The signature, or None if it was never finished.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT signature FROM processed_sources WHERE source = ?", (source,)).fetchone()
+        return row[0] if row is not None else None
+
+    def summaries(self, limit: Optional[int] = None) -> list:
+        """Session summaries written by an offline backfill, newest first."""
+        sql = "SELECT * FROM summaries ORDER BY timestamp DESC, source DESC"
+        if limit is not None:
+            return self._query(sql + " LIMIT ?", (limit,))
+        return self._query(sql)
+
+    def add_entities(self, role: str, entries: list, timestamp: Optional[str] = None) -> None:
+        """Inserts entity memories.
+
+        Args:
+            role (str): The role of the message.
+            entries (list): Dicts with "entity", "label" and "sentences".
+            timestamp (str, optional): ISO timestamp. Defaults to now.
+        """
+        timestamp = timestamp or self._now()
+        self._insert_many(self._ENTITY_SQL, [self._entity_row(timestamp, role, entry) for entry in entries])
+
+    def add_sentiments(self, role: str, entries: list, timestamp: Optional[str] = None) -> None:
+        """Inserts sentiment memories.
+
+        Args:
+            role (str): The role of the message.
+            entries (list): Dicts with "label", "score" and "sentence".
+            timestamp (str, optional): ISO timestamp. Defaults to now.
+        """
+        timestamp = timestamp or self._now()
+        self._insert_many(self._SENTIMENT_SQL, [self._sentiment_row(timestamp, role, entry) for entry in entries])
+
+    def add_classifications(self, role: str, entries: list, timestamp: Optional[str] = None) -> None:
+        """Inserts classification memories.
+
+        Args:
+            role (str): The role of the message.
+            entries (list): Dicts with "classification" and "message".
+            timestamp (str, optional): ISO timestamp. Defaults to now.
+        """
+        timestamp = timestamp or self._now()
+        self._insert_many(self._CLASSIFICATION_SQL, [self._classification_row(timestamp, role, entry) for entry in entries])
+
+    def entity_sentences(self, entity: str, limit: Optional[int] = None) -> list:
+        """All sentences mentioning an entity, newest first.
+
+        Args:
+            entity (str): The entity (case-insensitive).
+            limit (int, optional): Max rows. Defaults to None (all of them).
+
+        Returns:
+            list: The matching rows.
+        """
+        sql = "SELECT * FROM entities WHERE entity_key = ? ORDER BY timestamp DESC, id DESC"
+        params = (entity.lower(),)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params += (limit,)
+        return self._query(sql, params)
+
+    def entities(self, label: Optional[str] = None, role: Optional[str] = None, limit: Optional[int] = None) -> list:
+        """Entity memories, optionally filtered by label and role, newest first."""
+        return self._filtered("entities", {"label": label, "role": role}, limit)
+
+    def sentiments(self, label: Optional[str] = None, role: Optional[str] = None, min_score: Optional[float] = None,
+                   limit: Optional[int] = None) -> list:
+        """Sentiment memories, optionally filtered by label, role and minimum score, newest first."""
+        return self._filtered("sentiments", {"label": label, "role": role}, limit, min_score=min_score)
+
+    def recent_classifications(self, limit: int = 10, classification: Optional[str] = None, role: Optional[str] = None) -> list:
+        """The last N classified milestones, newest first."""
+        return self._filtered("classifications", {"classification": classification, "role": role}, limit)
+
+    def _filtered(self, table: str, filters: dict, limit: Optional[int], min_score: Optional[float] = None) -> list:
+        clauses = [f"{column} = ?" for column, value in filters.items() if value is not None]
+        params = tuple(value for value in filters.values() if value is not None)
+        if min_score is not None:
+            clauses.append("score >= ?")
+            params += (min_score,)
+        sql = f"SELECT * FROM {table}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY timestamp DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params += (limit,)
+        return self._query(sql, params)
+
+    def rows_after(self, table: str, after_id: int, limit: int, min_score: Optional[float] = None) -> list:
+        """Rows added after a given ID, oldest first (for incremental indexing).
+
+        Args:
+            table (str): "entities", "sentiments" or "classifications".
+            after_id (int): Only rows with a higher ID are returned.
+            limit (int): Max rows.
+            min_score (float, optional): Minimum score (sentiments only). Defaults to None.
+
+        Returns:
+            list: The rows.
+        """
+        self._check_table(table)
+        sql = f"SELECT * FROM {table} WHERE id > ?"
+        params = (after_id,)
+        if min_score is not None:
+            sql += " AND score >= ?"
+            params += (min_score,)
+        return self._query(sql + " ORDER BY id LIMIT ?", params + (limit,))
+
+    def rows_by_id(self, table: str, ids: list) -> dict:
+        """Looks rows up by ID.
+
+        Args:
+            table (str): "entities", "sentiments" or "classifications".
+            ids (list): The row IDs.
+
+        Returns:
+            dict: {id: row} for the IDs that exist.
+        """
+        self._check_table(table)
+        if not ids:
+            return {}
+        placeholders = ", ".join("?" for _ in ids)
+        rows = self._query(f"SELECT * FROM {table} WHERE id IN ({placeholders})", tuple(ids))
+        return {row["id"]: row for row in rows}
+
+    @staticmethod
+    def _check_table(table: str) -> None:
+        if table not in ("entities", "sentiments", "classifications"):
+            raise ValueError(f"Unknown memory table: {table}")
+
+    def count(self, table: str) -> int:
+        self._check_table(table)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def migrate_json(self, memory_dir: Optional[str] = None) -> dict:
+        """Imports the old entity_recognition.json, sentiment.json and classification.json files.
+        Each file goes in as one transaction, together with a note that it was imported, and is renamed
+        to <name>.migrated afterwards. A crash in between leaves either nothing or the whole file imported,
+        and a file that was imported but never renamed is only renamed on the next run.
+
+        Args:
+            memory_dir (str, optional): Where the JSON files are. Defaults to this store's directory.
+
+        Returns:
+            dict: How many rows were imported per table.
+        """
+        memory_dir = memory_dir or self.memory_dir
+        imported = {"entities": 0, "sentiments": 0, "classifications": 0}
+
+        entity_file = os.path.join(memory_dir, 'entity_recognition.json')
+        entity_data = self._load_legacy(entity_file)
+        if entity_data is not None:
+            imported["entities"] = self._import_legacy(entity_file, [
+                {"role": entry["role"], "timestamp": entry.get("date-time"), "entities": [entry], "sentiments": [], "classifications": []}
+                for entry in entity_data])
+
+        # The old sentiment file never stored a timestamp, so the import time is the best we've got.
+        sentiment_file = os.path.join(memory_dir, 'sentiment.json')
+        sentiment_data = self._load_legacy(sentiment_file)
+        if sentiment_data is not None:
+            imported["sentiments"] = self._import_legacy(sentiment_file, [
+                {"role": data["role"], "entities": [], "classifications": [],
+                 "sentiments": [{"label": data["sentiment"], "score": data["score"], "sentence": data["sentence"]}]}
+                for data in (entry["memory_data"] for entry in sentiment_data)])
+
+        classification_file = os.path.join(memory_dir, 'classification.json')
+        classification_data = self._load_legacy(classification_file)
+        if classification_data is not None:
+            imported["classifications"] = self._import_legacy(classification_file, [
+                {"role": entry["role"], "timestamp": entry.get("datetime"), "entities": [], "sentiments": [], "classifications": [entry]}
+                for entry in classification_data.get("memory_data", [])])
+
+        if any(imported.values()):
+            logger.info(f"Migrated legacy memory JSON into {self.db_path}: {imported}")
+        return imported
+
+    def _import_legacy(self, file_path: str, results: list) -> int:
+        """Writes one legacy file's rows in a single transaction (unless an earlier run already did) and renames the file.
+
+        Args:
+            file_path (str): The legacy JSON file.
+            results (list): Its rows, as write_batch takes them.
+
+        Returns:
+            int: The rows imported.
+        """
+        source = "legacy:" + os.path.abspath(file_path)
+        if self.processed_source(source) is None:
+            self.write_batch(results, processed_sources=[(source, "migrated")])
+        else:
+            results = []
+        self._mark_migrated(file_path)
+        return len(results)
+
+    @staticmethod
+    def _load_legacy(file_path: str):
+        if not os.path.exists(file_path):
+            return None
+        try:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except json.JSONDecodeError:
+            logger.error(f"File '{file_path}' is not a valid JSON file, skipping migration.")
+            return None
+
+    @staticmethod
+    def _mark_migrated(file_path: str) -> None:
+        os.replace(file_path, file_path + ".migrated")
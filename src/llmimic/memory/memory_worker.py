@@ -0,0 +1,165 @@
+import queue
+import threading
+import time
+from typing import Callable, Optional
+from llmimic import logger
+
+class MemoryWorker:
+    """Runs memory processing on a background thread so it stays off the response path.
+    Jobs go through a bounded queue: when it's full, submit() blocks until there's room
+    (backpressure) instead of letting the backlog grow forever. A single worker thread
+    handles the jobs, so results are written in the order they were submitted. If batch_fn is
+    given, whatever has piled up in the queue (up to max_batch_size jobs) is handed over in one call.
+    """
+    _STOP = object()
+
+    def __init__(self, process_fn: Callable, max_queue_size: int = 32, name: str = "MemoryWorker",
+                 batch_fn: Optional[Callable] = None, max_batch_size: int = 1):
+        """Init for MemoryWorker. Starts the worker thread.
+
+        Args:
+            process_fn (Callable): Called with the arguments given to submit().
+            max_queue_size (int, optional): Max jobs waiting before submit() blocks. Defaults to 32.
+            name (str, optional): The worker thread name. Defaults to "MemoryWorker".
+            batch_fn (Callable, optional): Called with a list of argument tuples when jobs are batched. Defaults to None.
+            max_batch_size (int, optional): Max jobs handed to batch_fn at once. Defaults to 1.
+        """
+        self.process_fn = process_fn
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_queue_size = max_queue_size
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._pending = 0
+        self._pending_since = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._processed = 0
+        self._failed = 0
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, *args, timeout: Optional[float] = None) -> None:
+        """Queues a job. Blocks while the queue is full.
+
+        Args:
+            timeout (float, optional): Max seconds to wait for room. Defaults to None (wait forever).
+
+        Raises:
+            RuntimeError: The worker has been closed.
+            queue.Full: There was still no room after timeout.
+        """
+        if self._closed:
+            raise RuntimeError("Memory worker is closed.")
+        enqueued_at = time.monotonic()
+        with self._condition:
+            self._pending += 1
+            self._pending_since.append(enqueued_at)
+        try:
+            self._queue.put((enqueued_at, args), timeout=timeout)
+        except queue.Full:
+            with self._condition:
+                self._pending -= 1
+                self._pending_since.remove(enqueued_at)
+                self._condition.notify_all()
+            raise
+
+    def _next_batch(self) -> tuple:
+        """Blocks for one job, then grabs whatever else is already queued (up to max_batch_size).
+
+        Returns:
+            tuple: (jobs, stop) where stop means the stop sentinel was reached.
+        """
+        item = self._queue.get()
+        if item is self._STOP:
+            return [], True
+        jobs = [item]
+        limit = self.max_batch_size if self.batch_fn is not None else 1
+        while len(jobs) < limit:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is self._STOP:
+                return jobs, True
+            jobs.append(item)
+        return jobs, False
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            jobs, stop = self._next_batch()
+            if not jobs:
+                continue
+            try:
+                if len(jobs) > 1:
+                    self.batch_fn([args for _, args in jobs])
+                else:
+                    self.process_fn(*jobs[0][1])
+                failed = False
+            except Exception as e:
+                logger.error(f"Memory processing failed: {e}")
+                failed = True
+            now = time.monotonic()
+            with self._condition:
+                for enqueued_at, _ in jobs:
+                    lag = now - enqueued_at
+                    self._pending -= 1
+                    self._pending_since.remove(enqueued_at)
+                    self._processed += 1
+                    self._failed += int(failed)
+                    self._last_lag = lag
+                    self._max_lag = max(self._max_lag, lag)
+                self._condition.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Waits until every submitted job has been processed.
+
+        Args:
+            timeout (float, optional): Max seconds to wait. Defaults to None (wait forever).
+
+        Returns:
+            bool: True if everything was processed, False on timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Processes whatever is still queued, then stops the worker thread.
+
+        Args:
+            timeout (float, optional): Max seconds to wait for the backlog. Defaults to None (wait forever).
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if not self.flush(timeout=timeout):
+            logger.warning(f"Memory worker closed with {self._pending} jobs still pending.")
+        try:
+            # Without a timeout the flush above emptied the queue, so this can't block for long.
+            self._queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            # The worker is a daemon thread, it goes away with the process.
+            logger.warning("Memory worker queue still full, leaving the worker thread behind.")
+            return
+        self._thread.join(timeout=timeout)
+
+    def metrics(self) -> dict:
+        """Queue depth and lag numbers for monitoring.
+
+        Returns:
+            dict: queue_depth, max_queue_size, processed, failed, lag_seconds (age of the oldest
+            job not done yet), last_lag_seconds and max_lag_seconds (submit to done).
+        """
+        with self._condition:
+            oldest = self._pending_since[0] if self._pending_since else None
+            return {
+                "queue_depth": self._pending,
+                "max_queue_size": self.max_queue_size,
+                "processed": self._processed,
+                "failed": self._failed,
+                "lag_seconds": time.monotonic() - oldest if oldest is not None else 0.0,
+                "last_lag_seconds": self._last_lag,
+                "max_lag_seconds": self._max_lag,
+            }
@@ -0,0 +1,31 @@
+import threading
+
+_punkt_lock = threading.Lock()
+_punkt_ready = False
+
+def _ensure_punkt() -> None:
+  """Makes sure NLTK's sentence tokenizer data is there, downloading it the first time it's actually needed."""
+  global _punkt_ready
+  if _punkt_ready:
+    return
+  import nltk
+  with _punkt_lock:
+    if not _punkt_ready:
+      try:
+        nltk.data.find("tokenizers/punkt_tab")
+      except LookupError:
+        nltk.download("punkt_tab", quiet=True)
+      _punkt_ready = True
+
+def sent_tokenize(text: str) -> list:
+  """Splits text into sentences with NLTK (imported and set up on first use).
+
+  Args:
+    text (str): The text to split.
+
+  Returns:
+    list: The sentences.
+  """
+  _ensure_punkt()
+  from nltk.tokenize import sent_tokenize as nltk_sent_tokenize
+  return nltk_sent_tokenize(text)
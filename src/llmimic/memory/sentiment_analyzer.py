@@ -1,20 +1,27 @@
-import torch
-from transformers import pipeline
-from datasets import Dataset
-import os
-import json
-import nltk
-nltk.download('punkt_tab')
+from typing import Optional
+from llmimic.inference_backend import InferenceBackend
+from .analysis_cache import AnalysisCache
+from .memory_store import MemoryStore
+from .sentences import sent_tokenize
 
-class SentimentAnalyzer:  
-    def __init__(self):
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.sentiment_analyzer = pipeline(
+class SentimentAnalyzer:
+    model_id = "cardiffnlp/twitter-roberta-base-sentiment"
+    label_mapping = {
+        'LABEL_0': 'negative',
+        'LABEL_2': 'positive'
+    }
+    neutral_label = 'LABEL_1'
+    cache = None
+
+    def __init__(self, backend: Optional[InferenceBackend] = None, cache: Optional[AnalysisCache] = None):
+        self.cache = cache
+        backend = backend if backend is not None else InferenceBackend()
+        self.sentiment_analyzer = backend.pipeline(
             "text-classification",
-            model="cardiffnlp/twitter-roberta-base-sentiment",
-            device=device
+            self.model_id,
+            "sequence-classification"
         )
-    
+
     def analyze_sentiment(self, text: str, batch_size=8):
         """Analyzes the string for sentiment.
 
@@ -25,67 +32,47 @@ class SentimentAnalyzer:
         Returns:
             _type_: The sentiment data.
         """
-        sentences = nltk.sent_tokenize(text)
-        
-        dataset = Dataset.from_dict({"text": sentences})
-        
-        def process_batch(batch):
-            print(batch)
-            results = self.sentiment_analyzer(batch["text"], batch_size=batch_size)
-            label_mapping = {
-                'LABEL_0': 'negative',
-                'LABEL_2': 'positive'
-            }
-            
-            sentiments = []
-            for i, res in enumerate(results):
-                label = label_mapping.get(res['label'], 'unknown')
-                score = res['score']
-                sentence = batch["text"][i]
-                
-                if res['label'] != 'LABEL_1':
-                    sentiments.append({
-                        "label": label,
-                        "score": score,
-                        "sentence": sentence
-                    })
-                else:
-                    sentiments.append(None)
-                
-            return {"sentiments": sentiments}
+        sentences = sent_tokenize(text)
+        return [item for item in self.analyze_sentences(sentences, batch_size=batch_size) if item is not None]
 
-        processed_dataset = dataset.map(process_batch, batched=True)
-        
-        return [item for item in processed_dataset["sentiments"] if item is not None]
-    
-    def append_to_sentiment_json(self, role: str, memory_data, memory_dir: str) -> None:
-        """Appends the data to the JSON file.
+    def analyze_sentences(self, sentences: list, batch_size: int = 16) -> list:
+        """Scores several sentences (from one or more messages) in one batched call.
 
         Args:
-            role (str): The role of the message.
-            memory_data (_type_): The sentiment data.
-            memory_dir (str): The memory directory.
-        """
-        sentiment_file = os.path.join(memory_dir, 'sentiment.json')
-
-        if not os.path.isfile(sentiment_file):
-            with open(sentiment_file, 'w') as file:
-                json.dump([], file)
+            sentences (list): The sentences to analyze.
+            batch_size (int, optional): Sentences per forward pass. Defaults to 16.
 
-        with open(sentiment_file, 'r') as file:
-            data = json.load(file)
+        Returns:
+            list: One {"label", "score", "sentence"} dict per sentence, or None where it's neutral.
+        """
+        if not sentences:
+            return []
+        if self.cache is None:
+            results = self._score(sentences, batch_size)
+        else:
+            results = self.cache.get_many(self.model_id, sentences, lambda misses: self._score(misses, batch_size))
+        # The sentence is attached after the lookup: a cached result may come from a differently spaced copy of it.
+        return [dict(result, sentence=sentence) if result is not None else None for sentence, result in zip(sentences, results)]
 
-        for entry in memory_data:
-            entry_data = {
-                "memory_data": {
-                    "role": role,
-                    "sentiment": entry["label"],
-                    "score": entry["score"],
-                    "sentence": entry["sentence"]
-                }
-            }
+    def _score(self, sentences: list, batch_size: int) -> list:
+        results = self.sentiment_analyzer(sentences, batch_size=batch_size)
+        sentiments = []
+        for res in results:
+            if res['label'] == self.neutral_label:
+                sentiments.append(None)
+                continue
+            sentiments.append({
+                "label": self.label_mapping.get(res['label'], 'unknown'),
+                "score": res['score']
+            })
+        return sentiments
 
-            data.append(entry_data)
+    def append_to_memory(self, role: str, memory_data, memory_store: MemoryStore) -> None:
+        """Appends the data to the memory store.
 
-        with open(sentiment_file, 'w') as file:
-            json.dump(data, file, indent=4)
\ No newline at end of file
+        Args:
+            role (str): The role of the message.
+            memory_data (_type_): The sentiment data.
+            memory_store (MemoryStore): Where the memories are written.
+        """
+        memory_store.add_sentiments(role, memory_data)
@@ -1,18 +1,51 @@
 import torch
-from transformers import pipeline
-import os
-import json
-from datetime import datetime
+from typing import Optional
+from transformers import AutoTokenizer
 from llmimic import logger
+from llmimic.inference_backend import InferenceBackend
+from .analysis_cache import AnalysisCache
+from .memory_store import MemoryStore
 
 class TextClassifier:
-    def __init__(self):
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.classifier = pipeline(
-            "zero-shot-classification",
-            model="facebook/bart-large-mnli",
-            device=device
-        )
+    """Zero-shot classifier built on an NLI model, scoring "This example is {label}." for every label.
+    The hypotheses are tokenized once and cached, premise/hypothesis pairs from several messages
+    are scored in the same forward pass, and two_stage mode only scores the personal labels
+    for messages that don't look like throwaway chatter in the first place.
+    """
+    model_id = "facebook/bart-large-mnli"
+    hypothesis_template = "This example is {}."
+    personal_gate_label = "a personal or emotional moment in a relationship"
+    cache = None
+
+    def __init__(self, model=None, tokenizer=None, batch_size: int = 32, two_stage: bool = False, max_length: int = 512,
+                 backend: Optional[InferenceBackend] = None, cache: Optional[AnalysisCache] = None):
+        """Init for TextClassifier.
+
+        Args:
+            model (optional): An NLI sequence classification model. Defaults to facebook/bart-large-mnli.
+            tokenizer (optional): The model's tokenizer. Defaults to the one for facebook/bart-large-mnli.
+            batch_size (int, optional): Premise/hypothesis pairs per forward pass. Defaults to 32.
+            two_stage (bool, optional): Gate on throwaway vs personal before scoring personal labels. Defaults to False.
+            max_length (int, optional): Max tokens per pair, the premise gets truncated to fit. Defaults to 512.
+            backend (InferenceBackend, optional): How the model is loaded and run. Defaults to None (plain torch).
+            cache (AnalysisCache, optional): Cache for classifications of texts seen before. Defaults to None.
+        """
+        self.cache = cache
+        backend = backend if backend is not None else InferenceBackend()
+        self.device = backend.device
+        self.tokenizer = tokenizer if tokenizer is not None else AutoTokenizer.from_pretrained(self.model_id)
+        if model is None:
+            model = backend.load_model("sequence-classification", self.model_id)
+        else:
+            model.to(self.device)
+            model.eval()
+        self.model = model
+        self.batch_size = batch_size
+        self.two_stage = two_stage
+        self.max_length = max_length
+        self.entailment_id = self._find_label_id("entail")
+        self._pair_template = self._derive_pair_template()
+        self._hypothesis_cache = {}
         self.__generate_candidate_labels()
 
     def __generate_candidate_labels(self):
@@ -46,6 +79,106 @@ class TextClassifier:
         self.personal_labels = personal_labels
         self.throwaway_labels = throwaway_labels
 
+    def _find_label_id(self, prefix: str) -> int:
+        for label, label_id in self.model.config.label2id.items():
+            if label.lower().startswith(prefix):
+                return int(label_id)
+        # Same fallback the zero-shot pipeline uses when the config doesn't name its labels.
+        return -1
+
+    def _derive_pair_template(self) -> tuple:
+        """Works out which special tokens the tokenizer wraps a premise/hypothesis pair in,
+        so cached token IDs can be stitched together without re-tokenizing.
+
+        Returns:
+            tuple: (prefix, middle, suffix) special token IDs.
+        """
+        premise = self.tokenizer("premise", add_special_tokens=False)["input_ids"]
+        hypothesis = self.tokenizer("hypothesis", add_special_tokens=False)["input_ids"]
+        pair = self.tokenizer("premise", "hypothesis")["input_ids"]
+        for start in range(len(pair) - len(premise) + 1):
+            if pair[start:start + len(premise)] != premise:
+                continue
+            middle_start = start + len(premise)
+            for end in range(middle_start, len(pair) - len(hypothesis) + 1):
+                if pair[end:end + len(hypothesis)] == hypothesis:
+                    return pair[:start], pair[middle_start:end], pair[end + len(hypothesis):]
+        raise ValueError("Could not work out how the tokenizer joins sentence pairs.")
+
+    def _hypothesis_ids(self, label: str) -> list:
+        ids = self._hypothesis_cache.get(label)
+        if ids is None:
+            ids = self.tokenizer(self.hypothesis_template.format(label), add_special_tokens=False)["input_ids"]
+            self._hypothesis_cache[label] = ids
+        return ids
+
+    def _build_pair(self, premise_ids: list, hypothesis_ids: list) -> dict:
+        prefix, middle, suffix = self._pair_template
+        room = self.max_length - len(prefix) - len(middle) - len(suffix) - len(hypothesis_ids)
+        first = prefix + premise_ids[:max(room, 0)] + middle
+        second = hypothesis_ids + suffix
+        pair = {"input_ids": first + second}
+        if "token_type_ids" in self.tokenizer.model_input_names:
+            pair["token_type_ids"] = [0] * len(first) + [1] * len(second)
+        return pair
+
+    def _score(self, texts: list, labels: list) -> torch.Tensor:
+        """Entailment logits for every (text, label) pair, batched across texts.
+
+        Args:
+            texts (list): The premises.
+            labels (list): The candidate labels.
+
+        Returns:
+            torch.Tensor: Shape (len(texts), len(labels)).
+        """
+        premises = self.tokenizer(texts, add_special_tokens=False)["input_ids"]
+        hypotheses = [self._hypothesis_ids(label) for label in labels]
+        pairs = [self._build_pair(premise, hypothesis) for premise in premises for hypothesis in hypotheses]
+
+        # Sorting by length keeps padding (and wasted compute) down inside each batch.
+        order = sorted(range(len(pairs)), key=lambda i: len(pairs[i]["input_ids"]))
+        scores = torch.empty(len(pairs))
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch_indices = order[start:start + self.batch_size]
+                batch = self.tokenizer.pad([pairs[i] for i in batch_indices], return_tensors="pt")
+                batch = {key: value.to(self.device) for key, value in batch.items()}
+                logits = self.model(**batch).logits
+                scores[batch_indices] = logits[:, self.entailment_id].float().cpu()
+        return scores.view(len(texts), len(labels))
+
+    def classify_batch(self, texts: list) -> list:
+        """Classifies several texts at once, sharing forward passes between them.
+
+        Args:
+            texts (list): The texts to classify.
+
+        Returns:
+            list: The classification found for each text, in order.
+        """
+        if not texts:
+            return []
+        if self.cache is None:
+            return self._classify(texts)
+        # Two-stage mode can pick a different label, so its results are cached separately.
+        cache_id = f"{self.model_id}:two_stage" if self.two_stage else self.model_id
+        return self.cache.get_many(cache_id, texts, self._classify)
+
+    def _classify(self, texts: list) -> list:
+        if not self.two_stage:
+            labels = self.personal_labels + self.throwaway_labels
+            return [labels[i] for i in self._score(texts, labels).argmax(dim=1).tolist()]
+
+        gate_labels = self.throwaway_labels + [self.personal_gate_label]
+        results = [gate_labels[i] for i in self._score(texts, gate_labels).argmax(dim=1).tolist()]
+        personal = [i for i, label in enumerate(results) if label == self.personal_gate_label]
+        if personal:
+            best = self._score([texts[i] for i in personal], self.personal_labels).argmax(dim=1).tolist()
+            for i, label_index in zip(personal, best):
+                results[i] = self.personal_labels[label_index]
+        return results
+
     def classify_text(self, text: str) -> str:
         """The function that classifies the text.
 
@@ -55,37 +188,33 @@ class TextClassifier:
         Returns:
             str: The classification it found.
         """
-        result = self.classifier(text, self.personal_labels + self.throwaway_labels)
-        return result['labels'][0]
+        return self.classify_batch([text])[0]
     
-    def append_to_memory(self, classification, role: str, original_text: str, memory_dir: str):
-        """Appends the memory data to the JSON file.
+    def append_to_memory(self, classification, role: str, original_text: str, memory_store: MemoryStore):
+        """Appends the memory data to the memory store.
 
         Args:
             classification (_type_): The classification data.
             role (str): The role of the message.
             original_text (str): The original message content.
-            memory_dir (str): The memory directory.
+            memory_store (MemoryStore): Where the memories are written.
         """
-        if classification not in self.personal_labels:
-            logger.info(f"Ignored classification: {classification}")
-            return
+        memory_store.add_classifications(role, self.memory_entries(classification, original_text))
 
-        memory_file = os.path.join(memory_dir, 'classification.json')
+    def memory_entries(self, classification, original_text: str) -> list:
+        """The classification memory of a message, if its classification is worth remembering.
 
-        memory_data = {
-            "datetime": datetime.now().isoformat(),
+        Args:
+            classification (_type_): The classification data.
+            original_text (str): The original message content.
+
+        Returns:
+            list: Nothing for throwaway classifications, otherwise a dict with "classification" and "message".
+        """
+        if classification not in self.personal_labels:
+            logger.debug("Ignored classification: %s", classification)
+            return []
+        return [{
             "classification": classification,
-            "role": role,
             "message": original_text
-        }
-
-        if not os.path.exists(memory_file):
-            with open(memory_file, 'w') as file:
-                json.dump({"memory_data": [memory_data]}, file, indent=4)
-        else:
-            with open(memory_file, 'r+') as file:
-                data = json.load(file)
-                data["memory_data"].append(memory_data)
-                file.seek(0)
-                json.dump(data, file, indent=4)
\ No newline at end of file
+        }]
@@ -0,0 +1,51 @@
+import numpy as np
+import torch
+from typing import Optional
+from transformers import AutoTokenizer
+from llmimic.inference_backend import InferenceBackend
+
+class TextEmbedder:
+    """Sentence embeddings for memory retrieval: mean-pooled, L2-normalized hidden states, so a dot
+    product is the cosine similarity. Texts are sorted by length before batching to keep padding down.
+    """
+    model_id = "sentence-transformers/all-MiniLM-L6-v2"
+
+    def __init__(self, batch_size: int = 32, max_length: int = 256, backend: Optional[InferenceBackend] = None):
+        """Init for TextEmbedder.
+
+        Args:
+            batch_size (int, optional): Texts per forward pass. Defaults to 32.
+            max_length (int, optional): Max tokens per text, longer ones are truncated. Defaults to 256.
+            backend (InferenceBackend, optional): How the model is loaded and run. Defaults to None (plain torch).
+        """
+        backend = backend if backend is not None else InferenceBackend()
+        self.device = backend.device
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+        self.model = backend.load_model("feature-extraction", self.model_id)
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.dimension = self.model.config.hidden_size
+
+    def embed(self, texts: list) -> np.ndarray:
+        """Embeds texts in batches.
+
+        Args:
+            texts (list): The texts to embed.
+
+        Returns:
+            np.ndarray: float32 array of shape (len(texts), dimension), one unit vector per text.
+        """
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch_indices = order[start:start + self.batch_size]
+                batch = self.tokenizer([texts[i] for i in batch_indices], padding=True, truncation=True,
+                                       max_length=self.max_length, return_tensors="pt")
+                batch = {key: value.to(self.device) for key, value in batch.items()}
+                hidden = self.model(**batch).last_hidden_state
+                mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                pooled = torch.nn.functional.normalize(pooled.float(), dim=-1)
+                embeddings[batch_indices] = pooled.cpu().numpy()
+        return embeddings
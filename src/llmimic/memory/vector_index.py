@@ -0,0 +1,190 @@
+import json
+import os
+import threading
+from typing import Optional
+import numpy as np
+from llmimic import logger
+
+class VectorIndex:
+    """Local nearest-neighbour index over unit vectors (dot product = cosine similarity), no service needed.
+    Vectors, their keys and (once trained) their IVF list assignments live in flat append-only files
+    that are memory-mapped, so opening an index with millions of entries doesn't read it into memory.
+    Up to ivf_threshold vectors, search is an exact scan; past it, k-means centroids are trained and
+    only the nprobe closest lists get scanned. The centroids are retrained whenever the index has
+    doubled since the last training. meta.json is replaced last and holds the authoritative count,
+    so a crash halfway through an append only loses the rows that weren't committed.
+    """
+    meta_filename = "meta.json"
+    vectors_filename = "vectors.f32"
+    keys_filename = "keys.i64"
+    lists_filename = "lists.i32"
+    centroids_filename = "centroids.npy"
+
+    def __init__(self, index_dir: str, dimension: int, model_id: Optional[str] = None, ivf_threshold: int = 50000,
+                 nprobe: int = 16, scan_chunk: int = 65536):
+        """Init for VectorIndex. Opens the index in index_dir, creating it if it isn't there yet.
+
+        Args:
+            index_dir (str): The directory the index files live in.
+            dimension (int): The vector dimension.
+            model_id (str, optional): The embedding model; an index built with another model is discarded. Defaults to None.
+            ivf_threshold (int, optional): Vector count past which the IVF lists are used. Defaults to 50000.
+            nprobe (int, optional): IVF lists scanned per search. Defaults to 16.
+            scan_chunk (int, optional): Rows scored at a time in an exact scan. Defaults to 65536.
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_dir = index_dir
+        self.dimension = dimension
+        self.model_id = model_id
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.scan_chunk = scan_chunk
+        self._lock = threading.Lock()
+        self._vectors = self._keys = self._lists = None
+        self.centroids = None
+        self.meta = self._load_meta()
+        if self.meta["trained_count"]:
+            self.centroids = np.load(self._path(self.centroids_filename))
+        self._remap()
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.index_dir, filename)
+
+    def _load_meta(self) -> dict:
+        fresh = {"dimension": self.dimension, "model_id": self.model_id, "count": 0, "trained_count": 0, "cursors": {}}
+        meta_path = self._path(self.meta_filename)
+        if not os.path.exists(meta_path):
+            return fresh
+        with open(meta_path, "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        if meta.get("dimension") != self.dimension or meta.get("model_id") != self.model_id:
+            logger.warning(f"Vector index in {self.index_dir} was built with another embedding model, rebuilding it.")
+            for filename in (self.vectors_filename, self.keys_filename, self.lists_filename, self.centroids_filename):
+                if os.path.exists(self._path(filename)):
+                    os.remove(self._path(filename))
+            return fresh
+        return meta
+
+    def _write_meta(self) -> None:
+        meta_path = self._path(self.meta_filename)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(self.meta, file)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def _map(self, filename: str, dtype, width: int = 1):
+        count = self.meta["count"]
+        shape = (count, width) if width > 1 else (count,)
+        if count == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(self._path(filename), dtype=dtype, mode="r", shape=shape)
+
+    def _remap(self) -> None:
+        self._vectors = self._map(self.vectors_filename, np.float32, self.dimension)
+        self._keys = self._map(self.keys_filename, np.int64)
+        self._lists = self._map(self.lists_filename, np.int32) if self.centroids is not None else None
+
+    def _append(self, filename: str, array: np.ndarray, committed_bytes: int) -> None:
+        """Appends raw rows to a file, first cutting off anything past the committed rows."""
+        path = self._path(filename)
+        with open(path, "r+b" if os.path.exists(path) else "wb") as file:
+            file.truncate(committed_bytes)
+            file.seek(committed_bytes)
+            file.write(np.ascontiguousarray(array).tobytes())
+
+    def __len__(self) -> int:
+        return self.meta["count"]
+
+    def cursor(self, name: str) -> int:
+        """Where incremental indexing of a source left off (e.g. the last row ID embedded from a table)."""
+        return self.meta["cursors"].get(name, 0)
+
+    def add(self, keys: list, vectors: np.ndarray, cursors: Optional[dict] = None) -> None:
+        """Appends vectors and commits them together with the new cursors.
+
+        Args:
+            keys (list): One int64 key per vector.
+            vectors (np.ndarray): Unit vectors, shape (len(keys), dimension).
+            cursors (dict, optional): Source cursors to store along with the vectors. Defaults to None.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        keys = np.asarray(keys, dtype=np.int64)
+        with self._lock:
+            count = self.meta["count"]
+            # Drop the maps first, the files are about to change size under them.
+            self._vectors = self._keys = self._lists = None
+            if len(keys):
+                self._append(self.vectors_filename, vectors, count * self.dimension * 4)
+                self._append(self.keys_filename, keys, count * 8)
+                if self.centroids is not None:
+                    self._append(self.lists_filename, self._assign(vectors), count * 4)
+            self.meta["count"] = count + len(keys)
+            self.meta["cursors"].update(cursors or {})
+            self._write_meta()
+            self._remap()
+            trained = self.meta["trained_count"]
+            if self.meta["count"] >= self.ivf_threshold and (not trained or self.meta["count"] >= 2 * trained):
+                self._train()
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        lists = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), self.scan_chunk):
+            chunk = np.asarray(vectors[start:start + self.scan_chunk])
+            lists[start:start + len(chunk)] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return lists
+
+    def _train(self, iterations: int = 10) -> None:
+        """Trains the IVF centroids (spherical k-means on a sample) and reassigns every vector."""
+        count = self.meta["count"]
+        nlist = int(min(max(np.sqrt(count), 16), 1024))
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(count, size=min(count, nlist * 64), replace=False))
+        sample = np.asarray(self._vectors[sample_rows])
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # An empty list keeps its old centroid.
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids).astype(np.float32)
+        self.centroids = centroids
+        lists = self._assign(self._vectors)
+        self._lists = None
+        lists.tofile(self._path(self.lists_filename))
+        np.save(self._path(self.centroids_filename), centroids)
+        self.meta["trained_count"] = count
+        self._write_meta()
+        self._remap()
+        logger.info(f"Trained {nlist} IVF lists over {count} memory vectors.")
+
+    def search(self, query: np.ndarray, k: int = 5) -> list:
+        """The k nearest vectors to a query.
+
+        Args:
+            query (np.ndarray): A unit vector.
+            k (int, optional): How many results. Defaults to 5.
+
+        Returns:
+            list: (key, score) tuples, best first.
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(self.dimension)
+        with self._lock:
+            vectors, keys, lists, centroids = self._vectors, self._keys, self._lists, self.centroids
+        if len(keys) == 0 or k <= 0:
+            return []
+
+        if centroids is not None:
+            probes = np.argsort(centroids @ query)[-self.nprobe:]
+            rows = np.flatnonzero(np.isin(lists, probes))
+            scores = np.asarray(vectors[rows]) @ query
+        else:
+            rows = None
+            scores = np.empty(len(keys), dtype=np.float32)
+            for start in range(0, len(keys), self.scan_chunk):
+                scores[start:start + self.scan_chunk] = np.asarray(vectors[start:start + self.scan_chunk]) @ query
+
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        best = best[np.argsort(-scores[best])]
+        positions = rows[best] if rows is not None else best
+        return [(int(keys[position]), float(scores[i])) for position, i in zip(positions, best)]
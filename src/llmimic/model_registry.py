@@ -0,0 +1,210 @@
+import sys
+import threading
+import time
+from typing import Any, Callable, Optional
+from . import logger
+
+class ModelRegistry:
+  """Keeps models resident between calls instead of reloading them from disk every time.
+  Each model is registered with a factory and only loaded the first time somebody asks for it.
+  One registry can be shared by several LLMInstance sessions, so they all use the same weights.
+  If idle_timeout is set, models nobody has touched in that many seconds get evicted. Callers that
+  keep a model around instead of calling get() each time take it with acquire() and hand it back
+  with release(); a model that is held like that is never evicted for being idle.
+  """
+  def __init__(self, idle_timeout: Optional[float] = None):
+    """Init for ModelRegistry.
+
+    Args:
+      idle_timeout (float, optional): Seconds of inactivity before a model is evicted. Defaults to None (never).
+    """
+    self.idle_timeout = None
+    self._factories = {}
+    self._models = {}
+    self._last_used = {}
+    self._holders = {}
+    self._load_locks = {}
+    self._lock = threading.RLock()
+    self._reaper = None
+    self._stop_event = threading.Event()
+    self.set_idle_timeout(idle_timeout)
+
+  def register(self, name: str, factory: Callable[[], Any], replace: bool = False) -> None:
+    """Registers a factory for a model. Nothing is loaded until get() is called.
+
+    Args:
+      name (str): The name the model is looked up by.
+      factory (Callable[[], Any]): Callable that builds the model.
+      replace (bool, optional): Replace an existing factory (and evict its model). Defaults to False.
+    """
+    with self._lock:
+      if name in self._factories and not replace:
+        return
+      if replace:
+        self.evict(name)
+      self._factories[name] = factory
+      self._load_locks.setdefault(name, threading.Lock())
+
+  def is_registered(self, name: str) -> bool:
+    return name in self._factories
+
+  def is_loaded(self, name: str) -> bool:
+    return name in self._models
+
+  def get(self, name: str) -> Any:
+    """Returns the model, loading it first if it isn't resident yet.
+    Concurrent callers asking for the same model wait on a single load.
+
+    Args:
+      name (str): The name of the model.
+
+    Raises:
+      KeyError: No factory registered under that name.
+
+    Returns:
+      Any: Whatever the factory built.
+    """
+    with self._lock:
+      if name not in self._factories:
+        raise KeyError(f"Model '{name}' is not registered.")
+      model = self._models.get(name)
+      if model is not None:
+        self._last_used[name] = time.monotonic()
+        return model
+      load_lock = self._load_locks[name]
+
+    with load_lock:
+      with self._lock:
+        model = self._models.get(name)
+        factory = self._factories[name]
+      if model is None:
+        logger.info(f"Loading model '{name}'.")
+        start = time.perf_counter()
+        model = factory()
+        logger.info(f"Loaded model '{name}' in {time.perf_counter() - start:.2f}s.")
+        with self._lock:
+          self._models[name] = model
+
+    with self._lock:
+      self._last_used[name] = time.monotonic()
+    return model
+
+  def acquire(self, name: str) -> Any:
+    """Like get(), but the model stays marked as in use (and out of idle eviction) until release().
+
+    Args:
+      name (str): The name of the model.
+
+    Raises:
+      KeyError: No factory registered under that name.
+
+    Returns:
+      Any: Whatever the factory built.
+    """
+    with self._lock:
+      self._holders[name] = self._holders.get(name, 0) + 1
+    try:
+      return self.get(name)
+    except BaseException:
+      self.release(name)
+      raise
+
+  def release(self, name: str) -> None:
+    """Hands back a model taken with acquire(). Its idle time starts counting from here.
+
+    Args:
+      name (str): The name of the model.
+    """
+    with self._lock:
+      holders = self._holders.get(name, 0) - 1
+      if holders > 0:
+        self._holders[name] = holders
+      else:
+        self._holders.pop(name, None)
+      if name in self._last_used:
+        self._last_used[name] = time.monotonic()
+
+  def is_held(self, name: str) -> bool:
+    return name in self._holders
+
+  def evict(self, name: Optional[str] = None) -> None:
+    """Drops a model (or all of them) from memory. It'll be reloaded on the next get().
+
+    Args:
+      name (str, optional): The model to evict. Defaults to None (evict everything).
+    """
+    with self._lock:
+      names = list(self._models) if name is None else [name]
+      evicted = False
+      for model_name in names:
+        if self._models.pop(model_name, None) is not None:
+          self._last_used.pop(model_name, None)
+          logger.info(f"Evicted model '{model_name}'.")
+          evicted = True
+    if evicted:
+      self._release_device_memory()
+
+  def evict_idle(self) -> list:
+    """Evicts every model that has been idle longer than idle_timeout and isn't held through acquire().
+
+    Returns:
+      list: The names of the evicted models.
+    """
+    if self.idle_timeout is None:
+      return []
+    now = time.monotonic()
+    with self._lock:
+      idle = [name for name, last_used in self._last_used.items()
+              if now - last_used >= self.idle_timeout and name not in self._holders]
+      for name in idle:
+        self.evict(name)
+    return idle
+
+  def set_idle_timeout(self, idle_timeout: Optional[float]) -> None:
+    """Sets (or clears) the idle eviction timeout and starts the reaper thread if needed.
+
+    Args:
+      idle_timeout (float, optional): Seconds of inactivity before eviction, None to disable.
+    """
+    with self._lock:
+      self.idle_timeout = idle_timeout
+      if idle_timeout is not None and (self._reaper is None or not self._reaper.is_alive()):
+        self._stop_event.clear()
+        self._reaper = threading.Thread(target=self._reap, name="ModelRegistryReaper", daemon=True)
+        self._reaper.start()
+
+  def shutdown(self) -> None:
+    """Stops the reaper thread and evicts all models."""
+    self._stop_event.set()
+    if self._reaper is not None:
+      self._reaper.join()
+      self._reaper = None
+    self.evict()
+
+  def _reap(self) -> None:
+    while self.idle_timeout is not None:
+      interval = min(max(self.idle_timeout / 2, 0.05), 30.0)
+      if self._stop_event.wait(interval):
+        return
+      self.evict_idle()
+
+  def _release_device_memory(self) -> None:
+    # Only bother if torch is already loaded, no point importing it just to empty a cache.
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+      torch.cuda.empty_cache()
+
+_shared_registry = None
+_shared_registry_lock = threading.Lock()
+
+def get_shared_registry() -> ModelRegistry:
+  """Returns the process-wide registry used by default by every session.
+
+  Returns:
+    ModelRegistry: The shared registry.
+  """
+  global _shared_registry
+  with _shared_registry_lock:
+    if _shared_registry is None:
+      _shared_registry = ModelRegistry()
+    return _shared_registry
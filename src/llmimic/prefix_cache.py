@@ -0,0 +1,203 @@
+import threading
+import time
+from typing import Optional
+import torch
+from transformers import DynamicCache, StoppingCriteria, StoppingCriteriaList
+from . import logger
+from .context_window import encode_chat
+from .tracing import get_shared_tracer, span
+
+class _FirstTokenMarker(StoppingCriteria):
+  """Notes when the first new token is out, which is where generate() goes from prefill to decode. Never stops anything."""
+  def __init__(self):
+    self.first_token_at = None
+
+  def __call__(self, input_ids: torch.Tensor, scores: torch.Tensor, **kwargs) -> torch.Tensor:
+    if self.first_token_at is None:
+      self.first_token_at = time.perf_counter_ns()
+    return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+class StopOnEvent(StoppingCriteria):
+  """Stops generate() once the event is set, e.g. when whoever reads a stream stops reading."""
+  def __init__(self, event: threading.Event):
+    self.event = event
+
+  def __call__(self, input_ids: torch.Tensor, scores: torch.Tensor, **kwargs) -> torch.Tensor:
+    return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+def generate_with_stages(model, prompt_tokens: int, **generate_kwargs):
+  """model.generate(), traced as an "llm.prefill" and an "llm.decode" span.
+
+  Args:
+    model: The causal LM.
+    prompt_tokens (int): Tokens being prefilled, recorded on the prefill span.
+    **generate_kwargs: Passed on to model.generate().
+
+  Returns:
+    Whatever model.generate() returns.
+  """
+  marker = _FirstTokenMarker()
+  generate_kwargs["stopping_criteria"] = StoppingCriteriaList(list(generate_kwargs.get("stopping_criteria") or []) + [marker])
+  start = time.perf_counter_ns()
+  outputs = model.generate(**generate_kwargs)
+  end = time.perf_counter_ns()
+  first_token_at = marker.first_token_at if marker.first_token_at is not None else end
+  tracer = get_shared_tracer()
+  tracer.record("llm.prefill", start, first_token_at, tokens=prompt_tokens)
+  tracer.record("llm.decode", first_token_at, end)
+  return outputs
+
+class PrefixCachedGenerator:
+  """Generation that keeps the KV cache from the previous turn around.
+  Each turn's prompt is compared token by token with what the cache holds; only the part after the
+  longest common prefix gets prefilled. Because the comparison is on tokens, anything that rewrites
+  earlier messages (summaries, the context window sliding) automatically cuts the reuse back to the
+  point where the prompts differ, so a stale cache can never be used.
+  """
+  def __init__(self, model, tokenizer, cache_all_turns: bool = True):
+    """Init for PrefixCachedGenerator.
+
+    Args:
+      model: The causal LM (e.g. pipe.model).
+      tokenizer: Its tokenizer, with a chat template.
+      cache_all_turns (bool, optional): Keep the whole conversation cached, not just the stable prefix. Defaults to True.
+    """
+    self.model = model
+    self.tokenizer = tokenizer
+    self.cache_all_turns = cache_all_turns
+    self._cache = None
+    self._cached_ids = []
+    self._prefix_key = None
+    self._prefix_length = 0
+    self._lock = threading.Lock()
+    self.last_reused_tokens = 0
+    self.last_prefilled_tokens = 0
+
+  def invalidate(self) -> None:
+    """Drops the cache, the next turn prefills everything."""
+    with self._lock:
+      self._cache = None
+      self._cached_ids = []
+
+  def encode(self, messages: list, add_generation_prompt: bool = True) -> list:
+    """Applies the chat template to the messages.
+
+    Args:
+      messages (list): The prompt messages.
+      add_generation_prompt (bool, optional): Append the assistant header. Defaults to True.
+
+    Returns:
+      list: The token IDs.
+    """
+    return encode_chat(self.tokenizer, messages, add_generation_prompt=add_generation_prompt)
+
+  def _reusable_cache(self, input_ids: list) -> tuple:
+    """Crops the cache down to the longest prefix it shares with input_ids.
+    At least one token is always left to prefill, generate() needs something to run on.
+
+    Args:
+      input_ids (list): The new prompt.
+
+    Returns:
+      tuple: (cache, reused token count)
+    """
+    reuse = 0
+    for cached, new in zip(self._cached_ids, input_ids[:-1]):
+      if cached != new:
+        break
+      reuse += 1
+
+    if self._cache is None or reuse == 0:
+      return DynamicCache(), 0
+
+    excess = self._cache.get_seq_length() - reuse
+    if excess > 0:
+      self._cache.crop(-excess)
+    self._cached_ids = self._cached_ids[:reuse]
+    return self._cache, reuse
+
+  def generate_ids(self, input_ids: list, prefix_length: Optional[int] = None, **generate_kwargs) -> list:
+    """Generates from token IDs, reusing as much of the cached prefix as possible.
+
+    Args:
+      input_ids (list): The full prompt.
+      prefix_length (int, optional): Length of the stable prefix (persona/system block), only
+        used when cache_all_turns is off. Defaults to None.
+      **generate_kwargs: Passed on to model.generate().
+
+    Returns:
+      list: The newly generated token IDs.
+    """
+    with self._lock:
+      cache, reuse = self._reusable_cache(input_ids)
+      self.last_reused_tokens = reuse
+      self.last_prefilled_tokens = len(input_ids) - reuse
+      logger.debug("Prefix cache: reusing %d tokens, prefilling %d.", reuse, len(input_ids) - reuse)
+
+      # generate() doesn't expand a cache it's handed to the beam count, so that's done here. Every beam
+      # shares the prompt, so afterwards beam 0 cut back to the prompt is what's kept.
+      beams = generate_kwargs.get("num_beams", 1) or 1
+      if beams > 1:
+        cache.batch_repeat_interleave(beams)
+
+      input_tensor = torch.tensor([input_ids], device=self.model.device)
+      try:
+        with torch.inference_mode():
+          outputs = generate_with_stages(
+            self.model,
+            len(input_ids) - reuse,
+            input_ids=input_tensor,
+            attention_mask=torch.ones_like(input_tensor),
+            past_key_values=cache,
+            return_dict_in_generate=True,
+            **generate_kwargs
+          )
+      except Exception:
+        self._cache, self._cached_ids = None, []
+        raise
+      sequence = outputs.sequences[0].tolist()
+
+      self._cache = cache
+      if beams > 1:
+        cache.batch_select_indices(torch.tensor([0], device=self.model.device))
+        excess = cache.get_seq_length() - len(input_ids)
+        if excess > 0:
+          cache.crop(-excess)
+        self._cached_ids = input_ids[:cache.get_seq_length()]
+      else:
+        self._cached_ids = sequence[:cache.get_seq_length()]
+
+      if not self.cache_all_turns:
+        keep = min(prefix_length or 0, len(self._cached_ids))
+        if keep == 0:
+          self._cache, self._cached_ids = None, []
+        else:
+          excess = self._cache.get_seq_length() - keep
+          if excess > 0:
+            self._cache.crop(-excess)
+          self._cached_ids = self._cached_ids[:keep]
+
+      return sequence[len(input_ids):]
+
+  def generate(self, messages: list, prefix_messages: int = 0, **generate_kwargs) -> str:
+    """Generates a reply to the messages.
+
+    Args:
+      messages (list): The prompt messages.
+      prefix_messages (int, optional): How many leading messages make up the stable prefix. Defaults to 0.
+      **generate_kwargs: Passed on to model.generate().
+
+    Returns:
+      str: The decoded reply.
+    """
+    with span("llm.tokenize"):
+      input_ids = self.encode(messages)
+      prefix_length = None
+      if not self.cache_all_turns and prefix_messages:
+        prefix_key = tuple(message["content"] for message in messages[:prefix_messages])
+        if prefix_key != self._prefix_key:
+          self._prefix_key = prefix_key
+          self._prefix_length = len(self.encode(messages[:prefix_messages], add_generation_prompt=False))
+        prefix_length = self._prefix_length
+    new_ids = self.generate_ids(input_ids, prefix_length=prefix_length, **generate_kwargs)
+    return self.tokenizer.decode(new_ids, skip_special_tokens=True)
@@ -0,0 +1,121 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+from . import logger
+
+class RollingSummary:
+  """Hierarchical rolling summary of the conversation that has scrolled past the recent turns.
+  Once `block_size` messages are older than the newest `recent_keep`, they're summarized into a
+  block summary (each block only ever gets summarized once). When there are more than `max_blocks`
+  block summaries, the oldest ones are merged into the running summary. So the prompt carries at most
+  one running summary, `max_blocks` block summaries and fewer than block_size + recent_keep raw
+  messages, no matter how long the chat gets.
+  The summarizing happens on a background thread; each result is committed in one step under `lock`
+  (state and on_commit together), so readers holding the lock see either the old or the new summary.
+  """
+  def __init__(self, history: list, summarize_fn: Callable[[list], list], start: int = 3, block_size: int = 8,
+               recent_keep: int = 4, max_blocks: int = 4, on_commit: Optional[Callable[["RollingSummary"], None]] = None,
+               background: bool = True):
+    """Init for RollingSummary.
+
+    Args:
+      history (list): The message history (read, never modified).
+      summarize_fn (Callable[[list], list]): Summarizes a list of texts, returns a list of summaries.
+      start (int, optional): Messages before this index (system/user info/intro) are never summarized. Defaults to 3.
+      block_size (int, optional): Messages per block summary. Defaults to 8.
+      recent_keep (int, optional): Newest messages that always stay verbatim. Defaults to 4.
+      max_blocks (int, optional): Block summaries kept before the oldest get merged into the running summary. Defaults to 4.
+      on_commit (Callable[[RollingSummary], None], optional): Called under the lock after each commit. Defaults to None.
+      background (bool, optional): Summarize on a worker thread. Defaults to True.
+    """
+    self.history = history
+    self.summarize_fn = summarize_fn
+    self.block_size = max(1, block_size)
+    self.recent_keep = recent_keep
+    self.max_blocks = max(1, max_blocks)
+    self.on_commit = on_commit
+    self.lock = threading.RLock()
+    self.summary = None
+    self.blocks = []
+    self.upto = start
+    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="RollingSummary") if background else None
+    self._job = None
+
+  def text(self) -> Optional[str]:
+    """The summary as it goes into the prompt: running summary first, then the block summaries.
+
+    Returns:
+      str: The summary text, or None if nothing has been summarized yet.
+    """
+    with self.lock:
+      parts = ([self.summary] if self.summary else []) + self.blocks
+    return "\n".join(parts) if parts else None
+
+  def _pending_blocks(self) -> int:
+    return max(0, len(self.history) - self.recent_keep - self.upto) // self.block_size
+
+  def schedule(self) -> Optional[Future]:
+    """Starts summarizing whatever full blocks have built up, unless a job is already running.
+
+    Returns:
+      Future: The job (already finished when not running in the background), or None if there was nothing to do.
+    """
+    with self.lock:
+      if self._job is not None and not self._job.done():
+        return self._job
+      if self._pending_blocks() == 0:
+        return None
+      if self._executor is None:
+        self._job = Future()
+        self._run()
+        self._job.set_result(None)
+      else:
+        self._job = self._executor.submit(self._run)
+      return self._job
+
+  @staticmethod
+  def _transcript(messages: list) -> str:
+    return "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+
+  def _run(self) -> None:
+    """Summarizes full blocks until it has caught up with the history (messages that arrive meanwhile included)."""
+    while True:
+      with self.lock:
+        blocks = self._pending_blocks()
+        if blocks == 0:
+          return
+        start, end = self.upto, self.upto + blocks * self.block_size
+        messages = list(self.history[start:end])
+      try:
+        self._summarize(messages, start, end)
+      except Exception as e:
+        logger.error(f"Rolling summary failed: {e}")
+        return
+
+  def _summarize(self, messages: list, start: int, end: int) -> None:
+    """Summarizes history[start:end] into new blocks, merges the overflowing blocks and commits."""
+    transcripts = [self._transcript(messages[i:i + self.block_size]) for i in range(0, len(messages), self.block_size)]
+    new_blocks = self.summarize_fn(transcripts)
+    with self.lock:
+      summary, blocks = self.summary, self.blocks + list(new_blocks)
+    if len(blocks) > self.max_blocks:
+      overflow, blocks = blocks[:len(blocks) - self.max_blocks], blocks[len(blocks) - self.max_blocks:]
+      summary = self.summarize_fn(["\n".join(([summary] if summary else []) + overflow)])[0]
+    with self.lock:
+      self.summary, self.blocks, self.upto = summary, blocks, end
+      if self.on_commit is not None:
+        self.on_commit(self)
+    logger.info(f"Rolling summary now covers messages up to {end} ({len(blocks)} block(s)).")
+
+  def wait(self, timeout: Optional[float] = None) -> None:
+    """Waits for the running job, if any."""
+    with self.lock:
+      job = self._job
+    if job is not None:
+      job.result(timeout)
+
+  def close(self) -> None:
+    """Finishes the running job and stops the worker thread."""
+    if self._executor is not None:
+      self.wait()
+      self._executor.shutdown(wait=True)
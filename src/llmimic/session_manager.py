@@ -0,0 +1,251 @@
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Optional
+import torch
+from . import logger, UserData
+from .llm_instance import LLMInstance
+from .model_registry import get_shared_registry
+from .prefix_cache import generate_with_stages
+from .tracing import span
+
+class _Request:
+  __slots__ = ("input_ids", "generation_kwargs", "key", "future", "enqueued_at")
+
+  def __init__(self, input_ids: list, generation_kwargs: dict):
+    self.input_ids = input_ids
+    self.generation_kwargs = generation_kwargs
+    self.key = tuple(sorted(generation_kwargs.items()))
+    self.future = Future()
+    self.enqueued_at = time.monotonic()
+
+class BatchScheduler:
+  """Groups pending generate calls from many sessions into padded batches on one shared model.
+  A batch is sent off as soon as it's full (max_batch_size) or the oldest request has waited
+  max_wait seconds. Only requests with identical generation parameters share a batch; the rest
+  wait for the next round, oldest first.
+  """
+  def __init__(self, model, tokenizer, max_batch_size: int = 8, max_wait: float = 0.02):
+    """Init for BatchScheduler. Starts the scheduling thread.
+
+    Args:
+      model: The causal LM shared by every session.
+      tokenizer: Its tokenizer (used for the pad token).
+      max_batch_size (int, optional): Max requests per forward batch. Defaults to 8.
+      max_wait (float, optional): Max seconds a request waits for others to batch with. Defaults to 0.02.
+    """
+    self.model = model
+    self.tokenizer = tokenizer
+    self.max_batch_size = max_batch_size
+    self.max_wait = max_wait
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    self.pad_token_id = pad_token_id if pad_token_id is not None else 0
+    self._pending = []
+    self._condition = threading.Condition()
+    self._closed = False
+    self._batches = 0
+    self._requests = 0
+    self._generated_tokens = 0
+    self._thread = threading.Thread(target=self._run, name="BatchScheduler", daemon=True)
+    self._thread.start()
+
+  def submit(self, input_ids: list, **generation_kwargs) -> Future:
+    """Queues a prompt for generation.
+
+    Args:
+      input_ids (list): The prompt token IDs.
+      **generation_kwargs: Passed on to model.generate().
+
+    Raises:
+      RuntimeError: The scheduler has been closed.
+
+    Returns:
+      Future: Resolves to the list of newly generated token IDs.
+    """
+    request = _Request(list(input_ids), generation_kwargs)
+    with self._condition:
+      if self._closed:
+        raise RuntimeError("Batch scheduler is closed.")
+      self._pending.append(request)
+      self._condition.notify_all()
+    return request.future
+
+  def _next_batch(self) -> list:
+    """Waits for the oldest request, then collects compatible ones until the batch is full or max_wait runs out.
+
+    Returns:
+      list: The requests to run together (empty once closed and drained).
+    """
+    with self._condition:
+      self._condition.wait_for(lambda: self._pending or self._closed)
+      if not self._pending:
+        return []
+      head = self._pending[0]
+      deadline = head.enqueued_at + self.max_wait
+      while not self._closed:
+        compatible = sum(1 for request in self._pending if request.key == head.key)
+        remaining = deadline - time.monotonic()
+        if compatible >= self.max_batch_size or remaining <= 0:
+          break
+        self._condition.wait(remaining)
+      batch = [request for request in self._pending if request.key == head.key][:self.max_batch_size]
+      for request in batch:
+        self._pending.remove(request)
+      return batch
+
+  def _run(self) -> None:
+    while True:
+      batch = self._next_batch()
+      if not batch:
+        return
+      try:
+        results = self._generate(batch)
+        for request, new_ids in zip(batch, results):
+          request.future.set_result(new_ids)
+      except Exception as e:
+        logger.error(f"Batched generation failed: {e}")
+        for request in batch:
+          if not request.future.done():
+            request.future.set_exception(e)
+
+  def _generate(self, batch: list) -> list:
+    """Left-pads the prompts, runs one generate call and splits the results.
+
+    Args:
+      batch (list): The requests.
+
+    Returns:
+      list: The new token IDs for each request, in order.
+    """
+    longest = max(len(request.input_ids) for request in batch)
+    input_ids = [[self.pad_token_id] * (longest - len(request.input_ids)) + request.input_ids for request in batch]
+    attention_mask = [[0] * (longest - len(request.input_ids)) + [1] * len(request.input_ids) for request in batch]
+    device = self.model.device
+    with span("llm.batch", requests=len(batch)), torch.inference_mode():
+      sequences = generate_with_stages(
+        self.model,
+        sum(len(request.input_ids) for request in batch),
+        input_ids=torch.tensor(input_ids, device=device),
+        attention_mask=torch.tensor(attention_mask, device=device),
+        pad_token_id=self.pad_token_id,
+        **batch[0].generation_kwargs
+      )
+
+    eos_ids = self.model.generation_config.eos_token_id
+    eos_ids = set(eos_ids if isinstance(eos_ids, list) else [eos_ids]) - {None}
+    results = []
+    for sequence in sequences[:, longest:].tolist():
+      # Sequences that finished early are padded out to the longest one, cut them at their EOS.
+      for i, token in enumerate(sequence):
+        if token in eos_ids:
+          sequence = sequence[:i]
+          break
+      results.append(sequence)
+
+    with self._condition:
+      self._batches += 1
+      self._requests += len(batch)
+      self._generated_tokens += sum(len(result) for result in results)
+    logger.debug("Generated a batch of %d request(s).", len(batch))
+    return results
+
+  def metrics(self) -> dict:
+    """Batching and throughput counters.
+
+    Returns:
+      dict: pending, batches, requests, mean_batch_size and generated_tokens.
+    """
+    with self._condition:
+      return {
+        "pending": len(self._pending),
+        "batches": self._batches,
+        "requests": self._requests,
+        "mean_batch_size": self._requests / self._batches if self._batches else 0.0,
+        "generated_tokens": self._generated_tokens,
+      }
+
+  def close(self) -> None:
+    """Finishes whatever is queued and stops the scheduling thread."""
+    with self._condition:
+      self._closed = True
+      self._condition.notify_all()
+    self._thread.join()
+
+class SessionManager:
+  """Hosts many chat sessions on one text generation model.
+  Every session is a regular LLMInstance; they share the pipeline through the model registry and
+  their generate_response calls go through one BatchScheduler, so concurrent users get batched
+  together instead of queueing up one at a time.
+  """
+  def __init__(self, max_batch_size: int = 8, max_wait: float = 0.02):
+    """Init for SessionManager.
+
+    Args:
+      max_batch_size (int, optional): Max requests per forward batch. Defaults to 8.
+      max_wait (float, optional): Max seconds a request waits for others to batch with. Defaults to 0.02.
+    """
+    self.max_batch_size = max_batch_size
+    self.max_wait = max_wait
+    self.scheduler = None
+    self._scheduler_model = None
+    self.sessions = {}
+    self._lock = threading.Lock()
+
+  def create_session(self, user_data: UserData, preset_name: str) -> Optional[str]:
+    """Starts a new session.
+
+    Args:
+      user_data (UserData): The user's data.
+      preset_name (str): The preset from configs/presets.json.
+
+    Returns:
+      str: The session ID, or None if the session failed to start.
+    """
+    session = LLMInstance(scheduler=self.scheduler)
+    if not session.start(user_data, preset_name):
+      return None
+    with self._lock:
+      # The model is only loaded once the first session starts, so that's when the scheduler can exist.
+      if self.scheduler is None:
+        # The scheduler keeps the model too, so it holds on to it in the registry until shutdown().
+        get_shared_registry().acquire(session.pipe_name)
+        self._scheduler_model = session.pipe_name
+        self.scheduler = BatchScheduler(session.pipe.model, session.pipe.tokenizer,
+                                        max_batch_size=self.max_batch_size, max_wait=self.max_wait)
+      session.scheduler = self.scheduler
+      session_id = str(uuid.uuid4())
+      self.sessions[session_id] = session
+    logger.info(f"Session {session_id} created ({len(self.sessions)} active).")
+    return session_id
+
+  def get_session(self, session_id: str) -> LLMInstance:
+    return self.sessions[session_id]
+
+  def generate_response(self, session_id: str, prompt: str) -> str:
+    """Generates a reply in one session. Safe to call from many threads at once.
+
+    Args:
+      session_id (str): The session ID.
+      prompt (str): The user prompt.
+
+    Returns:
+      str: The reply.
+    """
+    return self.get_session(session_id).generate_response(prompt)
+
+  def close_session(self, session_id: str) -> None:
+    with self._lock:
+      session = self.sessions.pop(session_id, None)
+    if session is not None:
+      session.stop()
+
+  def shutdown(self) -> None:
+    """Stops every session and the scheduler."""
+    for session_id in list(self.sessions):
+      self.close_session(session_id)
+    if self.scheduler is not None:
+      self.scheduler.close()
+      self.scheduler = None
+      get_shared_registry().release(self._scheduler_model)
+      self._scheduler_model = None
@@ -0,0 +1,118 @@
+import re
+import threading
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+class StreamTrimmer:
+  """Incremental version of LLMInstance.trim_after_last_punctuation for streamed text.
+  Text is released up to the last sentence boundary seen so far (punctuation followed by whitespace);
+  whatever comes after it is held back, since it might turn out to be a hung sentence.
+  """
+  _boundary = re.compile(r'[.?!](?=\s)')
+
+  def __init__(self, trim_fn: Callable[[str], str]):
+    """Init for StreamTrimmer.
+
+    Args:
+      trim_fn (Callable[[str], str]): The full-text trim, applied once the stream ends.
+    """
+    self.trim_fn = trim_fn
+    self.text = ""
+    self._released = 0
+    self._scanned = 0
+
+  def feed(self, chunk: str) -> str:
+    """Adds a decoded chunk.
+
+    Args:
+      chunk (str): The new text.
+
+    Returns:
+      str: Text that is now safe to show (may be empty).
+    """
+    self.text += chunk
+    last = None
+    # Only the new part (plus the char before it, whose boundary may just have been confirmed) needs scanning.
+    for match in self._boundary.finditer(self.text, max(self._scanned - 1, self._released)):
+      last = match
+    self._scanned = len(self.text)
+    if last is None:
+      return ""
+    end = last.end()
+    released = self.text[self._released:end]
+    self._released = end
+    return released
+
+  @property
+  def released_text(self) -> str:
+    """Everything released so far."""
+    return self.text[:self._released]
+
+  def finish(self) -> str:
+    """Ends the stream and applies the full trim.
+
+    Returns:
+      str: The rest of the trimmed text that hasn't been released yet.
+    """
+    self.text = self.trim_fn(self.text)
+    tail = self.text[self._released:]
+    self._released = len(self.text)
+    return tail
+
+def iterate_in_thread(iterator_fn: Callable[[], Iterator], on_close: Optional[Callable[[], None]] = None) -> AsyncIterator:
+  """Runs a blocking iterator on a worker thread and exposes it as an async iterator.
+  If the consumer stops early, the blocking iterator is closed once it hands over its next item, and
+  closing the async iterator waits for that.
+
+  Args:
+    iterator_fn (Callable[[], Iterator]): Creates the blocking iterator (called on the worker thread).
+    on_close (Callable[[], None], optional): Called when the async iterator is done or closed, e.g. to
+      tell the blocking iterator to wrap up without waiting for its next item. Defaults to None.
+
+  Returns:
+    AsyncIterator: Yields the same items without blocking the event loop.
+  """
+  import asyncio
+  done = object()
+
+  async def _iterate():
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue()
+    stopped = threading.Event()
+
+    def _produce():
+      iterator = None
+      try:
+        iterator = iterator_fn()
+        for item in iterator:
+          if stopped.is_set():
+            break
+          loop.call_soon_threadsafe(items.put_nowait, (item, None))
+        else:
+          loop.call_soon_threadsafe(items.put_nowait, (done, None))
+      except BaseException as e:
+        if not stopped.is_set():
+          loop.call_soon_threadsafe(items.put_nowait, (done, e))
+      finally:
+        # If the consumer left early, this is what lets the iterator clean up (and stop generating).
+        close = getattr(iterator, "close", None)
+        if close is not None:
+          close()
+
+    thread = threading.Thread(target=_produce, name="StreamProducer", daemon=True)
+    thread.start()
+    try:
+      while True:
+        item, error = await items.get()
+        if item is done:
+          if error is not None:
+            raise error
+          return
+        yield item
+    finally:
+      stopped.set()
+      if on_close is not None:
+        on_close()
+      # The blocking iterator's own cleanup has to be over before the caller moves on.
+      await loop.run_in_executor(None, thread.join)
+
+  return _iterate()
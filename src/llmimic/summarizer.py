@@ -1,22 +1,59 @@
-import torch
-from transformers import AutoTokenizer, pipeline
+from typing import Optional
+from .inference_backend import InferenceBackend
+from .model_registry import ModelRegistry
 
 class Summarizer:
-    def __init__(self):
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.tokenizer = AutoTokenizer.from_pretrained("facebook/bart-large-cnn")
-        self.summarizer = pipeline("summarization", model="facebook/bart-large-cnn", device=self.device)
+    model_id = "facebook/bart-large-cnn"
 
-    def summarize_batch(self, dataset, batch_size: int):
-        """Summarizes a batch of data, oddly enough.
+    def __init__(self, tokenizer=None, backend: Optional[InferenceBackend] = None):
+        from transformers import AutoTokenizer
+        self.backend = backend if backend is not None else InferenceBackend()
+        self.device = self.backend.device
+        self.tokenizer = tokenizer if tokenizer is not None else AutoTokenizer.from_pretrained(self.model_id)
+        self.summarizer = self.backend.pipeline("summarization", self.model_id, "seq2seq-lm", tokenizer=self.tokenizer)
+
+    def summarize_texts(self, texts: list, min_length: int = 10, max_length: int = 130, batch_size: int = 8) -> list:
+        """Summarizes several texts in batched calls.
+        A text longer than the model's input is split into chunks, the chunks are summarized and
+        their summaries summarized again, so nothing past the input limit gets cut off.
 
         Args:
-            dataset (_type_): The dataset to summarize.
-            batch_size (int): The batch size.
+            texts (list): The texts to summarize.
+            min_length (int, optional): Minimum summary length in tokens. Defaults to 10.
+            max_length (int, optional): Maximum summary length in tokens. Defaults to 130.
+            batch_size (int, optional): Texts per forward batch. Defaults to 8.
 
         Returns:
-            _type_: The summarized data.
+            list: One summary per text.
         """
-        summaries = self.summarizer(dataset["content"], batch_size=batch_size, min_length=60, max_length=130)
-        return [{"index": data["index"], "summary_text": summary["summary_text"]}
-                for data, summary in zip(dataset, summaries)]
\ No newline at end of file
+        # model_max_length is a huge sentinel for tokenizers that don't set it, BART takes 1024 positions.
+        limit = min(self.tokenizer.model_max_length, 1024) - self.tokenizer.num_special_tokens_to_add()
+        chunked = []
+        for text in texts:
+            ids = self.tokenizer(text, add_special_tokens=False)["input_ids"]
+            if len(ids) <= limit:
+                chunked.append([text])
+            else:
+                chunked.append([self.tokenizer.decode(ids[i:i + limit]) for i in range(0, len(ids), limit)])
+
+        flat = [chunk for chunks in chunked for chunk in chunks]
+        outputs = self.summarizer(flat, min_length=min_length, max_length=max_length, truncation=True, batch_size=batch_size)
+        summaries = []
+        position = 0
+        for chunks in chunked:
+            parts = [output["summary_text"] for output in outputs[position:position + len(chunks)]]
+            position += len(chunks)
+            if len(parts) == 1:
+                summaries.append(parts[0])
+            else:
+                summaries.append(self.summarize_texts(["\n".join(parts)], min_length, max_length, batch_size)[0])
+        return summaries
+
+def register_summarizer_models(registry: ModelRegistry, backend: Optional[InferenceBackend] = None) -> None:
+    """Registers the summarizer (which loads its own tokenizer).
+
+    Args:
+        registry (ModelRegistry): The registry to register with.
+        backend (InferenceBackend, optional): How the summarizer runs. Defaults to None (plain torch).
+    """
+    registry.register("summarizer", lambda: Summarizer(backend=backend))
@@ -0,0 +1,338 @@
+import bisect
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+# Seconds. Roughly x2.5 apart, from 100us (tokenizing a short prompt) to 2min (a long generation on CPU).
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 25.0, 60.0, 120.0)
+
+def format_seconds(seconds: float) -> str:
+  if seconds < 1:
+    return f"{seconds * 1000:.1f}ms"
+  minutes, seconds = divmod(seconds, 60)
+  return f"{int(minutes)}m{seconds:.3f}s" if minutes else f"{seconds:.3f}s"
+
+class Span:
+  """One timed stage. Spans opened inside another one (on the same thread or task) become its children."""
+  __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "_start_counter", "_end_counter")
+
+  def __init__(self, name: str, parent: Optional["Span"] = None, attributes: Optional[dict] = None):
+    self.name = name
+    self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+    self.span_id = f"{random.getrandbits(64):016x}"
+    self.parent_id = parent.span_id if parent is not None else None
+    self.attributes = dict(attributes) if attributes else {}
+    self.start_ns = time.time_ns()
+    self.end_ns = None
+    self._start_counter = time.perf_counter_ns()
+    self._end_counter = None
+
+  def set_attribute(self, key: str, value) -> None:
+    self.attributes[key] = value
+
+  def elapsed(self) -> float:
+    """Seconds since the span started, or its duration once it has ended."""
+    end = self._end_counter if self._end_counter is not None else time.perf_counter_ns()
+    return (end - self._start_counter) / 1e9
+
+  def format_elapsed(self) -> str:
+    return format_seconds(self.elapsed())
+
+  def _end(self, end_counter: Optional[int] = None) -> None:
+    self._end_counter = end_counter if end_counter is not None else time.perf_counter_ns()
+    self.end_ns = self.start_ns + (self._end_counter - self._start_counter)
+
+class Histogram:
+  """Cumulative-bucket histogram of durations, Prometheus style, plus min/max for the extremes."""
+  def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+    self.buckets = tuple(buckets)
+    self.counts = [0] * (len(self.buckets) + 1)  # The last one is +Inf.
+    self.count = 0
+    self.sum = 0.0
+    self.min = None
+    self.max = None
+
+  def observe(self, value: float) -> None:
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.count += 1
+    self.sum += value
+    self.min = value if self.min is None else min(self.min, value)
+    self.max = value if self.max is None else max(self.max, value)
+
+  def quantile(self, q: float) -> float:
+    """Estimates a quantile by interpolating inside the bucket it falls in (clamped to min/max)."""
+    if not self.count:
+      return 0.0
+    rank = q * self.count
+    seen = 0
+    for i, count in enumerate(self.counts):
+      if seen + count >= rank and count:
+        lower = self.buckets[i - 1] if i > 0 else 0.0
+        upper = self.buckets[i] if i < len(self.buckets) else self.max
+        value = lower + (upper - lower) * (rank - seen) / count
+        return min(max(value, self.min), self.max)
+      seen += count
+    return self.max
+
+class Tracer:
+  """High-resolution, nestable spans with a latency histogram per span name.
+  `with tracer.span("llm.prefill"):` times a stage; spans opened inside it are its children (tracked
+  per thread and per asyncio task), so nested stages never overwrite each other. Every finished span
+  goes into its name's histogram and the most recent ones are kept for export. export() renders the
+  histograms as Prometheus text or everything as OpenTelemetry-style (OTLP) JSON; add_exporter()
+  registers a hook that's called with every finished span. A disabled tracer hands out spans that
+  aren't recorded.
+  """
+  def __init__(self, enabled: bool = True, max_spans: int = 2048, buckets: tuple = DEFAULT_BUCKETS,
+               service_name: str = "llmimic"):
+    """Init for Tracer.
+
+    Args:
+      enabled (bool, optional): Record spans at all. Defaults to True.
+      max_spans (int, optional): Finished spans kept for export. Defaults to 2048.
+      buckets (tuple, optional): Histogram bucket bounds in seconds. Defaults to DEFAULT_BUCKETS.
+      service_name (str, optional): Reported as service.name in OTLP exports. Defaults to "llmimic".
+    """
+    self.enabled = enabled
+    self.buckets = tuple(buckets)
+    self.service_name = service_name
+    self._spans = deque(maxlen=max_spans)
+    self._histograms = {}
+    self._exporters = []
+    self._lock = threading.Lock()
+    self._current = contextvars.ContextVar(f"llmimic_span_{id(self)}", default=None)
+
+  def configure(self, enabled: Optional[bool] = None, max_spans: Optional[int] = None) -> None:
+    with self._lock:
+      if enabled is not None:
+        self.enabled = enabled
+      if max_spans is not None and max_spans != self._spans.maxlen:
+        self._spans = deque(self._spans, maxlen=max_spans)
+
+  def current_span(self) -> Optional[Span]:
+    return self._current.get()
+
+  @contextmanager
+  def span(self, name: str, **attributes) -> Iterator[Span]:
+    """Times the block as a child of the current span.
+
+    Args:
+      name (str): The stage, dotted (e.g. "memory.ner"). Histograms are kept per name.
+      **attributes: Extra details for the exported span (batch sizes, token counts...).
+
+    Yields:
+      Span: The span, for attributes and elapsed().
+    """
+    parent = self._current.get()
+    span = Span(name, parent, attributes)
+    token = self._current.set(span)
+    try:
+      yield span
+    except BaseException as e:
+      span.set_attribute("error", type(e).__name__)
+      raise
+    finally:
+      self._current.reset(token)
+      span._end()
+      if self.enabled:
+        self._finish(span)
+
+  def traced(self, name: str) -> Callable:
+    """Decorator version of span()."""
+    def decorator(func):
+      @functools.wraps(func)
+      def wrapper(*args, **kwargs):
+        with self.span(name):
+          return func(*args, **kwargs)
+      return wrapper
+    return decorator
+
+  def record(self, name: str, start_counter: int, end_counter: int, parent: Optional[Span] = None, **attributes) -> None:
+    """Records a stage that was timed elsewhere (e.g. from a generation callback) as a finished span.
+
+    Args:
+      name (str): The stage.
+      start_counter (int): time.perf_counter_ns() at the start.
+      end_counter (int): time.perf_counter_ns() at the end.
+      parent (Span, optional): Its parent. Defaults to the current span.
+      **attributes: Extra details for the exported span.
+    """
+    if not self.enabled:
+      return
+    span = Span(name, parent if parent is not None else self._current.get(), attributes)
+    span.start_ns -= span._start_counter - start_counter
+    span._start_counter = start_counter
+    span._end(end_counter)
+    self._finish(span)
+
+  def _finish(self, span: Span) -> None:
+    with self._lock:
+      histogram = self._histograms.get(span.name)
+      if histogram is None:
+        histogram = self._histograms[span.name] = Histogram(self.buckets)
+      histogram.observe(span.elapsed())
+      self._spans.append(span)
+      exporters = list(self._exporters)
+    for exporter in exporters:
+      try:
+        exporter(span)
+      except Exception:
+        pass  # A broken hook mustn't take the traced code down with it.
+
+  def add_exporter(self, exporter: Callable[[Span], None]) -> None:
+    """Registers a hook that's called with every finished span (e.g. to forward it to an OTel SDK)."""
+    with self._lock:
+      self._exporters.append(exporter)
+
+  def remove_exporter(self, exporter: Callable[[Span], None]) -> None:
+    with self._lock:
+      if exporter in self._exporters:
+        self._exporters.remove(exporter)
+
+  def summary(self) -> dict:
+    """Latency percentiles per span name.
+
+    Returns:
+      dict: {name: {"count", "mean", "p50", "p95", "p99", "max"}}, in seconds.
+    """
+    with self._lock:
+      return {
+        name: {
+          "count": histogram.count,
+          "mean": histogram.sum / histogram.count,
+          "p50": histogram.quantile(0.5),
+          "p95": histogram.quantile(0.95),
+          "p99": histogram.quantile(0.99),
+          "max": histogram.max,
+        }
+        for name, histogram in sorted(self._histograms.items())
+      }
+
+  def reset(self) -> None:
+    """Drops every histogram and kept span."""
+    with self._lock:
+      self._histograms.clear()
+      self._spans.clear()
+
+  @staticmethod
+  def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+  def _prometheus(self) -> str:
+    metric = "llmimic_span_duration_seconds"
+    lines = [f"# HELP {metric} Duration of traced stages.", f"# TYPE {metric} histogram"]
+    with self._lock:
+      for name, histogram in sorted(self._histograms.items()):
+        label = f"span=\"{self._label(name)}\""
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), histogram.counts):
+          cumulative += count
+          le = "+Inf" if bound == float("inf") else repr(bound)
+          lines.append(f"{metric}_bucket{{{label},le=\"{le}\"}} {cumulative}")
+        lines.append(f"{metric}_sum{{{label}}} {histogram.sum!r}")
+        lines.append(f"{metric}_count{{{label}}} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+  @staticmethod
+  def _otel_value(value) -> dict:
+    if isinstance(value, bool):
+      return {"boolValue": value}
+    if isinstance(value, int):
+      return {"intValue": str(value)}
+    if isinstance(value, float):
+      return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+  def _otel(self) -> dict:
+    now = time.time_ns()
+    with self._lock:
+      spans = list(self._spans)
+      histograms = sorted(self._histograms.items())
+    resource = {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]}
+    scope = {"name": "llmimic.tracing"}
+    otel_spans = []
+    for span in spans:
+      entry = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": self._otel_value(value)} for key, value in span.attributes.items()],
+      }
+      if span.parent_id is not None:
+        entry["parentSpanId"] = span.parent_id
+      otel_spans.append(entry)
+    data_points = [{
+      "attributes": [{"key": "span", "value": {"stringValue": name}}],
+      "timeUnixNano": str(now),
+      "count": str(histogram.count),
+      "sum": histogram.sum,
+      "min": histogram.min,
+      "max": histogram.max,
+      "bucketCounts": [str(count) for count in histogram.counts],
+      "explicitBounds": list(self.buckets),
+    } for name, histogram in histograms]
+    return {
+      "resourceSpans": [{"resource": resource, "scopeSpans": [{"scope": scope, "spans": otel_spans}]}],
+      "resourceMetrics": [{"resource": resource, "scopeMetrics": [{"scope": scope, "metrics": [{
+        "name": "llmimic.span.duration",
+        "unit": "s",
+        "histogram": {"dataPoints": data_points, "aggregationTemporality": 2},
+      }]}]}],
+    }
+
+  def export(self, format: str = "prometheus") -> str:
+    """Renders what's been recorded.
+
+    Args:
+      format (str, optional): "prometheus" (histograms, text exposition format) or "otel"
+        (kept spans and histograms, OTLP JSON). Defaults to "prometheus".
+
+    Raises:
+      ValueError: Unknown format.
+
+    Returns:
+      str: The export.
+    """
+    if format == "prometheus":
+      return self._prometheus()
+    if format == "otel":
+      return json.dumps(self._otel())
+    raise ValueError(f"Unknown export format: {format}. Must be 'prometheus' or 'otel'.")
+
+  def write(self, path: str, format: str = "prometheus") -> None:
+    """Writes export(format) to a file, atomically (e.g. for a node_exporter textfile collector)."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+      file.write(self.export(format))
+    os.replace(tmp_path, path)
+
+_shared_tracer = None
+_shared_tracer_lock = threading.Lock()
+
+def get_shared_tracer() -> Tracer:
+  """Returns the process-wide tracer every stage reports to.
+
+  Returns:
+    Tracer: The shared tracer.
+  """
+  global _shared_tracer
+  with _shared_tracer_lock:
+    if _shared_tracer is None:
+      _shared_tracer = Tracer()
+    return _shared_tracer
+
+def span(name: str, **attributes):
+  """Shorthand for get_shared_tracer().span(name, **attributes)."""
+  return get_shared_tracer().span(name, **attributes)
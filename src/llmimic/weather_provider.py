@@ -0,0 +1,216 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Optional, Union
+import requests
+from requests.adapters import HTTPAdapter
+from . import logger
+
+class WeatherProvider:
+  """Current weather from OpenWeatherMap, cached and shared between sessions.
+  Lookups are keyed by coordinates rounded to `precision` decimals (2 is about a kilometre), and go
+  over one pooled requests.Session with explicit timeouts. A cached entry is fresh for `ttl` seconds;
+  after that it's still served right away while a background refresh fetches a new one
+  (stale-while-revalidate), up until it's `max_stale` seconds old. Concurrent lookups for the same
+  location share one in-flight request. If cache_path is set, the cache survives restarts.
+  """
+  base_url = "https://api.openweathermap.org/data/2.5/weather"
+  default_result = {
+    "weather_main": "N/A",
+    "description": "N/A",
+    "temperature": "N/A",
+    "feels_like": "N/A",
+    "wind_speed": "N/A",
+    "city": "N/A",
+    "country": "N/A"
+  }
+
+  def __init__(self, ttl: float = 600, max_stale: Optional[float] = 21600, timeout: Union[float, tuple] = (3.05, 10),
+               cache_path: Optional[str] = None, precision: int = 2, pool_size: int = 10):
+    """Init for WeatherProvider.
+
+    Args:
+      ttl (float, optional): Seconds an entry counts as fresh. Defaults to 600.
+      max_stale (float, optional): Seconds after which an entry is too old to serve at all. Defaults to 21600 (None: no limit).
+      timeout (float | tuple, optional): requests timeout, or (connect, read). Defaults to (3.05, 10).
+      cache_path (str, optional): JSON file to persist the cache in. Defaults to None (memory only).
+      precision (int, optional): Decimals the coordinates are rounded to. Defaults to 2.
+      pool_size (int, optional): Max pooled connections. Defaults to 10.
+    """
+    self.ttl = ttl
+    self.max_stale = max_stale
+    self.timeout = timeout
+    self.cache_path = cache_path
+    self.precision = precision
+    self.session = requests.Session()
+    self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+    self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+    self._entries = {}
+    self._inflight = {}
+    self._lock = threading.Lock()
+    self._save_lock = threading.Lock()
+    self._stats = {"fresh": 0, "stale": 0, "miss": 0, "fetched": 0, "failed": 0}
+    if cache_path:
+      self._load()
+
+  def _key(self, lat: float, lon: float) -> tuple:
+    return (round(float(lat), self.precision), round(float(lon), self.precision))
+
+  def _load(self) -> None:
+    """Reads the persisted cache, if there is one."""
+    if not os.path.exists(self.cache_path):
+      return
+    try:
+      with open(self.cache_path, "r") as file:
+        data = json.load(file)
+      for key, entry in data.items():
+        lat, lon = key.split(",")
+        self._entries[(float(lat), float(lon))] = (entry["fetched_at"], entry["data"])
+      logger.debug(f"Loaded {len(self._entries)} cached weather entries from {self.cache_path}.")
+    except (OSError, ValueError, KeyError, TypeError) as e:
+      logger.warning(f"Ignoring unreadable weather cache {self.cache_path}: {e}")
+
+  def _save(self) -> None:
+    """Writes the cache to cache_path (atomically, so a crash never leaves half a file)."""
+    if not self.cache_path:
+      return
+    with self._lock:
+      data = {f"{lat},{lon}": {"fetched_at": fetched_at, "data": entry}
+              for (lat, lon), (fetched_at, entry) in self._entries.items()}
+    with self._save_lock:
+      try:
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        temp_path = f"{self.cache_path}.tmp"
+        with open(temp_path, "w") as file:
+          json.dump(data, file)
+        os.replace(temp_path, self.cache_path)
+      except OSError as e:
+        logger.warning(f"Failed to persist the weather cache: {e}")
+
+  def _fetch(self, api_key: str, lat: float, lon: float) -> Optional[dict]:
+    """Requests the current weather.
+
+    Args:
+      api_key (str): Your OpenWeatherAPI API key.
+      lat (float): The latitude.
+      lon (float): The longitude.
+
+    Returns:
+      dict: The weather data, or None if the request failed.
+    """
+    params = {
+    "lat": lat,
+    "lon": lon,
+    "appid": api_key,
+    "units": "imperial"
+    }
+    try:
+      response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+      response.raise_for_status()
+      data = response.json()
+    except (requests.RequestException, ValueError) as e:
+      # The exception text contains the URL, api key included, so it stays out of the log.
+      status = getattr(getattr(e, "response", None), "status_code", None)
+      logger.warning(f"Weather request failed: {type(e).__name__}" + (f" (HTTP {status})." if status else "."))
+      return None
+
+    if "weather" not in data or "main" not in data or "sys" not in data:
+      return None
+
+    weather = data.get("weather", [{}])[0]
+    main = data.get("main", {})
+    wind = data.get("wind", {})
+
+    return {
+    "weather_main": weather.get("main", "N/A").lower(),
+    "description": weather.get("description", "N/A").lower(),
+    "temperature": main.get("temp", "N/A"),
+    "feels_like": main.get("feels_like", "N/A"),
+    "wind_speed": wind.get("speed", "N/A"),
+    "city": data.get("name", "N/A"),
+    "country": data.get("sys", {}).get("country", "N/A")
+    }
+
+  def _refresh(self, api_key: str, key: tuple, future: Future) -> None:
+    """Fetches one location and resolves everyone waiting on it."""
+    result = None
+    try:
+      result = self._fetch(api_key, *key)
+    finally:
+      with self._lock:
+        self._stats["fetched" if result is not None else "failed"] += 1
+        if result is not None:
+          self._entries[key] = (time.time(), result)
+        del self._inflight[key]
+      future.set_result(result)
+    if result is not None:
+      self._save()
+
+  def get(self, api_key: str, lat: float, lon: float) -> dict:
+    """Returns the current weather at a location.
+    Never touches the network while a usable cached entry exists.
+
+    Args:
+      api_key (str): Your OpenWeatherAPI API key.
+      lat (float): The latitude to get the weather data from.
+      lon (float): The longitude to get the weather data from.
+
+    Returns:
+      dict: The weather data for the chosen location (on success, N/A otherwise).
+    """
+    key = self._key(lat, lon)
+    now = time.time()
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None and self.max_stale is not None and now - entry[0] > self.max_stale:
+        entry = None
+      if entry is not None and now - entry[0] <= self.ttl:
+        self._stats["fresh"] += 1
+        return dict(entry[1])
+      self._stats["stale" if entry is not None else "miss"] += 1
+      future = self._inflight.get(key)
+      owner = future is None
+      if owner:
+        future = Future()
+        self._inflight[key] = future
+
+    if entry is not None:
+      if owner:
+        threading.Thread(target=self._refresh, args=(api_key, key, future), name="WeatherRefresh", daemon=True).start()
+      return dict(entry[1])
+    if owner:
+      self._refresh(api_key, key, future)
+    result = future.result()
+    return dict(result if result is not None else self.default_result)
+
+  def stats(self) -> dict:
+    """Cache counters.
+
+    Returns:
+      dict: fresh/stale hits, misses, and fetched/failed requests.
+    """
+    with self._lock:
+      return dict(self._stats)
+
+  def close(self) -> None:
+    self.session.close()
+
+_shared_provider = None
+_shared_provider_lock = threading.Lock()
+
+def get_shared_weather_provider(**options) -> WeatherProvider:
+  """Returns the process-wide weather provider, so every session shares its cache and connections.
+
+  Args:
+    **options: WeatherProvider arguments, only used when the provider is first created.
+
+  Returns:
+    WeatherProvider: The shared provider.
+  """
+  global _shared_provider
+  with _shared_provider_lock:
+    if _shared_provider is None:
+      _shared_provider = WeatherProvider(**options)
+    return _shared_provider
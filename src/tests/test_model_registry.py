@@ -0,0 +1,19 @@
+"""Tests for ModelRegistry's idle eviction. Run from src/ with `python -m pytest tests`."""
+import time
+from llmimic.model_registry import ModelRegistry
+
+def test_idle_eviction_skips_held_models():
+  registry = ModelRegistry()
+  registry.register("held", object)
+  registry.register("idle", object)
+  held = registry.acquire("held")
+  registry.get("idle")
+  registry.idle_timeout = 0.01
+  time.sleep(0.05)
+  assert registry.evict_idle() == ["idle"]
+  assert registry.get("held") is held
+
+  registry.release("held")
+  assert not registry.is_held("held")
+  time.sleep(0.05)
+  assert registry.evict_idle() == ["held"]
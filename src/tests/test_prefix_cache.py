@@ -0,0 +1,25 @@
+"""Regression tests for PrefixCachedGenerator. Run from src/ with `python -m pytest tests`."""
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+from llmimic.prefix_cache import PrefixCachedGenerator
+
+def tiny_llama() -> LlamaForCausalLM:
+  torch.manual_seed(0)
+  return LlamaForCausalLM(LlamaConfig(
+    vocab_size=64, hidden_size=32, intermediate_size=64, num_hidden_layers=2, num_attention_heads=4,
+    num_key_value_heads=2, max_position_embeddings=256, pad_token_id=0, eos_token_id=1)).eval()
+
+def test_alternating_beam_counts_match_uncached_generation():
+  model = tiny_llama()
+  generator = PrefixCachedGenerator(model, tokenizer=None)
+  prompt = list(range(2, 20))
+  for turn, beams in enumerate([1, 3, 1, 3, 3]):
+    kwargs = dict(max_new_tokens=4, min_new_tokens=4, do_sample=False, num_beams=beams)
+    new_ids = generator.generate_ids(prompt, **kwargs)
+    expected = model.generate(input_ids=torch.tensor([prompt]), attention_mask=torch.ones(1, len(prompt), dtype=torch.long),
+                              **kwargs)[0, len(prompt):].tolist()
+    assert new_ids == expected
+    if turn > 0:
+      # Beam turns keep the prompt cached, so the next turn reuses it instead of starting over.
+      assert generator.last_reused_tokens > 0
+    prompt = prompt + new_ids + [5, 6, 7]